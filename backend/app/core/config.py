@@ -14,6 +14,17 @@ class Settings(BaseSettings):
     ENVIRONMENT: str = Field(default="development", env="ENVIRONMENT")
     DEBUG: bool = Field(default=True, env="DEBUG")
     BACKEND_URL: str = 'https://payla.ng'
+    # Share of sub-400 requests written to the access log (errors/slow requests always are)
+    ACCESS_LOG_SAMPLE_RATE: float = Field(default=0.1, env="ACCESS_LOG_SAMPLE_RATE")
+    ACCESS_LOG_SLOW_MS: float = Field(default=1000.0, env="ACCESS_LOG_SLOW_MS")
+    # Firestore read budgets (documents) and latency thresholds; exceeding them logs a warning
+    FIRESTORE_QUERY_READ_BUDGET: int = Field(default=500, env="FIRESTORE_QUERY_READ_BUDGET")
+    FIRESTORE_SLOW_QUERY_MS: float = Field(default=1000.0, env="FIRESTORE_SLOW_QUERY_MS")
+    FIRESTORE_REQUEST_READ_BUDGET: int = Field(default=1000, env="FIRESTORE_REQUEST_READ_BUDGET")
+    FIRESTORE_SLOW_REQUEST_MS: float = Field(default=2000.0, env="FIRESTORE_SLOW_REQUEST_MS")
+    FIRESTORE_JOB_READ_BUDGET: int = Field(default=20000, env="FIRESTORE_JOB_READ_BUDGET")
+    # Add X-Firestore-Reads/Writes headers to every response (local profiling only)
+    FIRESTORE_USAGE_HEADERS: bool = Field(default=False, env="FIRESTORE_USAGE_HEADERS")
 
     # ────────────────────────────────
     # 2. FRONTEND
@@ -23,6 +34,8 @@ class Settings(BaseSettings):
         env="FRONTEND_URL",
         description="Base URL for client app (e.g. https://payla.ng)"
     )
+    # Embed the resolved paylink payload in /@username pages (saves the first API call)
+    PAYLINK_EMBED_DATA: bool = Field(default=True, env="PAYLINK_EMBED_DATA")
 
     # ────────────────────────────────
     # 3. FIREBASE / FIRESTORE
@@ -81,6 +94,8 @@ class Settings(BaseSettings):
     SECRET_KEY: str = Field(default="change-me-in-production", env="SECRET_KEY")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 1 week
+    # Bearer token required by /metrics; the endpoint is disabled (404) while unset
+    METRICS_TOKEN: Optional[str] = Field(default=None, env="METRICS_TOKEN")
 
     # ────────────────────────────────
     # 9. EMAIL (Gmail)
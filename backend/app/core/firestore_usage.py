@@ -0,0 +1,80 @@
+# app/core/firestore_usage.py
+"""
+Per-request and per-job Firestore document accounting.
+
+The request middleware and background loop runs open an `accounting()`
+scope; the SDK hooks in app/core/instrumentation.py add every document read
+and written to whichever scope is current. The scope lives in a ContextVar,
+so work handed to `asyncio.to_thread` / `firestore_run` is still attributed
+to the request or job that started it.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger("payla")
+
+
+class FirestoreUsage:
+    __slots__ = ("reads", "writes", "by_collection", "_lock")
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.by_collection: Dict[str, List[int]] = {}  # collection -> [reads, writes]
+        self._lock = threading.Lock()
+
+    def add(self, collection: str, reads: int = 0, writes: int = 0) -> None:
+        with self._lock:
+            self.reads += reads
+            self.writes += writes
+            counts = self.by_collection.setdefault(collection, [0, 0])
+            counts[0] += reads
+            counts[1] += writes
+
+    def summary(self, top: int = 5) -> str:
+        """Heaviest collections first, e.g. `users=1000r invoices=200r/3w`."""
+        with self._lock:
+            items = sorted(self.by_collection.items(), key=lambda item: -(item[1][0] + item[1][1]))
+        parts = []
+        for collection, (reads, writes) in items[:top]:
+            counts = "/".join(part for part in (f"{reads}r" if reads else "", f"{writes}w" if writes else "") if part)
+            parts.append(f"{collection}={counts}")
+        return " ".join(parts) or "none"
+
+
+_current: ContextVar[Optional[FirestoreUsage]] = ContextVar("firestore_usage", default=None)
+
+
+@contextmanager
+def accounting() -> Iterator[FirestoreUsage]:
+    """Attribute Firestore reads/writes made inside this block (and its threads) to one usage record."""
+    usage = FirestoreUsage()
+    token = _current.set(usage)
+    try:
+        yield usage
+    finally:
+        _current.reset(token)
+
+
+def record(collection: str, reads: int = 0, writes: int = 0) -> None:
+    usage = _current.get()
+    if usage is not None:
+        usage.add(collection, reads, writes)
+
+
+def check_budget(label: str, usage: FirestoreUsage, duration_ms: float,
+                 read_budget: int, slow_ms: Optional[float] = None) -> bool:
+    """Log a warning if a request or job read more than its budget or ran too long."""
+    over_reads = usage.reads > read_budget
+    too_slow = slow_ms is not None and duration_ms > slow_ms
+    if not (over_reads or too_slow):
+        return False
+    logger.warning(
+        f"🔥 Over budget: {label} | reads={usage.reads} (budget {read_budget}) "
+        f"writes={usage.writes} | {duration_ms:.0f}ms | {usage.summary()}"
+    )
+    return True
@@ -0,0 +1,342 @@
+# app/core/instrumentation.py
+"""
+Low-overhead hooks that feed app/core/metrics.py.
+
+Firestore and outbound HTTP calls are spread across every router and task,
+so rather than wrapping each call site the hooks patch the few SDK methods
+everything funnels through, once at startup:
+
+* Firestore: DocumentReference get/set/update/create/delete, Query.stream
+  (which Query.get and CollectionReference.get/stream use), Client.get_all
+  and the batch/bulk/transaction commits, timed by collection and operation.
+  Documents read and written are counted into the current request/job
+  (app/core/firestore_usage.py), and single calls that are slow or read more
+  than FIRESTORE_QUERY_READ_BUDGET documents are logged with their filters.
+* HTTP: httpx.AsyncClient.send and requests.Session.send, timed by provider
+  (resolved from the host) and outcome.
+
+The Firestore hooks read SDK internals (`_write_pbs`, `Transaction._commit`,
+`_path`, `_parent`, `_field_filters`, `_orders`, `_limit`), so
+instrument_firestore() checks they are still there before patching and
+refuses to start on an SDK that has moved them.
+"""
+
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlsplit
+
+from app.core import firestore_usage
+from app.core.config import settings
+from app.core.metrics import (
+    external_call_duration,
+    firestore_documents,
+    firestore_operation_duration,
+    firestore_operation_errors,
+)
+
+logger = logging.getLogger("payla")
+
+# google-cloud-firestore release the hooks were written against (requirements.txt)
+FIRESTORE_SDK_VERSION = "2.22.0"
+
+PROVIDER_HOSTS = {
+    "paystack.co": "paystack",
+    "facebook.com": "meta",
+    "termii.com": "termii",
+    "resend.com": "resend",
+    "cloudinary.com": "cloudinary",
+}
+
+_local = threading.local()
+
+
+# ---------------------------------------------------------------
+# Firestore
+# ---------------------------------------------------------------
+
+def _finish(collection: str, op: str, started: float, failed: bool,
+            reads: int = 0, writes: Optional[Dict[str, int]] = None, describe=None) -> None:
+    """Record one SDK call: latency, document counts, and a warning if it was slow or read too much."""
+    seconds = time.perf_counter() - started
+    labels = (collection, op)
+    firestore_operation_duration.observe(labels, seconds)
+    if failed:
+        firestore_operation_errors.inc(labels)
+        return
+
+    if reads:
+        firestore_documents.inc((collection, "read"), reads)
+        firestore_usage.record(collection, reads=reads)
+    for name, count in (writes or {}).items():
+        firestore_documents.inc((name, "write"), count)
+        firestore_usage.record(name, writes=count)
+
+    duration_ms = seconds * 1000
+    if reads > settings.FIRESTORE_QUERY_READ_BUDGET or duration_ms > settings.FIRESTORE_SLOW_QUERY_MS:
+        detail = describe() if describe is not None else ""
+        logger.warning(
+            f"🐢 Firestore {op} on {collection}: {reads} reads in {duration_ms:.0f}ms"
+            + (f" | {detail}" if detail else "")
+        )
+
+
+def _collection_of_path(path: str) -> str:
+    # "projects/p/databases/d/documents/users/uid" -> "users"
+    parts = path.split("/documents/", 1)[-1].split("/")
+    return parts[-2] if len(parts) >= 2 else "unknown"
+
+
+def _label_for(collections: Iterable[str]) -> str:
+    names = set(collections)
+    if not names:
+        return "none"
+    return names.pop() if len(names) == 1 else "mixed"
+
+
+def _write_counts(write_pbs) -> Dict[str, int]:
+    return dict(Counter(
+        _collection_of_path(pb.update.name or pb.delete or pb.transform.document)
+        for pb in write_pbs
+    ))
+
+
+def _describe_query(query) -> str:
+    parts = [" ".join(str(field_filter).split()) for field_filter in query._field_filters]
+    if query._orders:
+        parts.append("order_by " + ", ".join(order.field.field_path for order in query._orders))
+    if query._limit:
+        parts.append(f"limit {query._limit}")
+    return "; ".join(parts) or "no filters"
+
+
+def _timed_call(fn, plan):
+    """
+    Wrap a blocking SDK method. `plan(self)` returns (collection, op, reads,
+    writes_by_collection) and is evaluated before the call, since commits
+    clear their pending writes. Calls made from inside another timed call
+    (set() commits a batch internally) are not recorded twice.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if getattr(_local, "active", False):
+            return fn(self, *args, **kwargs)
+        collection, op, reads, writes = plan(self)
+        started = time.perf_counter()
+        _local.active = True
+        failed = True
+        try:
+            result = fn(self, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            _local.active = False
+            _finish(collection, op, started, failed, reads, writes)
+
+    return wrapper
+
+
+def _timed_iter(iterator, collection: str, op: str, started: float, min_reads: int, describe):
+    failed = True
+    count = 0
+    try:
+        for item in iterator:
+            count += 1
+            yield item
+        failed = False
+    finally:
+        _finish(collection, op, started, failed, max(count, min_reads), describe=describe)
+
+
+def _timed_stream(fn, label, min_reads: int = 0, describe=None):
+    """
+    Wrap a generator-returning SDK method; timed from the call until the
+    results are exhausted, counting one read per document yielded.
+    """
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if getattr(_local, "active", False) or kwargs.get("explain_options") is not None:
+            # Nested, or the caller needs the StreamGenerator's explain metrics
+            return fn(self, *args, **kwargs)
+        collection, op = label(self, *args)
+        started = time.perf_counter()
+        try:
+            iterator = fn(self, *args, **kwargs)
+        except Exception:
+            _finish(collection, op, started, True)
+            raise
+        return _timed_iter(
+            iterator, collection, op, started, min_reads,
+            (lambda: describe(self)) if describe is not None else None,
+        )
+
+    return wrapper
+
+
+def _patch(cls, name: str, wrapper) -> None:
+    original = getattr(cls, name)
+    if getattr(original, "__payla_instrumented__", False):
+        return
+    patched = wrapper(original)
+    patched.__payla_instrumented__ = True
+    setattr(cls, name, patched)
+
+
+def _check_firestore_internals() -> None:
+    """
+    Fail startup if the SDK no longer has the private attributes the hooks
+    read; otherwise every patched call would raise once traffic arrives.
+    Objects are built locally, nothing is sent to Firestore.
+    """
+    from google.cloud import firestore_v1
+    from google.cloud.firestore_v1.base_query import FieldFilter
+    from google.cloud.firestore_v1.transaction import Transaction
+
+    from app.core.firebase import db
+
+    version = getattr(firestore_v1, "__version__", "unknown")
+    if version != FIRESTORE_SDK_VERSION:
+        logger.warning(
+            f"⚠️ google-cloud-firestore {version} installed; instrumentation targets "
+            f"{FIRESTORE_SDK_VERSION}. Checking SDK internals"
+        )
+
+    document = db.collection("_instrumentation").document("check")
+    query = (
+        db.collection("_instrumentation")
+        .where(filter=FieldFilter("field", "==", 1))
+        .order_by("field")
+        .limit(1)
+    )
+    expected = {
+        "WriteBatch._write_pbs": lambda: db.batch()._write_pbs,
+        "Transaction._commit": lambda: Transaction._commit,
+        "DocumentReference._path": lambda: document._path[-2],
+        "Query._parent": lambda: query._parent.id,
+        "Query._field_filters": lambda: query._field_filters,
+        "Query._orders": lambda: query._orders[0].field.field_path,
+        "Query._limit": lambda: query._limit,
+    }
+    missing = []
+    for name, probe in expected.items():
+        try:
+            probe()
+        except (AttributeError, IndexError, TypeError):
+            missing.append(name)
+
+    if missing:
+        raise RuntimeError(
+            f"google-cloud-firestore {version} is incompatible with app/core/instrumentation.py "
+            f"(missing {', '.join(missing)}); update the hooks or pin "
+            f"google-cloud-firestore=={FIRESTORE_SDK_VERSION}"
+        )
+
+
+def instrument_firestore() -> None:
+    _check_firestore_internals()
+
+    from google.cloud.firestore_v1.batch import WriteBatch
+    from google.cloud.firestore_v1.bulk_batch import BulkWriteBatch
+    from google.cloud.firestore_v1.client import Client
+    from google.cloud.firestore_v1.document import DocumentReference
+    from google.cloud.firestore_v1.query import Query
+    from google.cloud.firestore_v1.transaction import Transaction
+
+    _patch(DocumentReference, "get", lambda fn: _timed_call(fn, lambda ref: (ref._path[-2], "get", 1, None)))
+    for op in ("set", "update", "create", "delete"):
+        _patch(DocumentReference, op, lambda fn, op=op: _timed_call(
+            fn, lambda ref: (ref._path[-2], op, 0, {ref._path[-2]: 1})
+        ))
+
+    # An empty query result is still billed as one read
+    _patch(Query, "stream", lambda fn: _timed_stream(
+        fn, lambda query, *_: (query._parent.id, "query"), min_reads=1, describe=_describe_query
+    ))
+
+    def get_all_wrapper(fn):
+        timed = _timed_stream(fn, lambda client, references, *_: (
+            _label_for(ref._path[-2] for ref in references), "get_all"
+        ))
+
+        @functools.wraps(fn)
+        def wrapper(self, references, *args, **kwargs):
+            # Materialize so the collection label can be read without consuming the caller's iterator
+            return timed(self, list(references), *args, **kwargs)
+
+        return wrapper
+
+    _patch(Client, "get_all", get_all_wrapper)
+
+    def commit_plan(op):
+        def plan(batch):
+            writes = _write_counts(batch._write_pbs)
+            return _label_for(writes), op, 0, writes
+        return plan
+
+    _patch(WriteBatch, "commit", lambda fn: _timed_call(fn, commit_plan("batch_commit")))
+    _patch(BulkWriteBatch, "commit", lambda fn: _timed_call(fn, commit_plan("bulk_commit")))
+    _patch(Transaction, "_commit", lambda fn: _timed_call(fn, commit_plan("transaction_commit")))
+
+    logger.info("📈 Firestore instrumentation enabled")
+
+
+# ---------------------------------------------------------------
+# Outbound HTTP
+# ---------------------------------------------------------------
+
+def provider_for(url) -> Optional[str]:
+    host = (urlsplit(str(url)).hostname or "").lower()
+    for suffix, provider in PROVIDER_HOSTS.items():
+        if host == suffix or host.endswith("." + suffix):
+            return provider
+    return None
+
+
+def _outcome(status_code: int) -> str:
+    return f"{status_code // 100}xx"
+
+
+def instrument_http_clients() -> None:
+    import httpx
+    import requests
+
+    def async_send(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, request, *args, **kwargs):
+            provider = provider_for(request.url)
+            if provider is None:
+                return await fn(self, request, *args, **kwargs)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                response = await fn(self, request, *args, **kwargs)
+                outcome = _outcome(response.status_code)
+                return response
+            finally:
+                external_call_duration.observe((provider, outcome), time.perf_counter() - started)
+        return wrapper
+
+    def sync_send(fn):
+        @functools.wraps(fn)
+        def wrapper(self, request, *args, **kwargs):
+            provider = provider_for(request.url)
+            if provider is None:
+                return fn(self, request, *args, **kwargs)
+            started = time.perf_counter()
+            outcome = "error"
+            try:
+                response = fn(self, request, *args, **kwargs)
+                outcome = _outcome(response.status_code)
+                return response
+            finally:
+                external_call_duration.observe((provider, outcome), time.perf_counter() - started)
+        return wrapper
+
+    _patch(httpx.AsyncClient, "send", async_send)
+    _patch(requests.Session, "send", sync_send)
+    logger.info("📈 Outbound HTTP instrumentation enabled")
@@ -0,0 +1,133 @@
+# app/core/log_pipeline.py
+"""
+Non-blocking logging pipeline.
+
+Loggers only enqueue records (QueueHandler); a QueueListener thread does the
+formatting and stdout writes, so log I/O never runs on the event loop.
+Application logs keep the plain text format; access logs are single-line
+JSON on the `payla.access` logger, sampled for successful traffic and always
+written for errors and slow requests.
+"""
+
+import copy
+import json
+import logging
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from fastapi import Request
+
+ACCESS_LOGGER = "payla.access"
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | %(message)s"
+
+access_logger = logging.getLogger(ACCESS_LOGGER)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from `extra={"fields": {...}}`."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _QueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Resolve msg % args in the caller (args may change later) but keep
+        # the traceback in exc_text rather than merging it into the message.
+        record = copy.copy(record)
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def configure_logging(level: str) -> QueueListener:
+    """
+    Route the app and uvicorn loggers through one queue and start the
+    listener thread that writes them out. Returns the listener so shutdown
+    can stop (and flush) it.
+    """
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    console.addFilter(lambda record: record.name != ACCESS_LOGGER)
+
+    access = logging.StreamHandler()
+    access.setFormatter(JsonFormatter())
+    access.addFilter(lambda record: record.name == ACCESS_LOGGER)
+
+    queue_handler = _QueueHandler(log_queue)
+    loggers = {
+        "uvicorn": level,
+        "uvicorn.error": level,
+        # Superseded by the sampled JSON access log below
+        "uvicorn.access": "WARNING",
+        "payla": level,
+    }
+    for name, logger_level in loggers.items():
+        logger = logging.getLogger(name)
+        logger.handlers[:] = [queue_handler]
+        logger.setLevel(logger_level)
+    logging.getLogger("payla").propagate = False
+    access_logger.setLevel(logging.INFO)
+
+    listener = QueueListener(log_queue, console, access, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class AccessLog:
+    """
+    Sampled access logging. Responses below 400 are logged with probability
+    `sample_rate`; 4xx/5xx, unhandled exceptions and requests slower than
+    `slow_ms` are always logged. Each line carries the sample rate so
+    counts can be re-weighted downstream.
+    """
+
+    def __init__(self, sample_rate: float = 1.0, slow_ms: float = 1000.0):
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.slow_ms = slow_ms
+
+    def record(self, request: Request, status_code: int, started: float, exc_info: Optional[bool] = None) -> None:
+        duration_ms = (time.perf_counter() - started) * 1000
+        always = status_code >= 400 or exc_info or duration_ms >= self.slow_ms
+        if not always and random.random() >= self.sample_rate:
+            return
+
+        if status_code >= 500:
+            level = logging.ERROR
+        elif status_code >= 400:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+
+        access_logger.log(
+            level,
+            "request",
+            exc_info=exc_info,
+            extra={"fields": {
+                "method": request.method,
+                "path": request.url.path,
+                "status": status_code,
+                "duration_ms": round(duration_ms, 1),
+                "client": request.client.host if request.client else None,
+                "sample_rate": 1.0 if always else self.sample_rate,
+            }},
+        )
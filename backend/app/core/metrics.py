@@ -0,0 +1,241 @@
+# app/core/metrics.py
+"""
+In-process metrics with Prometheus text exposition (served at /metrics).
+
+Counters, gauges and histograms keep plain dicts keyed by label values, so
+recording a sample is a bisect and a couple of dict operations. Each metric
+has its own lock because Firestore SDK calls report from worker threads.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from app.core import firestore_usage
+from app.core.config import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+RUN_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0)
+
+Labels = Tuple[str, ...]
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _labels(self, values: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(f'{extra[0]}="{extra[1]}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def lines(self) -> Iterator[str]:
+        raise NotImplementedError
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        yield from self.lines()
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+
+class Gauge(_Metric):
+    """Set directly, or `track` a callable that is read at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self._values: Dict[Labels, float] = {}
+        self._functions: Dict[Labels, Callable[[], float]] = {}
+
+    def set(self, labels: Labels, value: float) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def track(self, labels: Labels, fn: Callable[[], float]) -> None:
+        with self._lock:
+            self._functions[labels] = fn
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            values = dict(self._values)
+            functions = list(self._functions.items())
+        for labels, fn in functions:
+            try:
+                values[labels] = fn()
+            except Exception:
+                continue
+        for labels, value in values.items():
+            yield f"{self.name}{self._labels(labels)} {_format_value(value)}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last slot is +Inf), sum]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, labels: Labels = ()):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(labels, time.perf_counter() - started)
+
+    def lines(self) -> Iterator[str]:
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{self._labels(labels, ('le', _format_value(bound)))} {cumulative}"
+            yield f"{self.name}_sum{self._labels(labels)} {total!r}"
+            yield f"{self.name}_count{self._labels(labels)} {cumulative}"
+
+
+def render() -> str:
+    """Every registered metric in the Prometheus text format (0.0.4)."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------------
+# Payla metrics
+# ---------------------------------------------------------------
+
+http_request_duration = Histogram(
+    "payla_http_request_duration_seconds",
+    "HTTP request latency by route template and status.",
+    ("method", "route", "status"),
+)
+
+firestore_operation_duration = Histogram(
+    "payla_firestore_operation_duration_seconds",
+    "Firestore SDK call latency by collection and operation.",
+    ("collection", "op"),
+)
+firestore_operation_errors = Counter(
+    "payla_firestore_operation_errors_total",
+    "Firestore SDK calls that raised, by collection and operation.",
+    ("collection", "op"),
+)
+firestore_documents = Counter(
+    "payla_firestore_documents_total",
+    "Firestore documents read or written (billed units), by collection.",
+    ("collection", "kind"),
+)
+
+external_call_duration = Histogram(
+    "payla_external_call_duration_seconds",
+    "Outbound call latency by provider and outcome (2xx/4xx/5xx, or ok for SDK calls; error if it raised).",
+    ("provider", "outcome"),
+)
+
+background_run_duration = Histogram(
+    "payla_background_run_duration_seconds",
+    "Duration of one background loop run.",
+    ("loop",),
+    buckets=RUN_BUCKETS,
+)
+background_run_errors = Counter(
+    "payla_background_run_errors_total",
+    "Background loop runs that ended with an exception.",
+    ("loop",),
+)
+background_firestore_documents = Counter(
+    "payla_background_firestore_documents_total",
+    "Firestore documents read or written by background loop runs.",
+    ("loop", "kind"),
+)
+background_queue_depth = Gauge(
+    "payla_background_queue_depth",
+    "Items waiting to be processed by a background loop.",
+    ("loop",),
+)
+
+
+@contextmanager
+def track_run(loop: str):
+    """
+    Time one background loop run, count it as failed if it raises, and
+    account the Firestore documents it read and wrote.
+    """
+    started = time.perf_counter()
+    with firestore_usage.accounting() as usage:
+        try:
+            yield
+        except Exception:
+            background_run_errors.inc((loop,))
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            background_run_duration.observe((loop,), seconds)
+            background_firestore_documents.inc((loop, "read"), usage.reads)
+            background_firestore_documents.inc((loop, "write"), usage.writes)
+            firestore_usage.check_budget(f"job {loop}", usage, seconds * 1000, settings.FIRESTORE_JOB_READ_BUDGET)
+
+
+@contextmanager
+def track_external(provider: str):
+    """Time a provider SDK call that doesn't go through httpx/requests (e.g. Cloudinary uploads)."""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        external_call_duration.observe((provider, outcome), time.perf_counter() - started)
@@ -4,8 +4,9 @@ Reminder delivery time configuration
 Handles timezone conversion for different regions
 """
 
-from datetime import datetime, timezone
-from typing import Dict
+import hashlib
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Optional
 
 # Timezone configurations for different regions
 TIMEZONE_CONFIGS: Dict[str, Dict[str, any]] = {
@@ -35,6 +36,58 @@ TIMEZONE_CONFIGS: Dict[str, Dict[str, any]] = {
 # Default timezone for Nigeria
 DEFAULT_TIMEZONE = "WAT"
 
+# Preset reminders are spread over this window after the delivery hour
+# instead of all firing at HH:00. Slots are SEND_SLOT_SECONDS apart.
+SEND_WINDOW_MINUTES = 120
+SEND_SLOT_SECONDS = 15
+
+# Phone country calling codes (as produced by normalize_phone) → timezone code
+COUNTRY_CODE_TIMEZONES: Dict[str, str] = {
+    "234": "WAT",  # Nigeria
+    "229": "WAT",  # Benin
+    "237": "WAT",  # Cameroon
+    "227": "WAT",  # Niger
+    "233": "GMT",  # Ghana
+    "220": "GMT",  # Gambia
+    "231": "GMT",  # Liberia
+    "232": "GMT",  # Sierra Leone
+    "44": "GMT",   # United Kingdom
+    "254": "EAT",  # Kenya
+    "255": "EAT",  # Tanzania
+    "256": "EAT",  # Uganda
+    "251": "EAT",  # Ethiopia
+}
+
+
+def timezone_for_phone(phone: Optional[str]) -> Optional[str]:
+    """
+    Infer a timezone code from an E.164 phone number (e.g. "+2348012345678").
+    
+    Returns:
+        str | None: The timezone code, or None if the country code is unknown
+    """
+    if not phone or not phone.startswith("+"):
+        return None
+    digits = phone[1:]
+    for length in (3, 2, 1):
+        code = COUNTRY_CODE_TIMEZONES.get(digits[:length])
+        if code:
+            return code
+    return None
+
+
+def resolve_timezone(phone: Optional[str] = None, merchant_timezone: Optional[str] = None) -> str:
+    """
+    Pick the recipient's timezone: phone country code first, then the
+    merchant's configured timezone, then DEFAULT_TIMEZONE.
+    """
+    code = timezone_for_phone(phone)
+    if code:
+        return code
+    if merchant_timezone in TIMEZONE_CONFIGS:
+        return merchant_timezone
+    return DEFAULT_TIMEZONE
+
 
 def get_delivery_hour_utc(timezone_code: str = DEFAULT_TIMEZONE) -> int:
     """
@@ -75,6 +128,50 @@ def get_quiet_hours_utc(timezone_code: str = DEFAULT_TIMEZONE) -> tuple:
     return (start_utc, end_utc)
 
 
+def smooth_send_time(base: datetime, reminder_key: str, window_minutes: int = SEND_WINDOW_MINUTES) -> datetime:
+    """
+    Deterministically place a reminder inside [base, base + window).
+    
+    The slot comes from a stable hash of the reminder key, so a batch of
+    reminders is spread over the whole window instead of firing together,
+    and rescheduling the same reminder always lands on the same slot.
+    Slots are assigned per reminder, not per merchant: a merchant with many
+    reminders holds a proportionally large share of every part of the
+    window, and dispatch stays ordered by send time.
+    
+    Args:
+        base: Start of the window (the delivery hour, UTC)
+        reminder_key: Stable identifier of the reminder
+        window_minutes: Width of the window
+        
+    Returns:
+        datetime: The smoothed send time
+    """
+    slots = max(1, window_minutes * 60 // SEND_SLOT_SECONDS)
+    digest = hashlib.sha1(reminder_key.encode("utf-8")).digest()
+    slot = int.from_bytes(digest[:8], "big") % slots
+    return base + timedelta(seconds=slot * SEND_SLOT_SECONDS)
+
+
+def is_quiet_hours(now: datetime, timezone_code: str = DEFAULT_TIMEZONE) -> bool:
+    """
+    Check whether a UTC datetime falls inside the timezone's quiet hours.
+    """
+    start_utc, end_utc = get_quiet_hours_utc(timezone_code)
+    if start_utc > end_utc:  # Window spans midnight UTC
+        return now.hour >= start_utc or now.hour < end_utc
+    return start_utc <= now.hour < end_utc
+
+
+def quiet_hours_end_utc(now: datetime, timezone_code: str = DEFAULT_TIMEZONE) -> datetime:
+    """
+    The exact UTC moment the timezone's quiet window next opens for sending.
+    """
+    _, end_utc = get_quiet_hours_utc(timezone_code)
+    end = now.replace(hour=end_utc, minute=0, second=0, microsecond=0)
+    return end if end > now else end + timedelta(days=1)
+
+
 def format_time_for_timezone(dt: datetime, timezone_code: str = DEFAULT_TIMEZONE) -> str:
     """
     Format a UTC datetime for display in a specific timezone.
@@ -0,0 +1,168 @@
+# app/core/smtp_pool.py
+import asyncio
+import logging
+import time
+import weakref
+from email.message import EmailMessage
+from typing import Optional
+
+import aiosmtplib
+
+logger = logging.getLogger("payla")
+
+# -------------------------------------------------------------------
+# Pool settings
+# -------------------------------------------------------------------
+
+POOL_SIZE = 3               # Authenticated connections kept per event loop
+IDLE_CHECK_AFTER = 120      # Seconds idle before a NOOP health check
+SEND_TIMEOUT = 30           # Seconds per SMTP command
+
+
+class SMTPConnectionPool:
+    """
+    Small pool of logged-in aiosmtplib connections.
+    Messages reuse an open session (MAIL/RCPT/DATA only), so the TLS
+    handshake and AUTH happen once per connection instead of once per email.
+    """
+
+    def __init__(
+        self,
+        hostname: str,
+        port: int,
+        username: str,
+        password: str,
+        size: int = POOL_SIZE,
+        use_tls: bool = True,
+    ):
+        self.hostname = hostname
+        self.port = port
+        self.username = username
+        self.password = password
+        self.size = size
+        self.use_tls = use_tls
+
+        self._idle: asyncio.LifoQueue = asyncio.LifoQueue()
+        self._slots = asyncio.Semaphore(size)
+        self._last_used: dict = {}
+        self._closed = False
+
+    # ---------------------------------------------------------------
+    # Connection lifecycle
+    # ---------------------------------------------------------------
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        client = aiosmtplib.SMTP(
+            hostname=self.hostname,
+            port=self.port,
+            use_tls=self.use_tls,
+            timeout=SEND_TIMEOUT,
+        )
+        await client.connect()
+        await client.login(self.username, self.password)
+        logger.info(f"[SMTP] Connected {self.username}@{self.hostname}")
+        return client
+
+    async def _discard(self, client: Optional[aiosmtplib.SMTP]) -> None:
+        if client is None:
+            return
+        self._last_used.pop(id(client), None)
+        try:
+            if client.is_connected:
+                await client.quit()
+        except Exception:
+            client.close()
+
+    async def _checkout(self) -> aiosmtplib.SMTP:
+        """Return a live connection, reusing an idle one when possible."""
+        while not self._idle.empty():
+            client = self._idle.get_nowait()
+            if not client.is_connected:
+                await self._discard(client)
+                continue
+
+            idle_for = time.monotonic() - self._last_used.get(id(client), 0)
+            if idle_for > IDLE_CHECK_AFTER:
+                try:
+                    await client.noop()
+                except aiosmtplib.SMTPException:
+                    await self._discard(client)
+                    continue
+            return client
+
+        return await self._connect()
+
+    def _checkin(self, client: aiosmtplib.SMTP) -> None:
+        if self._closed or not client.is_connected:
+            client.close()
+            return
+        self._last_used[id(client)] = time.monotonic()
+        self._idle.put_nowait(client)
+
+    # ---------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------
+
+    async def send_message(self, msg: EmailMessage) -> None:
+        """
+        Send over a pooled connection.
+        A dropped connection is replaced and the message retried once.
+        """
+        if self._closed:
+            raise RuntimeError("SMTP pool is closed")
+
+        async with self._slots:
+            client = None
+            for attempt in range(2):
+                try:
+                    client = await self._checkout()
+                    await client.send_message(msg)
+                    self._checkin(client)
+                    return
+                except (
+                    aiosmtplib.SMTPServerDisconnected,
+                    aiosmtplib.SMTPConnectError,
+                    aiosmtplib.SMTPTimeoutError,
+                    ConnectionError,
+                ) as e:
+                    await self._discard(client)
+                    client = None
+                    if attempt == 1:
+                        raise
+                    logger.warning(f"[SMTP] Connection lost, reconnecting: {e}")
+                except Exception:
+                    await self._discard(client)
+                    raise
+
+    async def close(self) -> None:
+        self._closed = True
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait())
+
+
+# -------------------------------------------------------------------
+# Per-loop registry
+# -------------------------------------------------------------------
+# aiosmtplib connections are bound to the loop that opened them. The API
+# loop and the launch-email thread (its own asyncio.run) each get a pool.
+
+_pools: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict]" = weakref.WeakKeyDictionary()
+
+
+def get_smtp_pool(hostname: str, port: int, username: str, password: str) -> SMTPConnectionPool:
+    loop = asyncio.get_running_loop()
+    loop_pools = _pools.setdefault(loop, {})
+    key = (hostname, port, username)
+
+    pool = loop_pools.get(key)
+    if pool is None:
+        pool = SMTPConnectionPool(hostname, port, username, password)
+        loop_pools[key] = pool
+    return pool
+
+
+async def close_smtp_pools() -> None:
+    """Close every pool owned by the running loop (call on shutdown)."""
+    loop = asyncio.get_running_loop()
+    for pool in _pools.pop(loop, {}).values():
+        await pool.close()
@@ -0,0 +1,278 @@
+# app/core/static_assets.py
+"""
+In-memory static asset cache for the frontend (/js, /css, /assets).
+
+Files are read once at startup. Text assets are pre-compressed with gzip
+and brotli (Brotli is in requirements.txt; if it is missing only gzip is
+served and a warning is logged), every file gets a strong content-hash ETag
+(suffixed per encoding, since each encoding is a different representation),
+and requests are answered from memory with 304 handling. In DEBUG mode a watchfiles (inotify) watcher reloads changed
+files so edits show up without a restart.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import time
+from typing import Dict, Iterable, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+logger = logging.getLogger("payla")
+
+try:
+    import brotli
+except ImportError:  # Listed in requirements.txt; degrade to gzip only
+    brotli = None
+    logger.warning("brotli not installed; static assets will be served with gzip only")
+
+MAX_CACHED_BYTES = 5 * 1024 * 1024     # Larger files are not held in memory
+MIN_COMPRESS_BYTES = 512               # Not worth compressing below this
+
+# Explicit mappings to ensure correct types
+MIME_MAP = {
+    '.js': 'application/javascript',
+    '.mjs': 'application/javascript',
+    '.css': 'text/css',
+    '.json': 'application/json',
+    '.png': 'image/png',
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.gif': 'image/gif',
+    '.ico': 'image/x-icon',
+    '.webmanifest': 'application/manifest+json',
+    '.woff': 'font/woff',
+    '.woff2': 'font/woff2',
+    '.ttf': 'font/ttf',
+    '.eot': 'application/vnd.ms-fontobject',
+}
+COMPRESSIBLE = {".js", ".mjs", ".css", ".json", ".svg", ".html", ".txt", ".map", ".webmanifest", ".xml"}
+
+mimetypes.init()
+
+
+def get_mime_type(filename: str) -> str:
+    """Get correct MIME type for a file"""
+    ext = os.path.splitext(filename)[1].lower()
+    return MIME_MAP.get(ext, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+
+
+class StaticAsset:
+    __slots__ = ("media_type", "etag", "body", "gzip", "br", "path")
+
+    def __init__(self, path: str, body: Optional[bytes]):
+        self.path = path
+        self.media_type = get_mime_type(path)
+        if self.media_type.startswith("text/") or self.media_type == "application/javascript":
+            self.media_type += "; charset=utf-8"
+
+        if body is None:
+            # Too large to hold: size/mtime ETag, served from disk
+            stat = os.stat(path)
+            self.etag = f'"{stat.st_size:x}-{int(stat.st_mtime):x}"'
+            self.body = self.gzip = self.br = None
+            return
+
+        self.body = body
+        self.etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.gzip = self.br = None
+
+        if os.path.splitext(path)[1].lower() in COMPRESSIBLE and len(body) >= MIN_COMPRESS_BYTES:
+            gz = gzip.compress(body, compresslevel=9, mtime=0)
+            if len(gz) < len(body):
+                self.gzip = gz
+            if brotli is not None:
+                br = brotli.compress(body, quality=11)
+                if len(br) < len(body):
+                    self.br = br
+
+
+class HtmlShell:
+    """
+    An HTML template read once and pre-split at an injection marker, so each
+    request is assembled by concatenating head + snippet + tail.
+    """
+
+    def __init__(self, path: str, marker: str = "</head>"):
+        self.path = os.path.abspath(path)
+        self.marker = marker.encode("utf-8")
+        self.head = self.tail = b""
+        self.version = ""
+
+    def load(self) -> None:
+        with open(self.path, "rb") as f:
+            html = f.read()
+        head, sep, tail = html.partition(self.marker)
+        self.head, self.tail = head, sep + tail
+        self.version = hashlib.sha256(html).hexdigest()[:16]
+
+    @property
+    def loaded(self) -> bool:
+        return bool(self.version)
+
+    def render(self, snippet: str) -> bytes:
+        return b"".join((self.head, snippet.encode("utf-8"), self.tail))
+
+    def etag(self, *parts: str) -> str:
+        """Strong ETag for the shell version plus the per-request inputs."""
+        digest = hashlib.sha256("|".join((self.version, *parts)).encode("utf-8")).hexdigest()[:32]
+        return f'"{digest}"'
+
+
+def json_for_script(value) -> str:
+    """JSON literal that is safe to place inside an inline <script>."""
+    return (
+        json.dumps(value, default=str)
+        .replace("<", "\\u003c")
+        .replace(">", "\\u003e")
+        .replace("&", "\\u0026")
+    )
+
+
+def accepted_encodings(header: str) -> Dict[str, float]:
+    """Accept-Encoding as {coding: q}, e.g. "br;q=0, gzip" -> {"br": 0.0, "gzip": 1.0}."""
+    codings: Dict[str, float] = {}
+    for part in header.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[name] = q
+    return codings
+
+
+def _accepts(codings: Dict[str, float], name: str) -> bool:
+    return codings.get(name, codings.get("*", 0.0)) > 0
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match", "")
+    return if_none_match.strip() == "*" or etag in (tag.strip() for tag in if_none_match.split(","))
+
+
+class StaticAssetCache:
+    def __init__(self, root: str, mounts: Iterable[str] = ("js", "css", "assets")):
+        self.root = os.path.abspath(root)
+        self.mounts = tuple(mounts)
+        self._assets: Dict[str, StaticAsset] = {}
+        self._shells: Dict[str, HtmlShell] = {}
+        self.last_change = time.time()
+
+    def shell(self, relative_path: str, marker: str = "</head>") -> HtmlShell:
+        """Register an HTML shell under the frontend root; reloaded with the assets."""
+        shell = HtmlShell(os.path.join(self.root, relative_path), marker)
+        self._shells[shell.path] = shell
+        return shell
+
+    # ---------------------------------------------------------------
+    # Loading
+    # ---------------------------------------------------------------
+
+    def _key(self, path: str) -> Optional[str]:
+        rel = os.path.relpath(os.path.abspath(path), self.root).replace(os.sep, "/")
+        if rel.startswith("../") or rel.split("/", 1)[0] not in self.mounts:
+            return None
+        return rel
+
+    def _load_file(self, path: str) -> None:
+        key = self._key(path)
+        if key is None:
+            return
+        try:
+            size = os.path.getsize(path)
+            body = None
+            if size <= MAX_CACHED_BYTES:
+                with open(path, "rb") as f:
+                    body = f.read()
+            self._assets[key] = StaticAsset(path, body)
+        except FileNotFoundError:
+            self._assets.pop(key, None)
+
+    def _load_shell(self, path: str) -> None:
+        shell = self._shells.get(os.path.abspath(path))
+        if shell is None:
+            return
+        try:
+            shell.load()
+        except FileNotFoundError:
+            logger.error(f"❌ HTML shell missing: {path}")
+
+    def load(self) -> int:
+        """(Re)load every file under the mounted directories and every shell."""
+        for path in self._shells:
+            self._load_shell(path)
+        for mount in self.mounts:
+            for root, _, files in os.walk(os.path.join(self.root, mount)):
+                for name in files:
+                    self._load_file(os.path.join(root, name))
+        self.last_change = time.time()
+        return len(self._assets)
+
+    async def watch(self) -> None:
+        """Reload changed files as the filesystem reports them (DEBUG only)."""
+        try:
+            from watchfiles import awatch
+        except ImportError:
+            logger.warning("watchfiles not installed; static assets will not hot-reload")
+            return
+
+        async for changes in awatch(self.root):
+            for _, path in changes:
+                await asyncio.to_thread(self._load_file, path)
+                await asyncio.to_thread(self._load_shell, path)
+            self.last_change = time.time()
+            logger.debug(f"♻️ Frontend changed: {len(changes)} file(s)")
+
+    # ---------------------------------------------------------------
+    # Serving
+    # ---------------------------------------------------------------
+
+    def response(self, request: Request, mount: str, file_path: str, cache_control: str) -> Response:
+        key = f"{mount}/{file_path}".replace("\\", "/")
+        if ".." in key.split("/"):
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        asset = self._assets.get(key)
+        if asset is None:
+            raise HTTPException(status_code=404, detail=f"Asset not found: {file_path}")
+
+        body, encoding = asset.body, None
+        if body is not None:
+            codings = accepted_encodings(request.headers.get("accept-encoding", ""))
+            if asset.br is not None and _accepts(codings, "br"):
+                body, encoding = asset.br, "br"
+            elif asset.gzip is not None and _accepts(codings, "gzip"):
+                body, encoding = asset.gzip, "gzip"
+
+        # Each encoding is its own representation, so it gets its own strong ETag
+        etag = asset.etag if encoding is None else f'{asset.etag[:-1]}-{encoding}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding",
+            "X-Content-Type-Options": "nosniff",
+        }
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+
+        if etag_matches(request, etag):
+            headers.pop("Content-Encoding", None)
+            return Response(status_code=304, headers=headers)
+
+        if body is None:
+            return FileResponse(asset.path, media_type=asset.media_type, headers=headers)
+
+        return Response(content=body, media_type=asset.media_type, headers=headers)
@@ -180,16 +180,16 @@ async def require_silver(user: Optional[User] = Depends(get_current_user)) -> Us
         setattr(current_user, "subscription_end", user_data["subscription_end"])
 
     # 4️⃣ Check access with detailed logging
-    logger.info(f"🔍 Checking Silver access for user {current_user.id}")
-    logger.info(f"   Plan: {current_user.plan}")
-    logger.info(f"   Subscription ID: {current_user.subscription_id}")
-    logger.info(f"   Subscription End: {getattr(current_user, 'subscription_end', 'N/A')}")
-    logger.info(f"   Trial End: {current_user.trial_end_date}")
+    logger.debug(
+        f"🔍 Checking Silver access for user {current_user.id} | plan={current_user.plan} "
+        f"sub={current_user.subscription_id} sub_end={getattr(current_user, 'subscription_end', 'N/A')} "
+        f"trial_end={current_user.trial_end_date}"
+    )
     
     has_access = can_access_silver_features(current_user)
     
     if has_access:
-        logger.info(f"✅ User {current_user.id} granted Silver access")
+        logger.debug(f"✅ User {current_user.id} granted Silver access")
         return current_user
 
     # 5️⃣ Access denied - raise 403 with upgrade message
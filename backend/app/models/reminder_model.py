@@ -1,6 +1,6 @@
 # models/reminder_model.py
 from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Literal
+from typing import Dict, List, Optional, Literal
 from datetime import datetime
 
 
@@ -50,16 +50,22 @@ class Reminder(BaseModel):
     status: Literal["pending", "sent", "failed", "cancelled", "delivered"] = "pending"
 
     next_send: datetime
+    recipient_timezone: Optional[str] = None  # TIMEZONE_CONFIGS key, drives quiet hours
     last_sent: Optional[datetime] = None
     delivery_sid: Optional[str] = None
     
     # ✅ ADD THIS - matches your schedule_reminders_for_invoice
     active: bool = True
     
-    # ✅ ADD THESE - for lock mechanism
-    locked: bool = False
-    locked_at: Optional[datetime] = None
+    # Lease held by the worker currently processing this reminder
+    lease_owner: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
     
+    # Durable retries: failed attempts per channel, rescheduled via next_send
+    attempts: Dict[str, int] = {}
+    last_attempt_at: Optional[datetime] = None
+    last_error: Optional[str] = None
+
     # ✅ ADD THESE - for tracking failures/cancellations
     failed_reason: Optional[str] = None
     cancelled_reason: Optional[str] = None
@@ -63,6 +63,7 @@ class User(BaseModel):
     default_invoice_theme: str = "midnight-void"
     custom_invoice_colors: Optional[Dict[str, str]] = None
     show_payla_footer: bool = True
+    reminder_timezone: Optional[str] = None   # "WAT", "EAT", "GMT" — fallback when client phone has no known country code
 
     # ---------------- Helpers ----------------
     def is_trial_active(self) -> bool:
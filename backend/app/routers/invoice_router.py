@@ -6,6 +6,7 @@ from uuid import uuid4
 from datetime import datetime, timezone
 import httpx
 from google.cloud import firestore
+from google.api_core.exceptions import FailedPrecondition
 from pydantic import BaseModel
 from app.models.invoice_model import InvoiceCreate, Invoice
 from app.core.firebase import db
@@ -21,6 +22,8 @@ from app.core.notifications import create_notification
 from app.core.subscription import require_silver
 #from app.tasks.payout import initiate_payout
 from app.utils.crm import sync_client_to_crm
+from app.services.client_relationships import get_relationships, is_returning_client, record_invoice_published
+from app.services.payment_references import record_reference
 from google.cloud.firestore_v1.base_query import FieldFilter
 router = APIRouter(prefix="/invoices", tags=["Invoices"])
 
@@ -200,29 +203,12 @@ async def publish_invoice(
         raise HTTPException(status_code=400, detail="Incomplete invoice data")
 
     # 1. Check for Existing Relationship (Strict First Contact Logic)
-    is_returning_client = False
+    # One point read per contact against the client_relationships index
     client_email = data.get("client_email")
     normalized_phone = normalize_phone(data.get("client_phone"))
 
-    existing_base_query = db.collection("invoices").where(
-        filter=FieldFilter("sender_id", "==", current_user.id)
-    ).where(
-        filter=FieldFilter("status", "in", ["pending", "paid", "overdue", "sent"])
-    )
-
-    if client_email:
-        email_check = await firestore_run(
-            existing_base_query.where(filter=FieldFilter("client_email", "==", client_email)).limit(1).get
-        )
-        if email_check:
-            is_returning_client = True
-
-    if not is_returning_client and normalized_phone:
-        phone_check = await firestore_run(
-            existing_base_query.where(filter=FieldFilter("client_phone", "==", normalized_phone)).limit(1).get
-        )
-        if phone_check:
-            is_returning_client = True
+    relationships = await get_relationships(current_user.id, client_email, normalized_phone)
+    returning_client = is_returning_client(relationships)
 
     # 2. Initialize Paystack
     short_id = invoice_id.split("_")[-1]
@@ -285,14 +271,19 @@ async def publish_invoice(
         "sender_subaccount_code": subaccount_code,
         "published_at": datetime.now(timezone.utc),
         "updated_at": datetime.now(timezone.utc),
-        "is_returning_client": is_returning_client 
+        "is_returning_client": returning_client
     })
 
     published_invoice.pop("draft_data", None)
 
-    await firestore_run(
-        db.collection("invoices").document(published_id).set,
-        published_invoice,
+    # Invoice and its Paystack reference index entry land together
+    publish_batch = db.batch()
+    publish_batch.set(db.collection("invoices").document(published_id), published_invoice)
+    record_reference(paystack_data["reference"], "invoice", published_id, current_user.id, batch=publish_batch)
+    await firestore_run(publish_batch.commit)
+
+    await record_invoice_published(
+        current_user.id, client_email, normalized_phone, published_id, existing=relationships
     )
 
     # 4. Handle Notifications
@@ -483,14 +474,7 @@ async def update_invoice_status(
         "amount_paid_gross": paid_amount 
     }
 
-    # 7. CRM Sync 
-    await sync_client_to_crm(
-        merchant_id=invoice_data["sender_id"],
-        email=final_payer_email,
-        amount=float(invoice_data["amount"])
-    )
-
-    # 8. Trigger Payout (Background)
+    # 7. Trigger Payout (Background)
     # NOTE: Since you are using Paystack Subaccounts, the payout is 
     # handled AUTOMATICALLY by Paystack. You only need to call initiate_payout 
     # if you are doing manual ledger accounting.
@@ -499,8 +483,23 @@ async def update_invoice_status(
         # background_tasks.add_task(initiate_payout, invoice_data["sender_id"], amount, invoice_id)
         update_data["payout_status"] = "paid_via_subaccount"
 
-    # 9. Save Update
-    await firestore_run(ref.update, update_data)
+    # 8. Save Update (with the reference index entry for payout lookups).
+    # Preconditioned on the invoice being unchanged since it was read, so a
+    # webhook that marked it paid meanwhile wins and nothing is counted twice.
+    status_batch = db.batch()
+    status_batch.update(ref, update_data, option=db.write_option(last_update_time=doc.update_time))
+    record_reference(payload.transaction_reference, "invoice", invoice_id, invoice_data["sender_id"], batch=status_batch)
+    try:
+        await firestore_run(status_batch.commit)
+    except FailedPrecondition:
+        return {"message": "Invoice already processed", "status": "already_paid"}
+
+    # 9. CRM Sync (only the path that flipped the status records it)
+    await sync_client_to_crm(
+        merchant_id=invoice_data["sender_id"],
+        email=final_payer_email,
+        amount=float(invoice_data["amount"])
+    )
 
     # 10. Notifications
     create_notification(
@@ -4,14 +4,17 @@ from datetime import datetime
 from typing import Literal
 import uuid
 import time
+from typing import Dict, Tuple
 from app.models.user_model import User
 from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi.encoders import jsonable_encoder
 from google.cloud.firestore_v1.base_query import FieldFilter
 from app.models.paylink_model import PaylinkCreate, Paylink, CreatePaylinkTransactionRequest
 from app.core.firebase import db
 from app.core.auth import get_current_user
 from app.core.config import settings
 from app.utils.crm import sync_client_to_crm 
+from app.services.payment_references import record_reference
 from app.core.paystack import create_permanent_payment_page
 from app.core.notifications import create_notification
 from app.core.analytics import (
@@ -157,6 +160,9 @@ async def create_or_update_paylink(
 
     # Save initial record (without Paystack URLs yet)
     doc_ref.set(paylink_data.dict(by_alias=True), merge=True)
+    invalidate_public_paylink(username)
+    if doc.exists:
+        invalidate_public_paylink(doc.to_dict().get("username"))
 
     # 4. Trigger the Paystack Page creation with subaccount linkage
     updated_paylink_dict = await ensure_paystack_page(paylink_data.dict(by_alias=True))
@@ -249,14 +255,21 @@ async def get_my_paylink(current_user=Depends(get_current_user)):
 # --------------------------------------------------------------
 # 3. GET PAYLINK BY USERNAME (public)
 # --------------------------------------------------------------
-@router.get("/{username}", response_model=Paylink)
-async def get_paylink_by_username(username: str):
-    # 1. Clean the username input
-    username_clean = username.lower().lstrip("@").strip()
-    if not username_clean:
-        raise HTTPException(status_code=404, detail="Invalid username")
 
-    # 2. Query for the paylink document
+# Resolved public payloads, shared by the API below and the /@username page
+# (which embeds them so first paint needs no extra API call).
+PUBLIC_CACHE_TTL = 60  # seconds
+_public_cache: Dict[str, Tuple[float, dict]] = {}
+
+
+def invalidate_public_paylink(username: str) -> None:
+    """Drop a cached public payload (call after the owner changes the paylink)."""
+    if username:
+        _public_cache.pop(username.lower().lstrip("@").strip(), None)
+
+
+async def _load_public_paylink(username_clean: str) -> dict:
+    # 1. Query for the paylink document
     docs = db.collection("paylinks").where(filter=FieldFilter("username", "==", username_clean)).limit(1).get()
 
     if not docs:
@@ -266,7 +279,7 @@ async def get_paylink_by_username(username: str):
     data["_id"] = docs[0].id
     owner_id = data.get("user_id")
 
-    # 3. Check the OWNER'S subscription/trial/grace status
+    # 2. Check the OWNER'S subscription/trial/grace status
     user_doc = db.collection("users").document(owner_id).get()
     if not user_doc.exists:
         raise HTTPException(status_code=404, detail="Paylink owner not found")
@@ -288,17 +301,42 @@ async def get_paylink_by_username(username: str):
             detail="This Paylink is currently unavailable. If you are the owner, please check your subscription status."
         )
 
-    # 4. Check if the link is manually deactivated by the user
+    # 3. Check if the link is manually deactivated by the user
     if not data.get("active", True):
         raise HTTPException(status_code=404, detail="Paylink is currently inactive")
 
-    # 5. Sync branding (Override display_name with current profile data)
+    # 4. Sync branding (Override display_name with current profile data)
     data["display_name"] = user_data.get("business_name") or user_data.get("full_name")
     
-    # 6. Ensure Paystack connection is ready
+    # 5. Ensure Paystack connection is ready
     data = await ensure_paystack_page(data)
 
-    return Paylink(**data)
+    # Serialized exactly as the API responds (by alias), so both paths match
+    return jsonable_encoder(Paylink(**data), by_alias=True)
+
+
+async def resolve_public_paylink(username: str) -> dict:
+    """
+    Public paylink payload for `username`, from a short-lived cache.
+    Raises HTTPException (404/403) when the paylink can't be shown; failures
+    are not cached so a fix on the owner's side shows up immediately.
+    """
+    username_clean = username.lower().lstrip("@").strip()
+    if not username_clean:
+        raise HTTPException(status_code=404, detail="Invalid username")
+
+    cached = _public_cache.get(username_clean)
+    if cached and time.monotonic() - cached[0] < PUBLIC_CACHE_TTL:
+        return cached[1]
+
+    payload = await _load_public_paylink(username_clean)
+    _public_cache[username_clean] = (time.monotonic(), payload)
+    return payload
+
+
+@router.get("/{username}", response_model=Paylink)
+async def get_paylink_by_username(username: str):
+    return Paylink(**await resolve_public_paylink(username))
 
 # --------------------------------------------------------------
 # 4. DEACTIVATE PAYLINK  ← Protected
@@ -312,6 +350,7 @@ async def deactivate_paylink(current_user=Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="No paylink to deactivate")
 
     ref.update({"active": False, "updated_at": datetime.utcnow()})
+    invalidate_public_paylink((doc.to_dict() or {}).get("username"))
 
     # Notification
     create_notification(
@@ -337,6 +376,7 @@ async def activate_paylink(current_user=Depends(get_current_user)):
         raise HTTPException(status_code=404, detail="No paylink to activate")
 
     ref.update({"active": True, "updated_at": datetime.utcnow()})
+    invalidate_public_paylink((doc.to_dict() or {}).get("username"))
 
     # Notification
     create_notification(
@@ -424,7 +464,10 @@ async def create_paylink_transaction(username: str, req: CreatePaylinkTransactio
         },
     }
 
-    db.collection("paylink_transactions").document(reference).set(transaction)
+    txn_batch = db.batch()
+    txn_batch.set(db.collection("paylink_transactions").document(reference), transaction)
+    record_reference(reference, "paylink", reference, user_id, batch=txn_batch)
+    txn_batch.commit()
 
     # 5. Return data to Frontend
     return {
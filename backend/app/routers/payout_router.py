@@ -1,11 +1,14 @@
 ## routers/payout.py → FULLY INTEGRATED SUBACCOUNT VERSION
 import asyncio
+import csv
+import io
 import logging
 import httpx
 from datetime import datetime, timezone, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Literal
 
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field, validator
 from firebase_admin import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
@@ -13,6 +16,8 @@ from google.cloud.firestore_v1.base_query import FieldFilter
 from app.core.auth import get_current_user
 from app.models.user_model import User
 from app.core.config import settings
+from app.services.payment_references import find_source_document
+from app.utils.firebase import stream_pages
 
 router = APIRouter(prefix="/payout", tags=["Payout Settings"])
 logger = logging.getLogger("payla")
@@ -260,82 +265,157 @@ async def earnings(current_user: User = Depends(get_current_user)):
         "fee_structure": "Your Clients Pay Fees"
     }
 
-@router.get("/history")
-async def payout_history(current_user: User = Depends(get_current_user)):
-    user_id = current_user.id
-    history = []
+HISTORY_PAGE_MAX = 100
+EXPORT_PAGE_SIZE = 500
+EXPORT_COLUMNS = ["reference", "created_at", "type", "status", "amount", "arrival_date", "paid_at", "is_automated"]
+
+
+def _history_query(
+    user_id: str,
+    payout_type: Optional[str],
+    status: Optional[str],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+):
+    query = db.collection("payouts").where(filter=FieldFilter("user_id", "==", user_id))
+    if payout_type:
+        query = query.where(filter=FieldFilter("type", "==", payout_type))
+    if status:
+        query = query.where(filter=FieldFilter("status", "==", status.lower()))
+    if start_date:
+        query = query.where(filter=FieldFilter("created_at", ">=", start_date))
+    if end_date:
+        query = query.where(filter=FieldFilter("created_at", "<=", end_date))
+    return query.order_by("created_at", direction=firestore.Query.DESCENDING)
+
+
+def _history_row(d: dict) -> dict:
+    # Determine a friendly description
+    p_type = d.get("type", "paylink")
+    description = "Invoice Payment" if p_type == "invoice" else "Paylink Payment"
 
+    return {
+        "reference": d.get("reference"),
+        "amount": d.get("amount", 0),
+        "status": d.get("status", "settled").capitalize(),
+        "source_type": p_type,
+        "created_at": d.get("created_at").isoformat() if d.get("created_at") else None,
+        "description": description
+    }
+
+
+@router.get("/history")
+async def payout_history(
+    limit: int = Query(20, ge=1, le=HISTORY_PAGE_MAX),
+    cursor: Optional[str] = None,
+    type: Optional[Literal["invoice", "paylink"]] = None,
+    status: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+):
     # fetch only from the Payouts collection - this includes both Invoices and Paylinks now
-    payout_docs = db.collection("payouts")\
-        .where("user_id", "==", user_id)\
-        .order_by("created_at", direction=firestore.Query.DESCENDING)\
-        .limit(20).stream()
+    query = _history_query(current_user.id, type, status, start_date, end_date)
 
-    for doc in payout_docs:
-        d = doc.to_dict()
-        
-        # Determine a friendly description
-        p_type = d.get("type", "paylink")
-        description = "Invoice Payment" if p_type == "invoice" else "Paylink Payment"
-        
-        history.append({
-            "reference": d.get("reference"),
-            "amount": d.get("amount", 0),
-            "status": d.get("status", "settled").capitalize(),
-            "source_type": p_type,
-            "created_at": d.get("created_at").isoformat() if d.get("created_at") else None,
-            "description": description
-        })
+    # The cursor is the reference (document id) of the last payout on the previous page
+    if cursor:
+        cursor_doc = await asyncio.to_thread(db.collection("payouts").document(cursor).get)
+        if not cursor_doc.exists or (cursor_doc.to_dict() or {}).get("user_id") != current_user.id:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.start_after(cursor_doc)
+
+    # One extra document tells us whether another page exists
+    docs = await asyncio.to_thread(lambda: list(query.limit(limit + 1).stream()))
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    history = [_history_row(doc.to_dict()) for doc in docs]
+    next_cursor = docs[-1].id if has_more else None
 
     # Sorting is already handled by the Firestore order_by, 
     # but we'll keep the list return format consistent
-    return {"history": history, "payouts": history}
+    return {"history": history, "payouts": history, "next_cursor": next_cursor}
+
+
+def _export_rows(query):
+    """Yield CSV text page by page straight off the Firestore cursor."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def drain() -> str:
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+        return text
+
+    writer.writerow(EXPORT_COLUMNS)
+    yield drain()
+
+    for page in stream_pages(query, EXPORT_PAGE_SIZE, EXPORT_COLUMNS):
+        for doc in page:
+            d = doc.to_dict()
+            writer.writerow([
+                d.get(col).isoformat() if isinstance(d.get(col), datetime) else d.get(col, "")
+                for col in EXPORT_COLUMNS
+            ])
+        yield drain()
+
+
+@router.get("/history/export.csv")
+async def export_payout_history(
+    type: Optional[Literal["invoice", "paylink"]] = None,
+    status: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    current_user: User = Depends(get_current_user),
+):
+    query = _history_query(current_user.id, type, status, start_date, end_date)
+    filename = f"payla_payouts_{datetime.now(timezone.utc):%Y%m%d}.csv"
+
+    # Sync generator: Starlette iterates it in a worker thread, one page in memory at a time
+    return StreamingResponse(
+        _export_rows(query),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 
 # ------------------- Helpers & Payout Status -------------------
 
-async def queue_payout(
-    user_id: str, 
-    amount: float, 
-    reference: str, 
-    payout_type: str = "paylink", 
-    manual_payout: bool = False
-):
-    """
-    Handles recording and initiation of payouts for Subaccount splits.
-    Updates unified dashboard stats for both Invoices and Paylinks.
-    """
-    payout_ref = db.collection("payouts").document(reference)
-    
-    # Avoid duplicate processing
-    if payout_ref.get().exists:
-        logger.info(f"ℹ️ Payout reference {reference} already exists. Skipping.")
-        return
-
-    now = datetime.now(timezone.utc)
-    
+def settlement_arrival_date(now: datetime) -> datetime:
     # --- T+1 Settlement Logic ---
     arrival_date = now + timedelta(days=1)
     if now.weekday() == 4: # Friday -> Monday
         arrival_date = now + timedelta(days=3)
     elif now.weekday() == 5: # Saturday -> Monday
         arrival_date = now + timedelta(days=2)
-
-    # 1. Prepare payout record for the "Recent Payouts" list
-    payout_entry = {
+    return arrival_date
+
+
+def build_payout_entry(
+    user_id: str,
+    amount: float,
+    reference: str,
+    payout_type: str,
+    manual_payout: bool,
+    now: datetime
+) -> Dict[str, Any]:
+    """Payout ledger document as written to payouts/{reference}."""
+    return {
         "user_id": user_id,
         "reference": reference,
         "amount": amount,
         "type": payout_type, 
         "status": "settled" if not manual_payout else "pending",
         "created_at": now,
-        "arrival_date": arrival_date,
+        "arrival_date": settlement_arrival_date(now),
         "paid_at": now if not manual_payout else None,
         "is_automated": not manual_payout
     }
-    
-    # 2. Prepare User Dashboard Updates
-    user_ref = db.collection("users").document(user_id)
+
+
+def payout_user_updates(amount: float, payout_type: str, now: datetime) -> Dict[str, Any]:
+    """Dashboard counters on the user document for one payout."""
     user_updates = {
         "total_earned": firestore.Increment(amount),
         "last_payout_at": now,
@@ -346,6 +426,42 @@ async def queue_payout(
         user_updates["total_invoice_revenue"] = firestore.Increment(amount)
     else:
         user_updates["total_paylink_revenue"] = firestore.Increment(amount)
+    return user_updates
+
+
+def payout_source_update(manual_payout: bool, now: datetime) -> Dict[str, Any]:
+    """Fields stamped on the invoice or paylink transaction behind a payout."""
+    return {
+        "payout_status": "settled_by_paystack" if not manual_payout else "payout_pending",
+        "settled_at": now
+    }
+
+async def queue_payout(
+    user_id: str, 
+    amount: float, 
+    reference: str, 
+    payout_type: str = "paylink", 
+    manual_payout: bool = False
+):
+    """
+    Handles recording and initiation of payouts for Subaccount splits.
+    Updates unified dashboard stats for both Invoices and Paylinks.
+    """
+    payout_ref = db.collection("payouts").document(reference)
+    
+    # Avoid duplicate processing
+    if payout_ref.get().exists:
+        logger.info(f"ℹ️ Payout reference {reference} already exists. Skipping.")
+        return
+
+    now = datetime.now(timezone.utc)
+
+    # 1. Prepare payout record for the "Recent Payouts" list
+    payout_entry = build_payout_entry(user_id, amount, reference, payout_type, manual_payout, now)
+    
+    # 2. Prepare User Dashboard Updates
+    user_ref = db.collection("users").document(user_id)
+    user_updates = payout_user_updates(amount, payout_type, now)
 
     try:
         batch = db.batch()
@@ -357,29 +473,12 @@ async def queue_payout(
         batch.update(user_ref, user_updates)
         
         # C. Update the Source Transaction (Invoice or Paylink)
-        if payout_type == "invoice":
-            # Search for invoice where transaction_reference matches Paystack reference
-            # This is safer than document() because IDs vary
-            inv_query = db.collection("invoices").where("transaction_reference", "==", reference).limit(1).get()
-            
-            if inv_query:
-                # Update the specific invoice document found
-                batch.update(inv_query[0].reference, {
-                    "payout_status": "settled_by_paystack" if not manual_payout else "payout_pending",
-                    "settled_at": now
-                })
-            else:
-                # Fallback: Try document ID if query yields nothing
-                batch.update(db.collection("invoices").document(reference), {
-                    "payout_status": "settled_by_paystack" if not manual_payout else "payout_pending",
-                    "settled_at": now
-                }, merge=True)
+        # The payment_references index maps the Paystack reference to its document
+        source_ref = find_source_document(reference, payout_type)
+        if source_ref is not None:
+            batch.update(source_ref, payout_source_update(manual_payout, now))
         else:
-            # For Paylinks, the reference is usually the document ID
-            batch.update(db.collection("paylink_transactions").document(reference), {
-                "payout_status": "settled_by_paystack" if not manual_payout else "payout_pending",
-                "settled_at": now
-            })
+            logger.warning(f"⚠️ No {payout_type} document for payout {reference}; source not stamped")
         
         batch.commit()
         logger.info(f"💰 Unified Payout Logged: {payout_type.upper()} | {user_id} | ₦{amount}")
@@ -402,16 +501,12 @@ async def get_payout_status(reference: str):
         data = doc.to_dict()
         return {"payout_status": data.get("status", "settled")}
         
-    # 2. Fallback to check paylink_transactions if not in payouts history yet
-    tx_doc = db.collection("paylink_transactions").document(reference).get()
-    if tx_doc.exists:
-        data = tx_doc.to_dict()
-        return {"payout_status": data.get("payout_status", "processing")}
-        
-    # 3. Final fallback for Invoices
-    inv_doc = db.collection("invoices").where("transaction_reference", "==", reference).limit(1).get()
-    if inv_doc:
-        data = inv_doc[0].to_dict()
-        return {"payout_status": data.get("payout_status", "processing")}
+    # 2. Fall back to the invoice or paylink transaction behind the reference
+    source_ref = find_source_document(reference)
+    if source_ref is not None:
+        source_doc = source_ref.get()
+        if source_doc.exists:
+            data = source_doc.to_dict()
+            return {"payout_status": data.get("payout_status", "processing")}
 
     return {"payout_status": "processing"}
\ No newline at end of file
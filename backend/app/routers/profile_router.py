@@ -11,6 +11,8 @@ import uuid
 import cloudinary
 import cloudinary.uploader
 from app.core.config import settings
+from app.services.logo_cache import logo_cache
+from app.core.metrics import track_external
 import logging
 
 # Initialize logger
@@ -137,13 +139,14 @@ async def upload_logo(
         
         logger.info(f"📤 Attempting Cloudinary upload for user: {current_user.id}")
 
-        upload_result = cloudinary.uploader.upload(
-            file.file,
-            folder="payla/logos",
-            public_id=f"user_{current_user.id}_logo",
-            overwrite=True,
-            resource_type="auto"
-        )
+        with track_external("cloudinary"):
+            upload_result = cloudinary.uploader.upload(
+                file.file,
+                folder="payla/logos",
+                public_id=f"user_{current_user.id}_logo",
+                overwrite=True,
+                resource_type="auto"
+            )
 
         logo_url = upload_result.get("secure_url")
 
@@ -157,6 +160,10 @@ async def upload_logo(
             "updated_at": datetime.now(timezone.utc)
         })
 
+        # Receipts must not keep rendering the previous logo
+        logo_cache.invalidate(current_user.logo_url)
+        logo_cache.invalidate(logo_url)
+
         logger.info(f"✅ Successful Upload: {logo_url}")
 
         return {
@@ -1,126 +1,55 @@
-from fastapi import APIRouter, HTTPException, Depends
-from fastapi.responses import StreamingResponse
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from io import BytesIO
+import asyncio
+import io
+import logging
+import zipfile
+from collections import deque
+from fastapi import APIRouter, HTTPException, Depends, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from datetime import datetime, timezone
-import httpx
 
 from app.core.firebase import db
-from app.utils.firebase import firestore_run
+from app.utils.firebase import firestore_run, stream_pages
+from app.utils.receipt_pdf import format_date
+from app.services.receipt_renderer import receipt_renderer, receipt_key
+from app.services.logo_cache import logo_cache
 from app.models.user_model import User
 from app.core.auth import get_current_user
 from app.core.config import settings
 from app.core.subscription import require_silver
 
 router = APIRouter(prefix="/receipt", tags=["Receipts"])
+logger = logging.getLogger("payla")
 
-# --- Styles Configuration ---
-styles = getSampleStyleSheet()
-title_style = ParagraphStyle(
-    'CustomTitle',
-    parent=styles['Heading1'],
-    fontSize=26,
-    spaceAfter=20,
-    textColor=colors.HexColor("#1a1a1a"),
-    alignment=1 
-)
-subtitle_style = ParagraphStyle(
-    'Subtitle',
-    parent=styles['Normal'],
-    fontSize=10,
-    textColor=colors.grey,
-    alignment=1
-)
+EXPORT_PAGE_SIZE = 100      # Source documents fetched per page
+EXPORT_RENDER_AHEAD = 8     # Receipts prepared in parallel ahead of the ZIP writer
 
 # --- Helper Functions ---
-async def fetch_logo(url: str) -> BytesIO:
-    try:
-        async with httpx.AsyncClient(timeout=5) as client:
-            resp = await client.get(url)
-            if resp.status_code == 200:
-                return BytesIO(resp.content)
-    except Exception:
-        return None
-
-def format_date(dt_val) -> str:
-    """Safely converts Firestore Timestamps or strings to formatted strings."""
-    if not dt_val:
-        return "N/A"
-    try:
-        if isinstance(dt_val, datetime):
-            return dt_val.strftime("%B %d, %Y")
-        if hasattr(dt_val, "timestamp"): # Firestore Timestamp
-            return dt_val.strftime("%B %d, %Y")
-        return str(dt_val)
-    except:
-        return "Date Pending"
-
-# --------------------------------------------------------------
-# 1. PAYLINK RECEIPT
-# --------------------------------------------------------------
-@router.get("/paylink/{reference}.pdf")
-async def generate_paylink_receipt(reference: str, token: str | None = None):
-    # 1. Fetch Transaction Data
-    txn_doc = await db.collection("paylink_transactions").document(reference).get()
-    if not txn_doc.exists:
-        raise HTTPException(404, "Transaction not found")
-    
-    txn = txn_doc.to_dict()
-    
-    # Check status (Paystack sends 'success', but check both just in case)
-    if txn.get("status") not in ["success", "successful"]:
-        raise HTTPException(400, "Receipt only available for successful payments")
+def _pdf_response(path, filename: str) -> FileResponse:
+    return FileResponse(
+        path,
+        media_type="application/pdf",
+        filename=filename,
+        headers={"Cache-Control": "private, max-age=86400"}
+    )
 
-    # 2. Security Check (If you use the token in the frontend, keep this)
-    if token and token != reference:
-         raise HTTPException(403, "Invalid access token")
 
-    # 3. Fetch Merchant 
-    user_doc = await db.collection("users").document(txn["user_id"]).get()
-    user = user_doc.to_dict() if user_doc.exists else {}
-    
+def _paylink_receipt_job(reference: str, txn: dict, user: dict):
+    """Cache key and spec factory for a paylink receipt."""
     # IMPORTANT: Check correct field for subscription
     is_silver = user.get("plan") == "silver"
 
     if is_silver:
         logo_url = user.get("logo_url")
         business_name = user.get("business_name") or user.get("full_name") or "Merchant"
-        primary_color = colors.HexColor(user.get("custom_invoice_colors", {}).get("primary", "#1a1a1a"))
+        primary_color = user.get("custom_invoice_colors", {}).get("primary", "#1a1a1a")
         footer_brand = business_name
     else:
         logo_url = settings.PAYLA_LOGO_URL 
         business_name = "Payla Payments"
-        primary_color = colors.HexColor("#6366f1")
+        primary_color = "#6366f1"
         footer_brand = "Payla"
 
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.75*inch, bottomMargin=0.75*inch)
-    story = []
-
-    # 4. Logo Handling (unchanged but wrapped in try/except)
-    if logo_url:
-        logo_data = await fetch_logo(logo_url)
-        if logo_data:
-            try:
-                img = Image(logo_data)
-                aspect = img.imageHeight / float(img.imageWidth)
-                img.drawWidth = 1.3*inch
-                img.drawHeight = 1.3*inch * aspect
-                img.hAlign = 'CENTER'
-                story.append(img)
-                story.append(Spacer(1, 15))
-            except: pass
-
-    # 5. Header
-    story.append(Paragraph(business_name.upper(), title_style.clone('PaylinkTitle', textColor=primary_color)))
-    story.append(Paragraph("PAYMENT RECEIPT", subtitle_style))
-    story.append(Spacer(1, 30))
-
-    # 6. Data Mapping (FIXED FIELD NAMES)
+    # Data Mapping (FIXED FIELD NAMES)
     # Use 'amount' (the net amount) or 'requested_amount'
     display_amount = txn.get("amount") or txn.get("requested_amount") or 0
     
@@ -134,42 +63,100 @@ async def generate_paylink_receipt(reference: str, token: str | None = None):
     if txn.get("payer_name"): data.append(["Customer", txn["payer_name"]])
     elif txn.get("customer_email"): data.append(["Customer", txn["customer_email"]])
 
-    table = Table(data, colWidths=[2.2*inch, 3.8*inch], rowHeights=28)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor("#f8fafc")),
-        ('TEXTCOLOR', (0, 0), (0, -1), primary_color),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor("#cbd5e1")),
-        ('LEFTPADDING', (0, 0), (-1, -1), 12),
-    ]))
-    story.append(table)
-    story.append(Spacer(1, 40))
+    spec = {
+        "reference": reference,
+        "business_name": business_name,
+        "primary_color": primary_color,
+        "footer_brand": footer_brand,
+        "backend_url": settings.BACKEND_URL,
+        "rows": data,
+    }
+
+    async def build_spec():
+        return {**spec, "logo": await logo_cache.get(logo_url)}
+
+    key = receipt_key("paylink", reference, {**spec, "logo_url": logo_url})
+    return key, build_spec
+
+
+def _invoice_receipt_job(invoice_id: str, inv: dict, user: dict):
+    """Cache key and spec factory for an invoice receipt."""
+    # Determine Branding (The "Elite" Logic)
+    is_silver = user.get("subscription_tier") == "silver"
     
-    # 7. Professional Sign-off
-    thanks_text = f"<b>Thank you for your payment to {business_name}!</b>"
-    story.append(Paragraph(thanks_text, subtitle_style.clone('Thanks', textColor=primary_color, fontSize=11)))
-    story.append(Spacer(1, 60))
-
-    # 8. Footer (FIXED THE footer_content NameError)
-    footer_text = f"""
-    <font size="8" color="grey">
-    This receipt was issued by {footer_brand} via Payla Intelligence.<br/>
-    Reference: {reference}<br/>
-    {settings.BACKEND_URL}
-    </font>
-    """
-    story.append(Paragraph(footer_text, ParagraphStyle('Footer', alignment=1)))
+    if is_silver:
+        # User is paying: Give them their own brand
+        logo_url = user.get("custom_invoice_colors", {}).get("logo") or user.get("logo_url")
+        business_name = inv.get("sender_business_name") or user.get("business_name") or "Merchant"
+        primary_color = user.get("custom_invoice_colors", {}).get("primary", "#1a1a1a")
+        footer_brand = business_name
+        support_contact = user.get("email") or "the merchant"
+    else:
+        # Free Tier: You (Payla) are the brand
+        logo_url = settings.PAYLA_LOGO_URL # Ensure this is in your config
+        business_name = "Payla Payments"
+        primary_color = "#6366f1" # Payla Signature Indigo
+        footer_brand = "Payla"
+        support_contact = "support@payla.ng"
+
+    # Transaction Table
+    data = [
+        ["Invoice Number", invoice_id.upper()],
+        ["Transaction Ref", inv.get("transaction_reference", "Verified").upper()],
+        ["Date Paid", format_date(inv.get("paid_at"))],
+        ["Total Amount", f"{inv.get('currency', '₦')}{inv.get('amount', 0):,.2f}"],
+        ["Description", inv.get("description", "Payment for Services")],
+    ]
+
+    # Add Customer Info if available
+    customer_label = inv.get("client_name") or inv.get("client_email") or "Valued Customer"
+    data.append(["Paid By", customer_label])
+
+    spec = {
+        "business_name": business_name,
+        "primary_color": primary_color,
+        "footer_brand": footer_brand,
+        "support_contact": support_contact,
+        "rows": data,
+    }
+
+    async def build_spec():
+        return {**spec, "logo": await logo_cache.get(logo_url)}
+
+    key = receipt_key("invoice", invoice_id, {**spec, "logo_url": logo_url})
+    return key, build_spec
+
+
+# --------------------------------------------------------------
+# 1. PAYLINK RECEIPT
+# --------------------------------------------------------------
+@router.get("/paylink/{reference}.pdf")
+async def generate_paylink_receipt(reference: str, token: str | None = None):
+    # 1. Fetch Transaction Data
+    txn_doc = await firestore_run(db.collection("paylink_transactions").document(reference).get)
+    if not txn_doc.exists:
+        raise HTTPException(404, "Transaction not found")
+    
+    txn = txn_doc.to_dict()
+    
+    # Check status (Paystack sends 'success', but check both just in case)
+    if txn.get("status") not in ["success", "successful"]:
+        raise HTTPException(400, "Receipt only available for successful payments")
 
-    doc.build(story)
-    buffer.seek(0)
+    # 2. Security Check (If you use the token in the frontend, keep this)
+    if token and token != reference:
+         raise HTTPException(403, "Invalid access token")
+
+    # 3. Fetch Merchant 
+    user_doc = await firestore_run(db.collection("users").document(txn["user_id"]).get)
+    user = user_doc.to_dict() if user_doc.exists else {}
     
-    return StreamingResponse(
-        buffer, 
-        media_type="application/pdf", 
-        headers={"Content-Disposition": f'attachment; filename="Receipt_{reference[:8]}.pdf"'}
-    )
+    key, build_spec = _paylink_receipt_job(reference, txn, user)
+
+    # 4. Render once per reference + branding; repeat downloads serve the cached file
+    path = await receipt_renderer.get_path("paylink", key, build_spec)
+
+    return _pdf_response(path, f"Receipt_{reference[:8]}.pdf")
 
 # --------------------------------------------------------------
 # 2. INVOICE RECEIPT
@@ -199,102 +186,118 @@ async def generate_invoice_receipt(invoice_id: str, token: str | None = None):
          raise HTTPException(403, "Invalid security token for this receipt")
 
     sender_id = inv["sender_id"]
-    user_doc = await db.collection("users").document(sender_id).get()
+    user_doc = await firestore_run(db.collection("users").document(sender_id).get)
     user = user_doc.to_dict() if user_doc.exists else {}
 
-    # 3. Determine Branding (The "Elite" Logic)
-    is_silver = user.get("subscription_tier") == "silver"
-    
-    if is_silver:
-        # User is paying: Give them their own brand
-        logo_url = user.get("custom_invoice_colors", {}).get("logo") or user.get("logo_url")
-        business_name = inv.get("sender_business_name") or user.get("business_name") or "Merchant"
-        primary_color = colors.HexColor(user.get("custom_invoice_colors", {}).get("primary", "#1a1a1a"))
-        footer_brand = business_name
-        support_contact = user.get("email") or "the merchant"
-    else:
-        # Free Tier: You (Payla) are the brand
-        logo_url = settings.PAYLA_LOGO_URL # Ensure this is in your config
-        business_name = "Payla Payments"
-        primary_color = colors.HexColor("#6366f1") # Payla Signature Indigo
-        footer_brand = "Payla"
-        support_contact = "support@payla.ng"
+    key, build_spec = _invoice_receipt_job(invoice_id, inv, user)
 
-    buffer = BytesIO()
-    # Setting margins for a professional "letterhead" feel
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.75*inch, bottomMargin=0.75*inch)
-    story = []
+    # 3. Render once per invoice + branding; repeat downloads serve the cached file
+    path = await receipt_renderer.get_path("invoice", key, build_spec)
 
-    # 4. Logo Handling
-    if logo_url:
-        logo_data = await fetch_logo(logo_url)
-        if logo_data:
-            try:
-                img = Image(logo_data)
-                # Aspect ratio maintenance
-                aspect = img.imageHeight / float(img.imageWidth)
-                img.drawWidth = 1.2*inch
-                img.drawHeight = 1.2*inch * aspect
-                img.hAlign = 'CENTER'
-                story.append(img)
-                story.append(Spacer(1, 15))
-            except: 
-                pass
-
-    # 5. Header Section
-    story.append(Paragraph(business_name.upper(), title_style.clone('MainTitle', textColor=primary_color)))
-    story.append(Paragraph("OFFICIAL PAYMENT RECEIPT", subtitle_style))
-    story.append(Spacer(1, 30))
-
-    # 6. Transaction Table
-    data = [
-        ["Invoice Number", invoice_id.upper()],
-        ["Transaction Ref", inv.get("transaction_reference", "Verified").upper()],
-        ["Date Paid", format_date(inv.get("paid_at"))],
-        ["Total Amount", f"{inv.get('currency', '₦')}{inv.get('amount', 0):,.2f}"],
-        ["Description", inv.get("description", "Payment for Services")],
+    return _pdf_response(path, f"Receipt_{invoice_id}.pdf")
+
+
+# --------------------------------------------------------------
+# 3. BULK EXPORT (ZIP)
+# --------------------------------------------------------------
+class _ZipSink(io.RawIOBase):
+    """Write-only buffer the ZIP writer appends to; drained after every entry."""
+
+    def __init__(self):
+        self._chunks = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _export_sources(user_id: str, start: datetime | None, end: datetime | None):
+    """Yield (kind, doc_id, data) for paid invoices, then successful paylinks."""
+    sources = [
+        ("invoice", db.collection("invoices").where("sender_id", "==", user_id).where("status", "==", "paid")),
+        ("paylink", db.collection("paylink_transactions").where("user_id", "==", user_id).where("status", "==", "success")),
     ]
+    for kind, query in sources:
+        if start:
+            query = query.where("paid_at", ">=", start)
+        if end:
+            query = query.where("paid_at", "<=", end)
+        for page in stream_pages(query.order_by("paid_at"), EXPORT_PAGE_SIZE):
+            for doc in page:
+                yield kind, doc.id, doc.to_dict()
 
-    # Add Customer Info if available
-    customer_label = inv.get("client_name") or inv.get("client_email") or "Valued Customer"
-    data.append(["Paid By", customer_label])
 
-    table = Table(data, colWidths=[2.2*inch, 3.8*inch], rowHeights=30)
-    table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor("#f8fafc")), # Soft slate background for keys
-        ('TEXTCOLOR', (0, 0), (0, -1), primary_color),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor("#e2e8f0")),
-        ('LEFTPADDING', (0, 0), (-1, -1), 12),
-    ]))
-    story.append(table)
-    story.append(Spacer(1, 40))
-
-    # 7. Closing Message
-    thanks_style = ParagraphStyle('Thanks', parent=subtitle_style, fontSize=12, leading=16)
-    story.append(Paragraph(f"<b>Successful Payment.</b>", thanks_style.clone('bold', textColor=primary_color)))
-    story.append(Paragraph(f"This document confirms that your payment was received in full.", thanks_style))
-    story.append(Spacer(1, 60))
-
-    # 8. Brand-Specific Footer
-    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, textColor=colors.grey, alignment=1)
-    
-    footer_content = f"""
-    This receipt was generated by {footer_brand}.<br/>
-    For inquiries regarding this payment, please contact {support_contact}.<br/>
-    <b>Thank you for using Payla.</b>
-    """
-    story.append(Paragraph(footer_content, footer_style))
+async def _receipt_zip(user_id: str, user: dict, start: datetime | None, end: datetime | None):
+    sink = _ZipSink()
+    zf = zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED)  # PDFs are already compressed
+    sources = _export_sources(user_id, start, end)
+    window = deque()
+    errors = []
+
+    async def prepare(kind, doc_id, data):
+        if kind == "invoice":
+            key, build_spec = _invoice_receipt_job(doc_id, data, user)
+        else:
+            key, build_spec = _paylink_receipt_job(doc_id, data, user)
+        path = await receipt_renderer.get_path(kind, key, build_spec)
+        return f"{kind}s/Receipt_{doc_id}.pdf", path
+
+    async def fill():
+        while len(window) < EXPORT_RENDER_AHEAD:
+            item = await asyncio.to_thread(next, sources, None)
+            if item is None:
+                return
+            window.append((item[0], item[1], asyncio.ensure_future(prepare(*item))))
+
+    try:
+        await fill()
+        while window:
+            kind, doc_id, task = window.popleft()
+            await fill()  # keep renders running while this entry is written
+            try:
+                arcname, path = await task
+            except Exception as e:
+                logger.error(f"❌ Receipt export for {user_id}: {kind} {doc_id} failed: {e}")
+                errors.append(f"{kind}\t{doc_id}\t{' '.join(str(e).split())}")
+                continue
+            await asyncio.to_thread(zf.write, path, arcname)
+            yield sink.drain()
+
+        # Receipts that couldn't be rendered are listed rather than silently missing
+        if errors:
+            zf.writestr("errors.txt", "kind\tid\terror\n" + "\n".join(errors) + "\n")
+        zf.close()
+        yield sink.drain()
+    finally:
+        for _, _, task in window:
+            task.cancel()
 
-    doc.build(story)
-    buffer.seek(0)
 
-    filename = f"Receipt_{invoice_id}.pdf"
+@router.get("/export.zip")
+async def export_receipts(
+    start: datetime | None = Query(None, alias="from"),
+    end: datetime | None = Query(None, alias="to"),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Streams every receipt in the date range as a ZIP. Receipts come from the
+    render cache or are rendered on the process pool a few at a time, and
+    each entry is flushed to the client as soon as it is written.
+    """
+    user_doc = await firestore_run(db.collection("users").document(current_user.id).get)
+    user = user_doc.to_dict() if user_doc.exists else {}
+
+    filename = f"Payla_Receipts_{datetime.now(timezone.utc):%Y%m%d}.zip"
     return StreamingResponse(
-        buffer,
-        media_type="application/pdf",
+        _receipt_zip(current_user.id, user, start, end),
+        media_type="application/zip",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
\ No newline at end of file
+    )
@@ -3,10 +3,13 @@ from firebase_admin import firestore
 import hmac
 import hashlib
 import logging
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition
 from app.core.config import settings
 from datetime import datetime, timezone, timedelta
 # Import the queue_payout helper
 from app.routers.payout_router import queue_payout 
+from app.utils.crm import sync_client_to_crm
+from app.services.payment_references import record_reference
 
 router = APIRouter(prefix="/webhooks", tags=["Webhooks"])
 logger = logging.getLogger("payla")
@@ -58,18 +61,35 @@ async def paystack_webhook(
             
             if inv_doc.exists:
                 current_data = inv_doc.to_dict()
+                marked_paid = False
                 if current_data.get("status") != "paid":
-                    inv_ref.update({
-                        "status": "paid",
-                        "paid_at": now,
-                        "updated_at": now,
-                        "transaction_reference": reference,
-                        "payout_status": payout_status,
-                        "payer_email": event_data.get("customer", {}).get("email"),
-                        "payment_channel": event_data.get("channel"),
-                        "fees_covered_by_client": is_automated
-                    })
+                    try:
+                        # Precondition: nobody (e.g. the verify endpoint) changed the
+                        # invoice since we read it, so only one path records the payment
+                        inv_ref.update({
+                            "status": "paid",
+                            "paid_at": now,
+                            "updated_at": now,
+                            "transaction_reference": reference,
+                            "payout_status": payout_status,
+                            "payer_email": event_data.get("customer", {}).get("email"),
+                            "payment_channel": event_data.get("channel"),
+                            "fees_covered_by_client": is_automated
+                        }, option=db.write_option(last_update_time=inv_doc.update_time))
+                        marked_paid = True
+                    except FailedPrecondition:
+                        logger.info(f"ℹ️ Invoice {invoice_id} changed concurrently; leaving it to the other path.")
+
+                if marked_paid:
+                    record_reference(reference, "invoice", invoice_id, current_data.get("sender_id") or user_id)
                     
+                    # Buffered CRM stats, committed with the next CRM flush
+                    await sync_client_to_crm(
+                        merchant_id=current_data.get("sender_id") or user_id,
+                        email=event_data.get("customer", {}).get("email"),
+                        amount=float(original_amount)
+                    )
+
                     if user_id:
                         # UPDATE USER TOTAL EARNED (The fix for your dashboard card)
                         user_ref = db.collection("users").document(user_id)
@@ -95,8 +115,9 @@ async def paystack_webhook(
             tx_ref = db.collection("paylink_transactions").document(reference)
             tx_doc = tx_ref.get()
             
+            marked_success = False
             if not tx_doc.exists or tx_doc.to_dict().get("status") != "success":
-                tx_ref.set({
+                tx_fields = {
                     "status": "success",
                     "paid_at": now,
                     "payout_status": payout_status,
@@ -105,9 +126,26 @@ async def paystack_webhook(
                     "total_collected": amount_paid_gross,
                     "customer_email": event_data.get("customer", {}).get("email"),
                     "channel": event_data.get("channel")
-                }, merge=True)
-                
+                }
+                try:
+                    # Preconditioned like the invoice path, so a redelivered
+                    # webhook can't record the same payment twice
+                    if tx_doc.exists:
+                        tx_ref.update(tx_fields, option=db.write_option(last_update_time=tx_doc.update_time))
+                    else:
+                        tx_ref.create(tx_fields)
+                    marked_success = True
+                except (FailedPrecondition, AlreadyExists):
+                    logger.info(f"ℹ️ Paylink {reference} changed concurrently; leaving it to the other delivery.")
+
+            if marked_success:
                 if user_id:
+                    await sync_client_to_crm(
+                        merchant_id=user_id,
+                        email=event_data.get("customer", {}).get("email"),
+                        amount=float(original_amount)
+                    )
+
                     # UPDATE USER TOTAL EARNED
                     user_ref = db.collection("users").document(user_id)
                     user_ref.update({
@@ -0,0 +1,68 @@
+# scripts/backfill_client_relationships.py
+"""
+One-off backfill of the client_relationships index from existing invoices.
+Run once after deploying the index: python -m app.scripts.backfill_client_relationships
+"""
+import logging
+from collections import defaultdict
+
+from app.core.firebase import db
+from app.services.client_relationships import COLLECTION, normalize_contact, relationship_id
+
+logger = logging.getLogger("backfill_client_relationships")
+
+PUBLISHED_STATUSES = ["pending", "paid", "overdue", "sent"]
+
+
+def backfill():
+    stats = defaultdict(lambda: {"invoice_count": 0, "first": None, "last": None})
+
+    invoices = db.collection("invoices").where("status", "in", PUBLISHED_STATUSES).stream()
+    for doc in invoices:
+        inv = doc.to_dict()
+        sender_id = inv.get("sender_id")
+        published_at = inv.get("published_at") or inv.get("created_at")
+        if not sender_id:
+            continue
+
+        for kind, value in (("email", inv.get("client_email")), ("phone", inv.get("client_phone"))):
+            contact = normalize_contact(kind, value)
+            if not contact:
+                continue
+            entry = stats[(sender_id, kind, contact)]
+            entry["invoice_count"] += 1
+            if published_at and (entry["first"] is None or published_at < entry["first"][0]):
+                entry["first"] = (published_at, doc.id)
+            if published_at and (entry["last"] is None or published_at > entry["last"][0]):
+                entry["last"] = (published_at, doc.id)
+
+    batch = db.batch()
+    pending = 0
+    for (sender_id, kind, contact), entry in stats.items():
+        ref = db.collection(COLLECTION).document(relationship_id(sender_id, kind, contact))
+        fields = {
+            "sender_id": sender_id,
+            "contact_type": kind,
+            "contact_hash": ref.id.split("_", 1)[1],
+            "invoice_count": entry["invoice_count"],
+        }
+        if entry["first"]:
+            fields["first_invoice_at"], fields["first_invoice_id"] = entry["first"]
+        if entry["last"]:
+            fields["last_contact_at"], fields["last_invoice_id"] = entry["last"]
+        batch.set(ref, fields)
+        pending += 1
+        if pending >= 400:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    if pending:
+        batch.commit()
+
+    logger.info(f"Client relationship backfill complete: {len(stats)} entries written.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    backfill()
@@ -0,0 +1,50 @@
+# scripts/backfill_payment_references.py
+"""
+One-off backfill of the payment_references index from existing invoices and
+paylink transactions.
+Run once after deploying the index: python -m app.scripts.backfill_payment_references
+"""
+import logging
+
+from app.core.firebase import db
+from app.services.payment_references import record_reference
+
+logger = logging.getLogger("backfill_payment_references")
+
+
+def backfill():
+    batch = db.batch()
+    pending = 0
+    written = 0
+
+    def add(reference, source_type, doc_id, user_id):
+        nonlocal batch, pending, written
+        record_reference(reference, source_type, doc_id, user_id, batch=batch)
+        pending += 1
+        written += 1
+        if pending >= 400:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+
+    invoices = db.collection("invoices").select(["paystack_reference", "transaction_reference", "sender_id"]).stream()
+    for doc in invoices:
+        inv = doc.to_dict() or {}
+        references = {inv.get("paystack_reference"), inv.get("transaction_reference")}
+        for reference in filter(None, references):
+            add(reference, "invoice", doc.id, inv.get("sender_id"))
+
+    # Paylink transactions are keyed by their Paystack reference
+    transactions = db.collection("paylink_transactions").select(["user_id"]).stream()
+    for doc in transactions:
+        add(doc.id, "paylink", doc.id, (doc.to_dict() or {}).get("user_id"))
+
+    if pending:
+        batch.commit()
+
+    logger.info(f"Payment reference backfill complete: {written} entries written.")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    backfill()
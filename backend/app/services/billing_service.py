@@ -1,21 +1,46 @@
 # app/services/billing_service.py
+import asyncio
 import logging
+import weakref
 import httpx
 from app.core.config import settings
 
 logger = logging.getLogger("payla.billing")
 
+RESEND_URL = "https://api.resend.com/emails"
+RESEND_TIMEOUT = 15.0
+# Keep-alive connections shared by every billing send on a loop
+RESEND_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=10)
+
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+
+
+def get_resend_client() -> httpx.AsyncClient:
+    """Pooled HTTP client for Resend, one per event loop."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            timeout=RESEND_TIMEOUT,
+            limits=RESEND_LIMITS,
+            headers={"Authorization": f"Bearer {settings.RESEND_API_KEY}"},
+        )
+        _clients[loop] = client
+    return client
+
+
+async def close_resend_clients() -> None:
+    """Close the running loop's Resend client (call on shutdown)."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
+
+
 async def dispatch_billing_email(to_email, subject, html, sender):
     """
     High-priority dispatcher for billing using Resend directly.
     Bypasses reminder logic to ensure delivery.
     """
-    url = "https://api.resend.com/emails"
-    headers = {
-        "Authorization": f"Bearer {settings.RESEND_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
     payload = {
         "from": f"Payla Billing <{sender}>", # e.g. billing.noreply@payla.vip
         "to": [to_email],
@@ -27,8 +52,7 @@ async def dispatch_billing_email(to_email, subject, html, sender):
     }
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, headers=headers, json=payload)
+        response = await get_resend_client().post(RESEND_URL, json=payload)
             
         if response.status_code in [200, 201]:
             logger.info(f"📩 Billing email delivered via Resend to {to_email}")
@@ -39,4 +63,4 @@ async def dispatch_billing_email(to_email, subject, html, sender):
 
     except Exception as e:
         logger.error(f"💥 Critical Failure in billing dispatcher: {str(e)}")
-        return False
\ No newline at end of file
+        return False
@@ -0,0 +1,121 @@
+# app/services/client_relationships.py
+"""
+Client relationship index.
+
+One document per (sender_id, contact) in `client_relationships`, where the
+contact is a normalized email or phone. The document id is derived from a
+hash of the contact, so "has this merchant invoiced this client before?" is
+a point read instead of a query across the invoices collection.
+"""
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from google.cloud import firestore
+
+from app.core.firebase import db
+
+logger = logging.getLogger("payla")
+
+COLLECTION = "client_relationships"
+
+
+def normalize_contact(kind: str, value: Optional[str]) -> Optional[str]:
+    if not value:
+        return None
+    value = value.strip()
+    if kind == "email":
+        value = value.lower()
+        return value if "@" in value else None
+    # Phones are stored as +<country><number> by normalize_phone
+    digits = "".join(ch for ch in value if ch.isdigit())
+    return f"+{digits}" if digits else None
+
+
+def relationship_id(sender_id: str, kind: str, contact: str) -> str:
+    digest = hashlib.sha256(f"{kind}:{contact}".encode("utf-8")).hexdigest()[:32]
+    return f"{sender_id}_{digest}"
+
+
+def _contacts(email: Optional[str], phone: Optional[str]) -> List[Tuple[str, str]]:
+    contacts = []
+    for kind, value in (("email", email), ("phone", phone)):
+        contact = normalize_contact(kind, value)
+        if contact:
+            contacts.append((kind, contact))
+    return contacts
+
+
+def _refs(sender_id: str, email: Optional[str], phone: Optional[str]):
+    return [
+        (kind, contact, db.collection(COLLECTION).document(relationship_id(sender_id, kind, contact)))
+        for kind, contact in _contacts(email, phone)
+    ]
+
+
+async def get_relationships(sender_id: str, email: Optional[str], phone: Optional[str]) -> Dict[str, dict]:
+    """Point-read the index entries for a client's email and phone (kind -> data)."""
+    refs = _refs(sender_id, email, phone)
+    if not refs:
+        return {}
+
+    snaps = await asyncio.to_thread(lambda: list(db.get_all([ref for _, _, ref in refs])))
+    by_path = {snap.reference.path: snap for snap in snaps}
+
+    found = {}
+    for kind, _, ref in refs:
+        snap = by_path.get(ref.path)
+        if snap is not None and snap.exists:
+            found[kind] = snap.to_dict()
+    return found
+
+
+def is_returning_client(relationships: Dict[str, dict]) -> bool:
+    """
+    True if the merchant has published an invoice to this email or phone
+    before, given get_relationships() read before the current invoice is recorded.
+    """
+    return any(data.get("invoice_count", 0) > 0 for data in relationships.values())
+
+
+async def record_invoice_published(
+    sender_id: str,
+    email: Optional[str],
+    phone: Optional[str],
+    invoice_id: str,
+    existing: Optional[Dict[str, dict]] = None,
+) -> None:
+    """
+    Upsert the index entries after an invoice is published.
+    `existing` is the result of get_relationships() for the same client,
+    used to decide whether first_invoice_at needs to be written.
+    """
+    refs = _refs(sender_id, email, phone)
+    if not refs:
+        return
+
+    existing = existing or {}
+    now = datetime.now(timezone.utc)
+    batch = db.batch()
+
+    for kind, contact, ref in refs:
+        fields = {
+            "sender_id": sender_id,
+            "contact_type": kind,
+            "contact_hash": ref.id.split("_", 1)[1],
+            "invoice_count": firestore.Increment(1),
+            "last_contact_at": now,
+            "last_invoice_id": invoice_id,
+        }
+        if kind not in existing:
+            fields["first_invoice_at"] = now
+            fields["first_invoice_id"] = invoice_id
+        batch.set(ref, fields, merge=True)
+
+    try:
+        await asyncio.to_thread(batch.commit)
+    except Exception as e:
+        logger.error(f"Failed to update client relationship index for {sender_id}: {e}")
@@ -0,0 +1,211 @@
+# app/services/logo_cache.py
+"""
+Merchant logo byte cache.
+
+Logos are fetched once, decoded and downscaled to receipt size with Pillow,
+and kept as PNG bytes in a small in-memory LRU backed by a disk cache.
+Entries older than REVALIDATE_AFTER are revalidated with a conditional GET
+(ETag / Last-Modified), so an unchanged logo costs a 304 instead of a
+download. If Cloudinary is unreachable the last good copy is served. The
+disk cache is pruned by age and total size, like the receipt PDF cache.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import httpx
+from PIL import Image as PILImage
+
+logger = logging.getLogger("payla")
+
+MEMORY_ITEMS = 128              # Logos held in memory
+REVALIDATE_AFTER = 6 * 3600     # Seconds before an entry is revalidated upstream
+FETCH_TIMEOUT = 5.0
+TARGET_PX = 400                 # Longest side; ~1.3in at 300dpi on receipts
+CACHE_DIR = Path(os.getenv("LOGO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "payla_logos")))
+CACHE_MAX_BYTES = int(os.getenv("LOGO_CACHE_MAX_MB", "64")) * 1024 * 1024
+CACHE_MAX_AGE = 30 * 24 * 3600  # Seconds since a logo was last fetched or revalidated
+CACHE_PRUNE_EVERY = 50          # Disk writes between prunes
+
+
+def _key(url: str) -> str:
+    return hashlib.sha1(f"{url}|{TARGET_PX}".encode("utf-8")).hexdigest()
+
+
+def _downscale(raw: bytes) -> bytes:
+    """Decode once and shrink to the receipt's target size (PNG keeps transparency)."""
+    try:
+        with PILImage.open(BytesIO(raw)) as img:
+            img.thumbnail((TARGET_PX, TARGET_PX))
+            if img.mode not in ("RGB", "RGBA"):
+                img = img.convert("RGBA")
+            out = BytesIO()
+            img.save(out, format="PNG", optimize=True)
+            return out.getvalue()
+    except Exception:
+        # Formats Pillow can't decode (e.g. SVG) are passed through untouched
+        return raw
+
+
+class LogoCache:
+    def __init__(self, memory_items: int = MEMORY_ITEMS):
+        self.memory_items = memory_items
+        self._memory: "OrderedDict[str, Tuple[bytes, dict]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+        self._writes = 0
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self._prune_disk()
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=FETCH_TIMEOUT, follow_redirects=True)
+        return self._client
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    # ---------------------------------------------------------------
+    # Memory / disk tiers
+    # ---------------------------------------------------------------
+
+    def _remember(self, key: str, data: bytes, meta: dict) -> None:
+        self._memory[key] = (data, meta)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    @staticmethod
+    def _read_disk(key: str) -> Optional[Tuple[bytes, dict]]:
+        data_path, meta_path = CACHE_DIR / f"{key}.img", CACHE_DIR / f"{key}.json"
+        try:
+            return data_path.read_bytes(), json.loads(meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write_disk(key: str, data: Optional[bytes], meta: dict) -> None:
+        if data is not None:
+            tmp = CACHE_DIR / f"{key}.img.{os.getpid()}.tmp"
+            tmp.write_bytes(data)
+            os.replace(tmp, CACHE_DIR / f"{key}.img")
+        (CACHE_DIR / f"{key}.json").write_text(json.dumps(meta))
+
+    @staticmethod
+    def _prune_disk() -> None:
+        """Drop logos untouched for CACHE_MAX_AGE, then the stalest until under CACHE_MAX_BYTES."""
+        now = time.time()
+        entries: Dict[str, list] = {}  # key -> [last touched, total size]
+        for path in CACHE_DIR.iterdir():
+            if path.suffix not in (".img", ".json"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entry = entries.setdefault(path.stem, [0.0, 0])
+            entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+
+        total = sum(size for _, size in entries.values())
+        for key, (touched, size) in sorted(entries.items(), key=lambda item: item[1][0]):
+            if now - touched <= CACHE_MAX_AGE and total <= CACHE_MAX_BYTES:
+                break
+            for suffix in (".img", ".json"):
+                (CACHE_DIR / f"{key}{suffix}").unlink(missing_ok=True)
+            total -= size
+
+    async def _persist(self, key: str, data: Optional[bytes], meta: dict) -> None:
+        await asyncio.to_thread(self._write_disk, key, data, meta)
+        self._writes += 1
+        if self._writes % CACHE_PRUNE_EVERY == 0:
+            await asyncio.to_thread(self._prune_disk)
+
+    # ---------------------------------------------------------------
+    # Fetch / revalidate
+    # ---------------------------------------------------------------
+
+    async def _refresh(self, url: str, key: str, cached: Optional[Tuple[bytes, dict]]) -> Optional[bytes]:
+        headers = {}
+        if cached:
+            meta = cached[1]
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        try:
+            resp = await self._http().get(url, headers=headers)
+        except Exception as e:
+            logger.warning(f"Logo fetch failed for {url}: {e}")
+            return cached[0] if cached else None
+
+        if resp.status_code == 304 and cached:
+            data, meta = cached[0], {**cached[1], "checked_at": time.time()}
+            await self._persist(key, None, meta)
+        elif resp.status_code == 200:
+            data = await asyncio.to_thread(_downscale, resp.content)
+            meta = {
+                "url": url,
+                "etag": resp.headers.get("etag"),
+                "last_modified": resp.headers.get("last-modified"),
+                "checked_at": time.time(),
+            }
+            await self._persist(key, data, meta)
+        else:
+            logger.warning(f"Logo fetch for {url} returned {resp.status_code}")
+            return cached[0] if cached else None
+
+        self._remember(key, data, meta)
+        return data
+
+    async def _load(self, url: str, key: str) -> Optional[bytes]:
+        cached = await asyncio.to_thread(self._read_disk, key)
+        if cached and time.time() - cached[1].get("checked_at", 0) < REVALIDATE_AFTER:
+            self._remember(key, *cached)
+            return cached[0]
+        return await self._refresh(url, key, cached)
+
+    async def get(self, url: Optional[str]) -> Optional[bytes]:
+        """Receipt-sized logo bytes for `url`, or None if it can't be fetched."""
+        if not url:
+            return None
+        key = _key(url)
+
+        entry = self._memory.get(key)
+        if entry and time.time() - entry[1].get("checked_at", 0) < REVALIDATE_AFTER:
+            self._memory.move_to_end(key)
+            return entry[0]
+
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._load(url, key))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(pending)
+
+    def invalidate(self, url: Optional[str]) -> None:
+        """Drop a logo from memory and disk (call when a merchant replaces it)."""
+        if not url:
+            return
+        key = _key(url)
+        self._memory.pop(key, None)
+        for suffix in (".img", ".json"):
+            try:
+                (CACHE_DIR / f"{key}{suffix}").unlink()
+            except FileNotFoundError:
+                pass
+
+
+logo_cache = LogoCache()
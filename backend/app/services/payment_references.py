@@ -0,0 +1,93 @@
+# app/services/payment_references.py
+"""
+Paystack reference index.
+
+One document per Paystack reference in `payment_references`, pointing at the
+invoice or paylink transaction it pays for. Webhooks and payout lookups
+resolve a reference with a single point read instead of querying invoices
+by transaction_reference or probing collections by guessed document ids.
+"""
+
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+
+from app.core.firebase import db
+
+logger = logging.getLogger("payla")
+
+COLLECTION = "payment_references"
+
+SOURCE_COLLECTIONS = {
+    "invoice": "invoices",
+    "paylink": "paylink_transactions",
+}
+
+
+def reference_ref(reference: str):
+    return db.collection(COLLECTION).document(reference)
+
+
+def record_reference(reference: str, source_type: str, doc_id: str, user_id: Optional[str], batch=None) -> None:
+    """
+    Point `reference` at its source document. Pass a WriteBatch to write the
+    entry together with the source document; otherwise it is written directly.
+    """
+    if not reference:
+        return
+    fields = {
+        "source_type": source_type,
+        "doc_path": f"{SOURCE_COLLECTIONS[source_type]}/{doc_id}",
+        "user_id": user_id,
+        "updated_at": datetime.now(timezone.utc),
+    }
+    if batch is not None:
+        batch.set(reference_ref(reference), fields, merge=True)
+    else:
+        reference_ref(reference).set(fields, merge=True)
+
+
+def lookup_reference(reference: str) -> Optional[dict]:
+    """Index entry for a reference, or None if it was never recorded."""
+    if not reference:
+        return None
+    snap = reference_ref(reference).get()
+    return snap.to_dict() if snap.exists else None
+
+
+def source_document(reference: str):
+    """(source_type, DocumentReference) for a reference, or (None, None)."""
+    entry = lookup_reference(reference)
+    if not entry or not entry.get("doc_path"):
+        return None, None
+    return entry.get("source_type"), db.document(entry["doc_path"])
+
+
+def find_source_document(reference: str, source_type: Optional[str] = None):
+    """
+    DocumentReference behind a reference, falling back to the source
+    collections for references recorded before the index existed (both of
+    them when `source_type` is unknown). Returns None rather than a guessed
+    path when no document matches.
+    """
+    _, ref = source_document(reference)
+    if ref is not None:
+        return ref
+
+    if source_type in (None, "paylink"):
+        # Paylink transactions are keyed by their reference
+        ref = db.collection(SOURCE_COLLECTIONS["paylink"]).document(reference)
+        if ref.get(field_paths=["status"]).exists:
+            return ref
+
+    if source_type in (None, "invoice"):
+        matches = (
+            db.collection("invoices")
+            .where("transaction_reference", "==", reference)
+            .select(["transaction_reference"])
+            .limit(1)
+            .get()
+        )
+        if matches:
+            return matches[0].reference
+    return None
@@ -0,0 +1,176 @@
+# app/services/receipt_renderer.py
+"""
+Receipt rendering and caching.
+
+Receipts are rendered by reportlab in a small process pool so a PDF build
+never blocks the event loop. Rendered PDFs are written to a local disk cache
+and mirrored to Firebase Storage, keyed by reference plus a hash of the
+branding and content that went into them. A repeat download streams the
+stored file; a branding change produces a new key and a fresh render. The
+disk cache is pruned by age and total size; Storage remains the durable copy.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+from app.core.firebase import storage_bucket
+from app.utils.receipt_pdf import LAYOUT_VERSION, render_receipt
+
+logger = logging.getLogger("payla")
+
+RENDER_WORKERS = 2          # reportlab processes
+RENDER_QUEUE_MAX = 16       # Renders submitted or waiting at once (backpressure beyond this)
+CACHE_DIR = Path(os.getenv("RECEIPT_CACHE_DIR", os.path.join(tempfile.gettempdir(), "payla_receipts")))
+CACHE_MAX_BYTES = int(os.getenv("RECEIPT_CACHE_MAX_MB", "256")) * 1024 * 1024
+CACHE_MAX_AGE = 7 * 24 * 3600   # Seconds a local PDF is kept (Storage still has it)
+CACHE_PRUNE_EVERY = 50          # Local writes between prunes
+STORAGE_PREFIX = "receipts"
+
+SpecFactory = Callable[[], Awaitable[dict]]
+
+
+def receipt_key(kind: str, reference: str, fingerprint: dict) -> str:
+    """Cache key: reference plus a hash of everything that shapes the PDF."""
+    payload = json.dumps({"v": LAYOUT_VERSION, **fingerprint}, sort_keys=True, default=str)
+    digest = hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+    safe_ref = "".join(ch for ch in reference if ch.isalnum() or ch in "-_")
+    return f"{kind}_{safe_ref}_{digest}"
+
+
+class ReceiptRenderer:
+    def __init__(self, workers: int = RENDER_WORKERS, queue_max: int = RENDER_QUEUE_MAX):
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._slots = asyncio.Semaphore(queue_max)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._uploads: Set[asyncio.Task] = set()
+        self._writes = 0
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self._prune_local()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # Spawned, not forked: workers must not inherit the event loop,
+            # the Firestore/gRPC channels or the log listener thread
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # ---------------------------------------------------------------
+    # Cache tiers
+    # ---------------------------------------------------------------
+
+    @staticmethod
+    def _path(key: str) -> Path:
+        return CACHE_DIR / f"{key}.pdf"
+
+    @staticmethod
+    def _write_local(path: Path, pdf: bytes) -> None:
+        # Write-then-rename so a concurrent reader never sees a partial file
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(pdf)
+        os.replace(tmp, path)
+
+    @staticmethod
+    def _prune_local() -> None:
+        """Drop cached PDFs older than CACHE_MAX_AGE, then the oldest until under CACHE_MAX_BYTES."""
+        now = time.time()
+        files = []
+        for path in CACHE_DIR.glob("*.pdf"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if now - mtime <= CACHE_MAX_AGE and total <= CACHE_MAX_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    @staticmethod
+    def _download(key: str) -> Optional[bytes]:
+        if storage_bucket is None:
+            return None
+        blob = storage_bucket.blob(f"{STORAGE_PREFIX}/{key}.pdf")
+        if not blob.exists():
+            return None
+        return blob.download_as_bytes()
+
+    @staticmethod
+    def _upload(key: str, pdf: bytes) -> None:
+        if storage_bucket is None:
+            return
+        try:
+            blob = storage_bucket.blob(f"{STORAGE_PREFIX}/{key}.pdf")
+            blob.upload_from_string(pdf, content_type="application/pdf")
+        except Exception as e:
+            logger.warning(f"Receipt {key} not mirrored to storage: {e}")
+
+    # ---------------------------------------------------------------
+    # Rendering
+    # ---------------------------------------------------------------
+
+    async def render(self, kind: str, spec: dict) -> bytes:
+        """Render in the process pool, waiting for a slot when the queue is full."""
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor(), render_receipt, kind, spec)
+
+    async def _produce(self, kind: str, key: str, build_spec: SpecFactory) -> Path:
+        path = self._path(key)
+
+        pdf = await asyncio.to_thread(self._download, key)
+        if pdf is None:
+            pdf = await self.render(kind, await build_spec())
+            # Keep a reference so the mirror upload isn't garbage-collected mid-flight
+            upload = asyncio.get_running_loop().create_task(asyncio.to_thread(self._upload, key, pdf))
+            self._uploads.add(upload)
+            upload.add_done_callback(self._uploads.discard)
+            logger.info(f"🧾 Rendered receipt {key}")
+
+        await asyncio.to_thread(self._write_local, path, pdf)
+        self._writes += 1
+        if self._writes % CACHE_PRUNE_EVERY == 0:
+            await asyncio.to_thread(self._prune_local)
+        return path
+
+    async def get_path(self, kind: str, key: str, build_spec: SpecFactory) -> Path:
+        """
+        Local file for a receipt, rendering it only on a cache miss.
+        `build_spec` is awaited only when a render is needed, so logo
+        downloads and other prep are skipped for cached receipts.
+        Concurrent requests for the same key share a single render.
+        """
+        path = self._path(key)
+        if path.exists():
+            return path
+
+        pending = self._inflight.get(key)
+        if pending is None:
+            pending = asyncio.ensure_future(self._produce(kind, key, build_spec))
+            self._inflight[key] = pending
+            pending.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(pending)
+
+
+receipt_renderer = ReceiptRenderer()
@@ -0,0 +1,189 @@
+# app/services/reminder_dispatch.py
+"""
+Bounded dispatch engine for the reminder loop.
+
+Jobs (one per reminder or paid-invoice notification) go through a bounded
+queue drained by a fixed pool of workers. Provider calls inside a job are
+additionally gated by a per-channel semaphore, so a large backlog drains at
+a steady rate without flooding Meta, Termii or Resend. Each channel is
+also paced to its provider's request rate. Jobs run in the context of the
+code that submitted them, so per-run Firestore accounting (track_run) sees
+their reads and writes.
+"""
+
+import asyncio
+import contextvars
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from app.core.metrics import background_queue_depth
+
+logger = logging.getLogger("payla.reminders")
+
+WORKERS = 20
+QUEUE_MAX = 500
+CHANNEL_LIMITS: Dict[str, int] = {
+    "whatsapp": 10,
+    "sms": 5,
+    "email": 10,
+}
+# Provider request-rate ceilings (sends per second)
+CHANNEL_RATES: Dict[str, float] = {
+    "whatsapp": 20.0,   # Meta Cloud API
+    "sms": 5.0,         # Termii
+    "email": 2.0,       # Resend default plan
+}
+METRICS_LOG_INTERVAL = 60
+
+Job = Callable[[], Awaitable[None]]
+
+
+class _RatePacer:
+    """Spaces calls at least 1/rate seconds apart."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            if self._next_at > now:
+                await asyncio.sleep(self._next_at - now)
+                now = self._next_at
+            self._next_at = now + self.interval
+
+
+class ReminderDispatcher:
+    def __init__(
+        self,
+        workers: int = WORKERS,
+        queue_max: int = QUEUE_MAX,
+        channel_limits: Dict[str, int] = CHANNEL_LIMITS,
+        channel_rates: Dict[str, float] = CHANNEL_RATES,
+    ):
+        self.workers = workers
+        self.queue_max = queue_max
+        self.channel_limits = dict(channel_limits)
+        self.channel_rates = dict(channel_rates)
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._pacers: Dict[str, _RatePacer] = {}
+        self._tasks: List[asyncio.Task] = []
+
+        self._busy = 0
+        self._in_flight: Dict[str, int] = {ch: 0 for ch in self.channel_limits}
+        self._completed = 0
+        self._failed = 0
+
+    # ---------------------------------------------------------------
+    # Lifecycle
+    # ---------------------------------------------------------------
+
+    def start(self) -> None:
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.queue_max)
+        self._ensure_channels()
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._report_forever()))
+        logger.info(f"⚙️ Reminder dispatcher started | workers={self.workers} | limits={self.channel_limits}")
+
+    def _ensure_channels(self) -> None:
+        # Other loops (billing) share the channel limits without needing the workers
+        if self._semaphores:
+            return
+        self._semaphores = {
+            ch: asyncio.Semaphore(limit) for ch, limit in self.channel_limits.items()
+        }
+        self._pacers = {ch: _RatePacer(rate) for ch, rate in self.channel_rates.items()}
+
+    async def _worker(self, index: int) -> None:
+        while True:
+            job, done, context = await self._queue.get()
+            self._busy += 1
+            try:
+                # Run in the submitter's context (its accounting scope), not the worker's
+                await asyncio.get_running_loop().create_task(job(), context=context)
+                self._completed += 1
+                if not done.done():
+                    done.set_result(None)
+            except Exception as e:
+                self._failed += 1
+                logger.exception(f"❌ Dispatch worker {index} job failed: {e}")
+                if not done.done():
+                    done.set_exception(e)
+            finally:
+                self._busy -= 1
+                self._queue.task_done()
+
+    # ---------------------------------------------------------------
+    # Public API
+    # ---------------------------------------------------------------
+
+    async def submit(self, job: Job) -> asyncio.Future:
+        """
+        Queue a job, waiting while the queue is full (backpressure).
+        Returns a future resolved when the job finishes.
+        """
+        self.start()
+        done = asyncio.get_running_loop().create_future()
+        await self._queue.put((job, done, contextvars.copy_context()))
+        return done
+
+    @asynccontextmanager
+    async def channel(self, name: str):
+        """
+        Hold one of the channel's provider slots for the duration of a send,
+        after waiting for the channel's rate pacer.
+        """
+        self._ensure_channels()
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+
+        pacer = self._pacers.get(name)
+        if pacer is not None:
+            await pacer.wait()
+
+        async with semaphore:
+            self._in_flight[name] += 1
+            try:
+                yield
+            finally:
+                self._in_flight[name] -= 1
+
+    async def limited(self, name: str, awaitable: Awaitable):
+        async with self.channel(name):
+            return await awaitable
+
+    def metrics(self) -> dict:
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "queue_max": self.queue_max,
+            "workers": self.workers,
+            "workers_busy": self._busy,
+            "in_flight": dict(self._in_flight),
+            "completed": self._completed,
+            "failed": self._failed,
+        }
+
+    async def _report_forever(self) -> None:
+        while True:
+            await asyncio.sleep(METRICS_LOG_INTERVAL)
+            m = self.metrics()
+            if m["queue_depth"] or m["workers_busy"]:
+                logger.info(
+                    f"📊 Dispatch | queue={m['queue_depth']}/{m['queue_max']} "
+                    f"| busy={m['workers_busy']}/{m['workers']} | in_flight={m['in_flight']} "
+                    f"| done={m['completed']} | failed={m['failed']}"
+                )
+
+
+reminder_dispatcher = ReminderDispatcher()
+background_queue_depth.track(("reminder",), lambda: reminder_dispatcher.metrics()["queue_depth"])
@@ -0,0 +1,219 @@
+# app/services/reminder_leases.py
+"""
+Lease-based claiming of reminders.
+
+A worker claims a whole page of due reminders in one Firestore transaction,
+stamping each with its owner id and a lease expiry. While the work runs the
+leases are renewed in batches, and when the page is done they are released
+in a single batched write. A crashed worker simply lets its leases lapse.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import datetime, timezone, timedelta
+from typing import Iterator, List, Optional, Set
+from uuid import uuid4
+
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+from app.core.firebase import db
+
+logger = logging.getLogger("payla.reminders")
+
+PAGE_SIZE = 50                           # Reminders claimed per transaction
+LEASE_TTL = timedelta(minutes=10)        # Replaces the old LOCK_TIMEOUT
+RENEW_INTERVAL = 3 * 60                  # Seconds between lease renewals
+MAX_BATCH_WRITES = 400                   # Stay under Firestore's 500-write limit
+
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow().replace(tzinfo=timezone.utc)
+
+
+def _is_claimable(data: dict, now: datetime) -> bool:
+    if data.get("status") != "pending" or not data.get("active", True):
+        return False
+
+    expires = data.get("lease_expires_at")
+    if expires is None:
+        return True
+    if expires.tzinfo is None:
+        expires = expires.replace(tzinfo=timezone.utc)
+    # A live lease is never re-claimed, not even our own: that reminder is
+    # already queued or mid-send in this process
+    return expires <= now
+
+
+def stream_due_pages(
+    until: datetime,
+    since: Optional[datetime] = None,
+    page_size: int = PAGE_SIZE,
+) -> Iterator[List[dict]]:
+    """
+    Yield pending reminders with since < next_send <= until, one page at a
+    time, using a start_after cursor so the full result is never held in memory.
+    """
+    base = (
+        db.collection("reminders")
+        .where(filter=FieldFilter("status", "==", "pending"))
+        .where(filter=FieldFilter("active", "==", True))
+        .where(filter=FieldFilter("next_send", "<=", until))
+    )
+    if since is not None:
+        base = base.where(filter=FieldFilter("next_send", ">", since))
+    base = base.order_by("next_send").limit(page_size)
+
+    cursor = None
+    while True:
+        query = base.start_after(cursor) if cursor is not None else base
+        docs = list(query.stream())
+        if not docs:
+            return
+
+        page = []
+        for doc in docs:
+            data = doc.to_dict()
+            data["id"] = doc.id
+            page.append(data)
+        yield page
+
+        if len(docs) < page_size:
+            return
+        cursor = docs[-1]
+
+
+class ReminderLeases:
+    def __init__(self, owner: str = OWNER_ID, ttl: timedelta = LEASE_TTL):
+        self.owner = owner
+        self.ttl = ttl
+        self._held: Set[str] = set()
+
+    @property
+    def held(self) -> int:
+        return len(self._held)
+
+    # ---------------------------------------------------------------
+    # Claim / release
+    # ---------------------------------------------------------------
+
+    def _claim_sync(self, reminder_ids: List[str]) -> List[dict]:
+        refs = [db.collection("reminders").document(rid) for rid in reminder_ids]
+
+        @firestore.transactional
+        def txn(transaction):
+            now = _utcnow()
+            expires = now + self.ttl
+            claimed = []
+
+            for snap in db.get_all(refs, transaction=transaction):
+                if not snap.exists:
+                    continue
+                data = snap.to_dict()
+                if not _is_claimable(data, now):
+                    continue
+
+                lease = {"lease_owner": self.owner, "lease_expires_at": expires}
+                transaction.update(snap.reference, lease)
+                data.update(lease)
+                data["id"] = snap.id
+                claimed.append(data)
+
+            return claimed
+
+        return txn(db.transaction())
+
+    async def claim(self, reminder_ids: List[str]) -> List[dict]:
+        """Lease every claimable reminder in the page with one transaction."""
+        # Full sweeps reload reminders we already hold; never dispatch them twice
+        reminder_ids = [rid for rid in reminder_ids if rid not in self._held]
+        claimed: List[dict] = []
+        for i in range(0, len(reminder_ids), PAGE_SIZE):
+            page = reminder_ids[i:i + PAGE_SIZE]
+            try:
+                rows = await asyncio.to_thread(self._claim_sync, page)
+            except Exception as e:
+                logger.error(f"❌ Lease claim failed for {len(page)} reminders: {e}")
+                continue
+            claimed.extend(rows)
+
+        self._held.update(r["id"] for r in claimed)
+        if len(claimed) < len(reminder_ids):
+            logger.info(f"🔒 Claimed {len(claimed)}/{len(reminder_ids)} reminders (rest leased elsewhere)")
+        return claimed
+
+    def forget(self, reminder_id: str) -> None:
+        """Drop a lease whose document was deleted or rewritten by its processor."""
+        self._held.discard(reminder_id)
+
+    @staticmethod
+    def _update_each(refs: list, fields: dict) -> List[str]:
+        missing = []
+        for ref in refs:
+            try:
+                ref.update(fields)
+            except NotFound:
+                missing.append(ref.id)
+        return missing
+
+    def _write_batched(self, reminder_ids: List[str], fields: dict) -> List[str]:
+        """
+        Update every reminder in batches. A batch that fails because one of
+        its documents was deleted is replayed per document, so the others are
+        still written. Returns the ids that no longer exist.
+        """
+        missing: List[str] = []
+        for i in range(0, len(reminder_ids), MAX_BATCH_WRITES):
+            refs = [db.collection("reminders").document(rid) for rid in reminder_ids[i:i + MAX_BATCH_WRITES]]
+            batch = db.batch()
+            for ref in refs:
+                batch.update(ref, fields)
+            try:
+                batch.commit()
+            except NotFound:
+                missing.extend(self._update_each(refs, fields))
+
+        # Deleted elsewhere (e.g. by the cleanup job): stop renewing them
+        self._held.difference_update(missing)
+        return missing
+
+    async def release(self, reminder_ids: List[str]) -> None:
+        """Clear leases this worker still holds, in one batched write."""
+        ids = [rid for rid in reminder_ids if rid in self._held]
+        self._held.difference_update(ids)
+        if not ids:
+            return
+        try:
+            await asyncio.to_thread(
+                self._write_batched, ids, {"lease_owner": None, "lease_expires_at": None}
+            )
+        except Exception as e:
+            # Leases lapse on their own after LEASE_TTL
+            logger.error(f"❌ Lease release failed for {len(ids)} reminders: {e}")
+
+    # ---------------------------------------------------------------
+    # Renewal
+    # ---------------------------------------------------------------
+
+    async def renew_forever(self) -> None:
+        """Extend every held lease so long-running sends are not stolen."""
+        while True:
+            await asyncio.sleep(RENEW_INTERVAL)
+            ids = list(self._held)
+            if not ids:
+                continue
+            try:
+                await asyncio.to_thread(
+                    self._write_batched, ids, {"lease_expires_at": _utcnow() + self.ttl}
+                )
+                logger.debug(f"🔒 Renewed {len(ids)} reminder leases")
+            except Exception as e:
+                logger.error(f"❌ Lease renewal failed: {e}")
+
+
+reminder_leases = ReminderLeases()
@@ -0,0 +1,174 @@
+# app/services/reminder_scheduler.py
+"""
+In-memory scheduler for due reminders.
+
+Reminders due within the next HORIZON are preloaded into a min-heap keyed by
+next_send and fired at their exact time. The horizon is refilled
+incrementally (only the newly uncovered time slice is queried), and
+reminders created by this process are pushed in directly via enqueue().
+"""
+
+import asyncio
+import heapq
+import logging
+from datetime import datetime, timezone, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.services.reminder_leases import stream_due_pages
+
+logger = logging.getLogger("payla.reminders")
+
+HORIZON = timedelta(minutes=30)
+REFILL_INTERVAL = 5 * 60       # Seconds between incremental horizon refills
+FULL_SWEEP_EVERY = 6           # Every Nth refill re-scans everything already due
+
+DispatchFn = Callable[[List[dict]], Awaitable[None]]
+
+
+def _utcnow() -> datetime:
+    return datetime.utcnow().replace(tzinfo=timezone.utc)
+
+
+def _as_utc(dt: datetime) -> datetime:
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+
+class ReminderScheduler:
+    def __init__(self, horizon: timedelta = HORIZON):
+        self.horizon = horizon
+        self._heap: List[Tuple[float, str]] = []
+        self._entries: Dict[str, Tuple[float, dict]] = {}
+        self._horizon_end: Optional[datetime] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    # ---------------------------------------------------------------
+    # Queue management
+    # ---------------------------------------------------------------
+
+    def enqueue(self, reminder: dict) -> None:
+        """
+        Add (or move) a reminder. `reminder` is the Firestore document dict
+        with its id under "id" or "_id". Reminders beyond the loaded horizon
+        are ignored here; the refill that reaches them will load them.
+        """
+        if self._loop is None:
+            return
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is not self._loop:
+            self._loop.call_soon_threadsafe(self._push, reminder)
+        else:
+            self._push(reminder)
+
+    def discard(self, reminder_id: str) -> None:
+        """Forget a reminder; its stale heap entry is skipped when popped."""
+        self._entries.pop(reminder_id, None)
+
+    def _push(self, reminder: dict) -> None:
+        reminder_id = reminder.get("id") or reminder.get("_id")
+        next_send = reminder.get("next_send")
+        if not reminder_id or not next_send:
+            return
+
+        next_send = _as_utc(next_send)
+        if self._horizon_end is None or next_send > self._horizon_end:
+            return
+
+        fire_at = next_send.timestamp()
+        self._entries[reminder_id] = (fire_at, {**reminder, "id": reminder_id})
+        heapq.heappush(self._heap, (fire_at, reminder_id))
+
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def _pop_due(self, now_ts: float) -> List[dict]:
+        due = []
+        while self._heap and self._heap[0][0] <= now_ts:
+            fire_at, reminder_id = heapq.heappop(self._heap)
+            entry = self._entries.get(reminder_id)
+            # Skip entries that were discarded or re-enqueued at another time
+            if entry is None or entry[0] != fire_at:
+                continue
+            del self._entries[reminder_id]
+            due.append(entry[1])
+        return due
+
+    @property
+    def size(self) -> int:
+        return len(self._entries)
+
+    # ---------------------------------------------------------------
+    # Firestore loading
+    # ---------------------------------------------------------------
+
+    async def _load(self, start: Optional[datetime], end: datetime) -> int:
+        pages = stream_due_pages(end, since=start)
+        loaded = 0
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                return loaded
+            for row in page:
+                self._push(row)
+            loaded += len(page)
+
+    async def _refill_forever(self) -> None:
+        refills = 0
+        while True:
+            await asyncio.sleep(REFILL_INTERVAL)
+            try:
+                refills += 1
+                new_end = _utcnow() + self.horizon
+                start = None if refills % FULL_SWEEP_EVERY == 0 else self._horizon_end
+                # Extend the horizon first so enqueue() accepts the new slice
+                previous_end, self._horizon_end = self._horizon_end, new_end
+                loaded = await self._load(start, new_end)
+                logger.info(
+                    f"🗓️ Horizon refilled {'(full sweep)' if start is None else ''}"
+                    f" {previous_end} → {new_end} | loaded={loaded} | queued={self.size}"
+                )
+            except Exception as e:
+                logger.exception(f"❌ Horizon refill failed: {e}")
+
+    # ---------------------------------------------------------------
+    # Main loop
+    # ---------------------------------------------------------------
+
+    async def run(self, dispatch: DispatchFn) -> None:
+        """Fire due reminders through `dispatch` forever."""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._horizon_end = _utcnow() + self.horizon
+
+        loaded = await self._load(None, self._horizon_end)
+        logger.info(f"🗓️ Scheduler primed with {loaded} reminders (horizon {self.horizon})")
+
+        refill_task = asyncio.create_task(self._refill_forever())
+        try:
+            while True:
+                self._wakeup.clear()
+                due = self._pop_due(_utcnow().timestamp())
+                if due:
+                    try:
+                        await dispatch(due)
+                    except Exception as e:
+                        logger.exception(f"❌ Reminder dispatch failed: {e}")
+                    continue
+
+                timeout = None
+                if self._heap:
+                    timeout = max(0.0, self._heap[0][0] - _utcnow().timestamp())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            refill_task.cancel()
+
+
+reminder_scheduler = ReminderScheduler()
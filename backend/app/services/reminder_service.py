@@ -1,7 +1,7 @@
 # services/reminder_service.py
 import asyncio
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 import logging
 from app.models.reminder_model import Reminder, ReminderCreate
 from app.core.firebase import db
@@ -9,13 +9,27 @@ from app.services.channels import send_via_whatsapp, send_via_sms, send_via_emai
 from app.utils.email import generate_email_content
 from app.utils.whatsapp_layla import WHATSAPP_MESSAGES
 from app.utils.sms_layla import SMS_LAYLA
-from app.core.reminder_config import get_delivery_hour_utc, get_quiet_hours_utc
+from app.core.reminder_config import (
+    DEFAULT_TIMEZONE,
+    get_delivery_hour_utc,
+    is_quiet_hours,
+    quiet_hours_end_utc,
+    resolve_timezone,
+    smooth_send_time,
+    timezone_for_phone,
+)
+from app.services.reminder_scheduler import reminder_scheduler
+from app.services.reminder_leases import reminder_leases
+from app.services.client_relationships import get_relationships
 
 logger = logging.getLogger("payla")
 logger.setLevel(logging.INFO)
 
 DELIVERY_HOUR_UTC = get_delivery_hour_utc("WAT")
-QUIET_START_UTC, QUIET_END_UTC = get_quiet_hours_utc("WAT")
+
+MAX_SEND_ATTEMPTS = 3
+RETRY_BASE_SECONDS = 5 * 60   # 5 min, then 10, 20 ... capped below
+RETRY_MAX_SECONDS = 60 * 60
 
 # ---------------------------
 # Template helpers
@@ -32,53 +46,84 @@ def get_layla_email(email_type: str, context: dict, use_html: bool = True) -> st
     return generate_email_content(email_type, context, use_html=use_html)
 
 
-def is_within_quiet_hours(now: datetime, start_hour: int = None, end_hour: int = None) -> bool:
-    """Check if current time is within quiet hours (uses WAT timezone by default)"""
-    if start_hour is None:
-        start_hour = QUIET_START_UTC
-    if end_hour is None:
-        end_hour = QUIET_END_UTC
-    
-    # Handle case where quiet hours span midnight
-    if start_hour > end_hour:
-        return now.hour >= start_hour or now.hour < end_hour
-    else:
-        return start_hour <= now.hour < end_hour
+def is_within_quiet_hours(now: datetime, timezone_code: str = DEFAULT_TIMEZONE) -> bool:
+    """Check if `now` (UTC) is within the recipient timezone's quiet hours"""
+    return is_quiet_hours(now, timezone_code)
+
+
+def quiet_hours_end(now: datetime, timezone_code: str = DEFAULT_TIMEZONE, reminder_key: Optional[str] = None) -> datetime:
+    """
+    Next moment (UTC) at which the recipient's quiet hours are over.
+
+    With a reminder_key the time is spread over the send window after the
+    quiet hours end, so deferred reminders don't all fire at the same second.
+    """
+    end = quiet_hours_end_utc(now, timezone_code)
+    if reminder_key is None:
+        return end
+    return smooth_send_time(end, f"{reminder_key}:{end.date().isoformat()}")
+
 
 # ---------------------------
-# Send messages with retry
+# Durable retry scheduling
 # ---------------------------
-async def send_if_allowed(
-    methods: List[str],
-    invoice: dict,
-    whatsapp_msg: str,
-    sms_msg: str,
-    email_subject: str,
-    email_html: str,
-    email_type: str = "reminder"
-):
-    now = datetime.utcnow().replace(tzinfo=timezone.utc)
-    if is_within_quiet_hours(now):
-        logger.info(f"[{now.isoformat()}] Quiet hours: delaying sends for invoice {invoice.get('invoice_id')}")
-        return
+def retry_delay(attempt: int) -> timedelta:
+    """Exponential backoff for the given (1-based) failed attempt."""
+    return timedelta(seconds=min(RETRY_BASE_SECONDS * 2 ** (attempt - 1), RETRY_MAX_SECONDS))
 
-    for method in methods:
-        try:
-            if method == "whatsapp" and invoice.get("client_phone"):
-                logger.info(f"[{now.isoformat()}] Sending WhatsApp to {invoice['client_phone']}")
-                await send_via_whatsapp(invoice["client_phone"], whatsapp_msg)
 
-            elif method == "sms" and invoice.get("client_phone"):
-                logger.info(f"[{now.isoformat()}] Sending SMS to {invoice['client_phone']}")
-                await send_via_sms(invoice["client_phone"], sms_msg)
+async def reschedule_reminder(reminder_id: str, next_send: datetime, fields: dict = None):
+    """
+    Push a reminder's next_send forward, drop its lease and hand it back to the
+    scheduler. The caller returns immediately; nothing sleeps while it waits.
+    """
+    update = {
+        **(fields or {}),
+        "next_send": next_send,
+        "lease_owner": None,
+        "lease_expires_at": None,
+    }
+    reminder_leases.forget(reminder_id)
+    await asyncio.to_thread(db.collection("reminders").document(reminder_id).update, update)
+    reminder_scheduler.enqueue({"id": reminder_id, "next_send": next_send})
 
-            elif method == "email" and invoice.get("client_email"):
-                logger.info(f"[{now.isoformat()}] Sending Email to {invoice['client_email']} type: {email_type}")
-                result = await send_via_email(invoice["client_email"], email_subject, email_html, email_type=email_type)
-                logger.info(f"[{now.isoformat()}] Email send result: {result}")
 
-        except Exception as e:
-            logger.error(f"[{now.isoformat()}] Failed to send {method} for invoice {invoice.get('invoice_id')}: {e}")
+async def record_send_failures(rem: Reminder, failed: Dict[str, str]) -> bool:
+    """
+    Count a failed attempt for each channel in `failed` (channel -> error).
+    Schedules a backoff retry and returns True, or marks the reminder failed
+    and returns False once any channel has used up MAX_SEND_ATTEMPTS.
+    """
+    now = datetime.utcnow().replace(tzinfo=timezone.utc)
+    attempts = dict(rem.attempts or {})
+    for ch in failed:
+        attempts[ch] = attempts.get(ch, 0) + 1
+
+    worst = max(attempts[ch] for ch in failed)
+    last_error = "; ".join(f"{ch}: {err}" for ch, err in failed.items())[:500]
+
+    if worst >= MAX_SEND_ATTEMPTS:
+        logger.error(f"Reminder {rem.id} giving up after {worst} attempts ({last_error})")
+        reminder_leases.forget(rem.id)
+        await asyncio.to_thread(db.collection("reminders").document(rem.id).update, {
+            "attempts": attempts,
+            "status": "failed",
+            "active": False,
+            "failed_reason": f"Send failed after {worst} attempts: {last_error}",
+            "last_attempt_at": now,
+            "lease_owner": None,
+            "lease_expires_at": None,
+        })
+        return False
+
+    next_send = now + retry_delay(worst)
+    logger.info(f"Reminder {rem.id} retry {worst}/{MAX_SEND_ATTEMPTS} at {next_send.isoformat()}")
+    await reschedule_reminder(rem.id, next_send, {
+        "attempts": attempts,
+        "last_error": last_error,
+        "last_attempt_at": now,
+    })
+    return True
 
 
 # ---------------------------
@@ -134,83 +179,6 @@ def map_templates(trigger: datetime, due_date: datetime, context: dict, is_first
 
     return whatsapp_key, sms_key, email_type
 
-# ---------------------------
-# Send reminder to all user-selected channels with retries
-# ---------------------------
-async def send_reminder_to_all_channels(rem: Reminder, invoice: dict, context: dict, channels: list):
-    # --- STEP A: Determine if this is the first contact EVER for this client/business pair ---
-    is_first_contact = False
-    
-    # 1. Get all reminders for this invoice to see if this is the 'Initial' one
-    all_rem_docs = db.collection("reminders").where("invoice_id", "==", rem.invoice_id).get()
-    reminders_list = sorted([d.to_dict() for d in all_rem_docs], key=lambda x: x['next_send'])
-    
-    if reminders_list and reminders_list[0]['id'] == rem.id:
-        # 2. Check if this client has ever received a 'paid' or 'sent' invoice from THIS business before
-        # This prevents repeat clients from getting the Layla intro every time.
-        previous_invoices = db.collection("invoices")\
-            .where("sender_id", "==", invoice.get("sender_id"))\
-            .where("client_email", "==", invoice.get("client_email"))\
-            .limit(2).get()
-        
-        # If count is 1, this is their first invoice from this business
-        if len(previous_invoices) <= 1:
-            is_first_contact = True
-
-    # --- STEP B: Map Templates with the calculated is_first flag ---
-    whatsapp_key, sms_key, email_type = map_templates(
-        rem.next_send, 
-        context.get("due_date_dt", datetime.utcnow()), 
-        context,
-        is_first=is_first_contact
-    )
-
-    async def try_send(ch: str):
-        if ch in rem.channel_used:
-            return
-
-        retry_count = 0
-        max_retries = 3
-        success = False
-
-        while not success and retry_count < max_retries:
-            now = datetime.utcnow().replace(tzinfo=timezone.utc)
-            if is_within_quiet_hours(now):
-                await asyncio.sleep(60)
-                continue
-
-            try:
-                if ch == "whatsapp" and invoice.get("client_phone"):
-                    msg = rem.message or get_layla_whatsapp(whatsapp_key, context)
-                    await send_via_whatsapp(invoice["client_phone"], msg)
-
-                elif ch == "sms" and invoice.get("client_phone"):
-                    msg = rem.message or get_layla_sms(sms_key, context)
-                    await send_via_sms(invoice["client_phone"], msg)
-
-                elif ch == "email" and invoice.get("client_email"):
-                    # Dynamic Subject based on Layla's Meta
-                    from app.utils.email import METADATA
-                    subject = METADATA.get(email_type, {}).get("title", "Invoice Reminder")
-                    html = rem.message or get_layla_email(email_type, context)
-                    await send_via_email(invoice["client_email"], subject, html, email_type=email_type)
-
-                success = True
-                rem.channel_used.append(ch)
-                db.collection("reminders").document(rem.id).update({
-                    "channel_used": rem.channel_used,
-                    "status": "sent" if set(rem.channel_used) == set(channels) else "pending",
-                    "sent_at": datetime.utcnow().replace(tzinfo=timezone.utc)
-                })
-
-            except Exception as e:
-                logger.error(f"Failed {ch} send: {e}")
-                retry_count += 1
-                await asyncio.sleep(5)
-
-    await asyncio.gather(*(try_send(ch) for ch in channels))
-
-
 # ---------------------------
 # Schedule reminders for invoice (user-selected channels only)
 # ---------------------------
@@ -255,33 +223,34 @@ async def schedule_reminders_for_invoice(invoice_id: str, payload: ReminderCreat
         logger.warning(f"No valid channels selected for {invoice_id}, skipping.")
         return []
 
+    # Recipient timezone drives delivery hour and quiet hours. The merchant's
+    # setting is only read when the phone's country code doesn't tell us.
+    merchant_tz = None
+    if timezone_for_phone(phone) is None:
+        user_doc = db.collection("users").document(user_id).get()
+        merchant_tz = (user_doc.to_dict() or {}).get("reminder_timezone") if user_doc.exists else None
+    tz_code = resolve_timezone(phone, merchant_tz)
+    delivery_hour_utc = get_delivery_hour_utc(tz_code)
+
     # ---------------------------
     # 🔥 FIX 1: Determine if this is a NEW or RETURNING Client globally
     # ---------------------------
-    # We check if the sender has ever sent an invoice to this specific email/phone before
-    # (excluding the current invoice document).
-    is_globally_new = True
-    
-    if email:
-        existing_invoices = db.collection("invoices")\
-            .where("sender_id", "==", user_id)\
-            .where("client_email", "==", email)\
-            .limit(2).get()
-        # If 2 or more exist, this is a returning client
-        if len(existing_invoices) > 1:
-            is_globally_new = False
-    elif phone:
-        existing_invoices = db.collection("invoices")\
-            .where("sender_id", "==", user_id)\
-            .where("client_phone", "==", phone)\
-            .limit(2).get()
-        if len(existing_invoices) > 1:
-            is_globally_new = False
+    # publish_invoice already resolved this against the client_relationships
+    # index; otherwise fall back to a point read of the index. The current
+    # invoice is already counted there, so more than one means returning.
+    if "is_returning_client" in invoice:
+        is_globally_new = not invoice["is_returning_client"]
+    else:
+        relationships = await get_relationships(user_id, email, phone)
+        is_globally_new = all(r.get("invoice_count", 0) <= 1 for r in relationships.values())
 
     # ---------------------------
     # 🔥 FIX 2: Generate Future Triggers Only (No Immediate Send)
     # ---------------------------
+    # Each trigger keeps the slot-free time it was planned for, which gives
+    # the reminder a stable id even though next_send is smoothed.
     triggers: List[datetime] = []
+    planned_for: Dict[datetime, datetime] = {}
     now = datetime.utcnow().replace(tzinfo=timezone.utc)
 
     if payload.manual_dates:
@@ -304,11 +273,14 @@ async def schedule_reminders_for_invoice(invoice_id: str, payload: ReminderCreat
 
         for offset in offsets:
             reminder_date = due_date - timedelta(days=offset)
-            # Set to standard delivery hour (e.g., 10 AM WAT)
-            reminder_date = reminder_date.replace(hour=DELIVERY_HOUR_UTC, minute=0, second=0, microsecond=0)
+            # Set to the recipient's delivery hour (e.g., 10 AM WAT), then
+            # spread across the send window so the day's reminders don't all fire at once
+            base = reminder_date.replace(hour=delivery_hour_utc, minute=0, second=0, microsecond=0)
+            reminder_date = smooth_send_time(base, f"{invoice_id}:{base.date().isoformat()}")
             
             if reminder_date > now:
                 triggers.append(reminder_date)
+                planned_for[reminder_date] = base
 
     # Remove duplicates and sort
     triggers = sorted(list(set(triggers)))
@@ -325,7 +297,7 @@ async def schedule_reminders_for_invoice(invoice_id: str, payload: ReminderCreat
         intro_flag = "INTRO_REQUIRED" if (is_globally_new and trigger == triggers[0]) else "STANDARD_REMINDER"
         
         rem = Reminder(
-            _id=f"{invoice_id}_{int(trigger.timestamp())}",
+            _id=f"{invoice_id}_{int(planned_for.get(trigger, trigger).timestamp())}",
             invoice_id=invoice_id,
             user_id=user_id, 
             channels_selected=channels,
@@ -333,12 +305,16 @@ async def schedule_reminders_for_invoice(invoice_id: str, payload: ReminderCreat
             # Store our logic flag in the message field if no custom message provided
             message=getattr(payload, "custom_message", "") or intro_flag,
             next_send=trigger,
+            recipient_timezone=tz_code,
             status="pending",
             active=True
         )
 
         # Save to Firestore
-        db.collection("reminders").document(rem.id).set(rem.dict(by_alias=True))
+        rem_data = rem.dict(by_alias=True)
+        db.collection("reminders").document(rem.id).set(rem_data)
+        # Hand it to the in-memory scheduler so it fires on time without waiting for a refill
+        reminder_scheduler.enqueue(rem_data)
         reminders.append(rem)
 
     logger.info(f"✅ Scheduled {len(reminders)} reminders. Intro required: {is_globally_new}")
@@ -1,11 +1,14 @@
 # app/tasks/billing_loop.py
 import asyncio
 import logging
+import time
 from datetime import datetime, timezone, timedelta
 from firebase_admin import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
 from app.utils.billing_emails import BILLING_TEMPLATES, generate_billing_content
 from app.services.billing_service import dispatch_billing_email # NEW INDEPENDENT SERVICE
+from app.core.metrics import background_queue_depth, track_run
+from app.services.reminder_dispatch import reminder_dispatcher
 
 db = firestore.client()
 logger = logging.getLogger("payla.billing")
@@ -13,89 +16,193 @@ logger = logging.getLogger("payla.billing")
 CHECK_INTERVAL = 3600 
 BILLING_SENDER = "billing.noreply@payla.vip"
 
-async def send_billing_email(user_id, user, template_key, new_status):
-    """Handles the formatting and dispatch for billing only."""
+PAGE_SIZE = 200             # Users pulled per query page
+RUN_BUDGET = 15 * 60        # Seconds a single hourly run may spend before yielding
+MAX_BATCH_WRITES = 400      # Stay under Firestore's 500-write limit
+
+CHECKPOINT_REF = db.collection("system").document("billing_nudge_checkpoint")
+
+
+def build_billing_email(user, template_key):
+    """Render (subject, html) for a billing template."""
+    # Prepare all possible variables the template might want
+    user_name_short = (user.get("full_name") or "Creator").split()[0]
+    context = {
+        "user_name": user_name_short,
+        "name": user_name_short, # Add 'name' as a fallback
+        "username": user.get("username") or "creator",
+        "billing_url": "https://payla.ng/subscription",
+        "plan": user.get("plan") or "free"
+    }
+
+    html = generate_billing_content(template_key, context)
+    
+    # FIX: Get the subject template safely
+    template_data = BILLING_TEMPLATES.get(template_key, {})
+    subject_template = template_data.get("subject", "Billing Update")
+
+    # FIX: Use kwargs (**context) to provide ALL variables to the format function
+    # This prevents KeyError if the template uses {user_name} instead of {name}
+    try:
+        subject = subject_template.format(**context)
+    except KeyError:
+        # Final fallback if keys are still missing
+        subject = subject_template.replace("{name}", user_name_short).replace("{user_name}", user_name_short)
+
+    return subject, html
+
+
+async def send_billing_email(user_id, user, template_key):
+    """Handles the formatting and dispatch for billing only. Returns True on delivery."""
     try:
         user_email = user.get("email")
         if not user_email:
-            return
+            return False
 
-        # Prepare all possible variables the template might want
-        user_name_short = (user.get("full_name") or "Creator").split()[0]
-        context = {
-            "user_name": user_name_short,
-            "name": user_name_short, # Add 'name' as a fallback
-            "username": user.get("username") or "creator",
-            "billing_url": "https://payla.ng/subscription",
-            "plan": user.get("plan") or "free"
-        }
-
-        html = generate_billing_content(template_key, context)
-        
-        # FIX: Get the subject template safely
-        template_data = BILLING_TEMPLATES.get(template_key, {})
-        subject_template = template_data.get("subject", "Billing Update")
-
-        # FIX: Use kwargs (**context) to provide ALL variables to the format function
-        # This prevents KeyError if the template uses {user_name} instead of {name}
-        try:
-            subject = subject_template.format(**context)
-        except KeyError:
-            # Final fallback if keys are still missing
-            subject = subject_template.replace("{name}", user_name_short).replace("{user_name}", user_name_short)
+        subject, html = build_billing_email(user, template_key)
 
         # CALL THE INDEPENDENT DISPATCHER
-        success = await dispatch_billing_email(
+        return await dispatch_billing_email(
             to_email=user_email,
             subject=subject,
             html=html,
             sender=BILLING_SENDER
         )
 
-        if success:
-            db.collection("users").document(user_id).update({
-                "billing_nudge_status": new_status,
-                "last_nudge_date": datetime.now(timezone.utc)
-            })
-            logger.info(f"✅ Subscription nudge ({new_status}) sent to {user_email}")
-
     except Exception as e:
         # This catch-all will now log the specific missing key if it still fails
         logger.error(f"Failed to process billing nudge for {user_id}: {str(e)}")
-        
-async def check_billing_status():
+        return False
+
+
+# ---------------------------
+# Paged phases
+# ---------------------------
+def _phase_query(phase: str, now: datetime):
+    users = db.collection("users")
+    if phase == "expiring":
+        # 1. EXPIRING SOON (The "72 Hour" Nudge)
+        return users\
+            .where(filter=FieldFilter("subscription_end", "<=", now + timedelta(days=3)))\
+            .where(filter=FieldFilter("subscription_end", ">", now))\
+            .where(filter=FieldFilter("billing_nudge_status", "==", "active"))
+    # 2. EXPIRED (The "Grace Period" Nudge)
+    # At least 1 hour past expiry to avoid webhook race conditions
+    return users\
+        .where(filter=FieldFilter("subscription_end", "<", now - timedelta(hours=1)))\
+        .where(filter=FieldFilter("billing_nudge_status", "in", ["active", "72h_sent"]))
+
+
+PHASES = {
+    "expiring": ("trial_expiring_72h", "72h_sent"),
+    "expired": ("sub_expired_24h", "expired_sent"),
+}
+
+
+def _fetch_page(phase: str, now: datetime, after, after_id=None):
+    # Document id breaks subscription_end ties so a page boundary never skips users
+    query = _phase_query(phase, now).order_by("subscription_end").order_by("__name__")
+    if after is not None:
+        cursor = {"subscription_end": after}
+        if after_id is not None:
+            cursor["__name__"] = after_id
+        query = query.start_after(cursor)
+    return [(doc.id, doc.to_dict()) for doc in query.limit(PAGE_SIZE).stream()]
+
+
+def _load_checkpoint() -> dict:
+    snap = CHECKPOINT_REF.get()
+    return (snap.to_dict() or {}) if snap.exists else {}
+
+
+def _commit_page(sent_ids: list, new_status: str, checkpoint: dict) -> None:
+    """Write nudge statuses for the page and the checkpoint together."""
     now = datetime.now(timezone.utc)
-    three_days_from_now = now + timedelta(days=3)
+    batch = db.batch()
+    writes = 0
+    for user_id in sent_ids:
+        batch.update(db.collection("users").document(user_id), {
+            "billing_nudge_status": new_status,
+            "last_nudge_date": now
+        })
+        writes += 1
+        if writes >= MAX_BATCH_WRITES:
+            batch.commit()
+            batch = db.batch()
+            writes = 0
+    batch.set(CHECKPOINT_REF, {**checkpoint, "updated_at": now})
+    batch.commit()
 
-    # 1. EXPIRING SOON (The "72 Hour" Nudge)
-    expiring_soon = db.collection("users")\
-        .where(filter=FieldFilter("subscription_end", "<=", three_days_from_now))\
-        .where(filter=FieldFilter("subscription_end", ">", now))\
-        .where(filter=FieldFilter("billing_nudge_status", "==", "active"))\
-        .stream()
 
-    for doc in expiring_soon:
-        user = doc.to_dict()
-        await send_billing_email(doc.id, user, "trial_expiring_72h", "72h_sent")
+async def _send_page(users: list, template_key: str) -> list:
+    # Shares the reminder loop's email slots and Resend pacing
+    async def send(user_id, user):
+        async with reminder_dispatcher.channel("email"):
+            return await send_billing_email(user_id, user, template_key)
 
-    # 2. EXPIRED (The "Grace Period" Nudge)
-    expired = db.collection("users")\
-        .where(filter=FieldFilter("subscription_end", "<", now))\
-        .where(filter=FieldFilter("billing_nudge_status", "in", ["active", "72h_sent"]))\
-        .stream()
-
-    for doc in expired:
-        user = doc.to_dict()
-        # Ensure at least 1 hour has passed since expiry to avoid webhook race conditions
-        sub_end = user['subscription_end'].replace(tzinfo=timezone.utc) if user['subscription_end'].tzinfo is None else user['subscription_end']
-        if (now - sub_end) >= timedelta(hours=1):
-            await send_billing_email(doc.id, user, "sub_expired_24h", "expired_sent")
+    background_queue_depth.set(("billing",), len(users))
+    try:
+        results = await asyncio.gather(*(send(uid, user) for uid, user in users))
+    finally:
+        background_queue_depth.set(("billing",), 0)
+    return [uid for (uid, _), ok in zip(users, results) if ok]
+
+
+async def run_phase(phase: str, now: datetime, checkpoint: dict, deadline: float) -> bool:
+    """Page through one phase. Returns False if the run budget ran out first."""
+    template_key, new_status = PHASES[phase]
+    cursor_key = f"{phase}_after"
+    cursor_id_key = f"{phase}_after_id"
+
+    while True:
+        if time.monotonic() >= deadline:
+            return False
+
+        users = await asyncio.to_thread(
+            _fetch_page, phase, now, checkpoint.get(cursor_key), checkpoint.get(cursor_id_key)
+        )
+        if not users:
+            # Phase drained: next run starts from the top again
+            checkpoint.pop(cursor_key, None)
+            checkpoint.pop(cursor_id_key, None)
+            await asyncio.to_thread(_commit_page, [], new_status, checkpoint)
+            return True
+
+        sent_ids = await _send_page(users, template_key)
+        # Failed sends stay behind the cursor and are retried on the next full pass
+        checkpoint[cursor_key] = users[-1][1].get("subscription_end")
+        checkpoint[cursor_id_key] = users[-1][0]
+        await asyncio.to_thread(_commit_page, sent_ids, new_status, checkpoint)
+
+        for uid, user in users:
+            if uid in sent_ids:
+                logger.info(f"✅ Subscription nudge ({new_status}) sent to {user.get('email')}")
+        logger.info(f"💳 Billing {phase}: {len(sent_ids)}/{len(users)} nudges sent this page")
+
+        if len(users) < PAGE_SIZE:
+            checkpoint.pop(cursor_key, None)
+            checkpoint.pop(cursor_id_key, None)
+            await asyncio.to_thread(_commit_page, [], new_status, checkpoint)
+            return True
+
+
+async def check_billing_status():
+    now = datetime.now(timezone.utc)
+    deadline = time.monotonic() + RUN_BUDGET
+    checkpoint = await asyncio.to_thread(_load_checkpoint)
+    checkpoint.pop("updated_at", None)
+
+    for phase in PHASES:
+        if not await run_phase(phase, now, checkpoint, deadline):
+            logger.warning(f"⏱️ Billing run hit its {RUN_BUDGET}s budget during '{phase}'; resuming next run")
+            return
 
 async def billing_service_loop():
     logger.info("🚀 Payla Billing Loop (Independent) Started")
     while True:
         try:
-            await check_billing_status()
+            with track_run("billing"):
+                await check_billing_status()
         except Exception as e:
             logger.error(f"Billing Loop Error: {e}")
-        await asyncio.sleep(CHECK_INTERVAL)
\ No newline at end of file
+        await asyncio.sleep(CHECK_INTERVAL)
@@ -3,6 +3,7 @@ import asyncio
 import logging
 from datetime import datetime, timezone, timedelta
 from app.utils.presell_email import send_layla_email
+from app.core.smtp_pool import close_smtp_pools
 from app.core.firebase import db
 
 logger = logging.getLogger("payla")
@@ -35,7 +36,7 @@ async def send_emails_to_group(collection: str, email_config: dict):
     for doc in docs:
         user = doc.to_dict()
         try:
-            send_layla_email(
+            await send_layla_email(
                 email_config["template"],
                 user["email"],
                 email_config["context"](user)
@@ -77,6 +78,7 @@ async def start_launch_email_scheduler():
             now = datetime.now(timezone.utc)
             if now >= LAUNCH_DATE_UTC:
                 await launch_day_email_blast()
+                await close_smtp_pools()
                 break
             else:
                 # Sleep until launch time or 5 seconds, whichever is smaller
@@ -5,10 +5,29 @@ from firebase_admin import firestore
 from app.tasks.reminder_service_loop import send_single_channel
 from app.utils.marketing import generate_marketing_content, MARKETING_TEMPLATES
 from google.cloud.firestore_v1.base_query import FieldFilter
+from app.core.metrics import background_queue_depth, track_run
 
 db = firestore.client()
 logger = logging.getLogger("payla.marketing")
 
+PAGE_SIZE = 100             # Candidates pulled per query page
+SEND_CONCURRENCY = 5        # Conversion emails in flight at once
+IN_QUERY_LIMIT = 30         # Firestore "in" filter cap
+IDLE_INTERVAL = 3600 * 4    # Sleep once the backlog is drained
+PITCH_ATTEMPTS = 3          # Failed sends retried on later cycles before giving up
+
+CURSOR_REF = db.collection("system").document("marketing_cursor")
+
+# collection -> (timestamp field, email field, merchant field)
+# The cursor runs on the time a source became paid, not when it was created:
+# a transaction created before the cursor but paid after it must still be seen.
+SOURCES = {
+    "invoices": ("paid_at", "client_email", "sender_id"),
+    "paylink_transactions": ("paid_at", "payer_email", "user_id"),
+}
+SOURCE_STATUS = {"invoices": "paid", "paylink_transactions": "success"}
+
+
 async def get_spots_left():
     """Dynamically calculate remaining Founding Creator spots"""
     try:
@@ -20,39 +39,146 @@ async def get_spots_left():
     except:
         return 373
 
-async def process_conversion(email: str, user_id: str, spots: int, doc_id: str, collection_name: str):
-    """Logic to check Client status and send the pitch"""
-    email_clean = email.lower().strip()
-    
+
+# ---------------------------
+# Batched lookups
+# ---------------------------
+def _chunks(items: list, size: int):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _existing_user_emails(emails: list) -> set:
+    found = set()
+    for chunk in _chunks(emails, IN_QUERY_LIMIT):
+        docs = db.collection("users").where(filter=FieldFilter("email", "in", chunk)).select(["email"]).stream()
+        found.update((doc.to_dict() or {}).get("email", "").lower() for doc in docs)
+    return found
+
+
+def _get_all(refs: list) -> dict:
+    """Fetch documents in one round-trip per call; keyed by document path."""
+    if not refs:
+        return {}
+    return {snap.reference.path: snap for snap in db.get_all(refs)}
+
+
+def _resolve_page(candidates: list) -> dict:
+    """Resolve users/suppression/CRM/merchant docs for a whole page at once."""
+    emails = sorted({c["email"] for c in candidates})
+    merchant_ids = sorted({c["user_id"] for c in candidates})
+
+    suppression_refs = [db.collection("suppression_list").document(e) for e in emails]
+    crm_refs = {
+        (c["user_id"], c["email"]): db.collection("users").document(c["user_id"]).collection("clients").document(c["email"])
+        for c in candidates
+    }
+    merchant_refs = [db.collection("users").document(uid) for uid in merchant_ids]
+
+    snaps = _get_all(suppression_refs + list(crm_refs.values()) + merchant_refs)
+
+    def data(ref):
+        snap = snaps.get(ref.path)
+        return snap.to_dict() if snap is not None and snap.exists else None
+
+    return {
+        "users": _existing_user_emails(emails),
+        "suppressed": {ref.id for ref in suppression_refs if data(ref) is not None},
+        "crm": {key: data(ref) or {} for key, ref in crm_refs.items()},
+        "merchants": {ref.id: data(ref) or {} for ref in merchant_refs},
+        # Only existing client records get flagged; don't create stubs
+        "crm_refs": {key: ref for key, ref in crm_refs.items() if data(ref) is not None},
+    }
+
+
+# ---------------------------
+# Candidate paging with a persisted cursor
+# ---------------------------
+def _load_cursor() -> dict:
+    snap = CURSOR_REF.get()
+    return snap.to_dict() or {} if snap.exists else {}
+
+
+def _fetch_page(collection: str, target_time: datetime, after, after_id=None) -> list:
+    ts_field, email_field, merchant_field = SOURCES[collection]
+    query = (
+        db.collection(collection)
+        .where(filter=FieldFilter("status", "==", SOURCE_STATUS[collection]))
+        .where(filter=FieldFilter("conversion_pitched", "==", False))
+        .where(filter=FieldFilter(ts_field, "<=", target_time))
+        .order_by(ts_field)
+        .order_by("__name__")
+    )
+    if after is not None:
+        cursor = {ts_field: after}
+        if after_id is not None:
+            cursor["__name__"] = after_id
+        query = query.start_after(cursor)
+
+    candidates = []
+    for doc in query.limit(PAGE_SIZE).stream():
+        row = doc.to_dict()
+        candidates.append({
+            "doc_id": doc.id,
+            "collection": collection,
+            "ts": row.get(ts_field),
+            "email": (row.get(email_field) or "").lower().strip(),
+            "user_id": row.get(merchant_field),
+            "attempts": row.get("conversion_pitch_attempts", 0),
+        })
+    return candidates
+
+
+def _commit_page(done: list, retry: list, crm_refs: dict, cursor_field: str, cursor_value, cursor_id) -> None:
+    """
+    Mark handled candidates processed, count a failed attempt on the ones to
+    retry, and advance the cursor (when it moved) in one batch.
+    """
+    batch = db.batch()
+    for c in done:
+        batch.update(db.collection(c["collection"]).document(c["doc_id"]), {"conversion_pitched": True})
+        ref = crm_refs.get((c["user_id"], c["email"]))
+        if ref is not None:
+            batch.set(ref, {"conversion_pitched": True}, merge=True)
+    for c in retry:
+        batch.update(
+            db.collection(c["collection"]).document(c["doc_id"]),
+            {"conversion_pitch_attempts": firestore.Increment(1)},
+        )
+    if cursor_value is not None:
+        batch.set(CURSOR_REF, {cursor_field: cursor_value, f"{cursor_field}_id": cursor_id}, merge=True)
+    batch.commit()
+
+
+# ---------------------------
+# Sending
+# ---------------------------
+async def send_pitch(candidate: dict, resolved: dict, spots: int, semaphore: asyncio.Semaphore) -> bool:
+    """Check Client status and send the pitch. Returns False only if the send failed."""
+    email_clean = candidate["email"]
+    user_id = candidate["user_id"]
+
     # 1. Safety Checks: Is Client already a User? OR on your suppression_list?
-    is_user_query = db.collection("users").where(filter=FieldFilter("email", "==", email_clean)).limit(1).get()
-    is_suppressed = db.collection("suppression_list").document(email_clean).get()
-
-    if not is_user_query and not is_suppressed.exists:
-        
-        # 2. Get the generated Client name from the User's CRM sub-collection
-        crm_ref = db.collection("users").document(user_id).collection("clients").document(email_clean)
-        crm_doc = await asyncio.to_thread(crm_ref.get)
-        crm_data = crm_doc.to_dict() if crm_doc.exists else {}
-
-        # 3. Get User (Merchant) Info from User Model for context
-        user_doc = await asyncio.to_thread(db.collection("users").document(user_id).get)
-        u_data = user_doc.to_dict() if user_doc.exists else {}
-        user_name = u_data.get("business_name") or u_data.get("full_name") or "a creator"
-
-        # 4. Prepare Context
-        context = {
-            "display_name": crm_data.get("display_name") or "there",
-            "business_name": user_name,
-            "spots_left": spots,
-            "unsubscribe_link": f"https://payla.ng/unsubscribe?email={email_clean}" # Points to your existing endpoint
-        }
-        
-        # 5. Generate and Send Pitch
-        subject = MARKETING_TEMPLATES["client_conversion"]["subject"].format(**context)
-        html = generate_marketing_content("client_conversion", context)
-
-        await send_single_channel(
+    if email_clean in resolved["users"] or email_clean in resolved["suppressed"]:
+        return True
+
+    # 2. Client name from the merchant's CRM, merchant name for context
+    crm_data = resolved["crm"].get((user_id, email_clean), {})
+    u_data = resolved["merchants"].get(user_id, {})
+    user_name = u_data.get("business_name") or u_data.get("full_name") or "a creator"
+
+    context = {
+        "display_name": crm_data.get("display_name") or "there",
+        "business_name": user_name,
+        "spots_left": spots,
+        "unsubscribe_link": f"https://payla.ng/unsubscribe?email={email_clean}" # Points to your existing endpoint
+    }
+
+    subject = MARKETING_TEMPLATES["client_conversion"]["subject"].format(**context)
+    html = generate_marketing_content("client_conversion", context)
+
+    async with semaphore:
+        sent = await send_single_channel(
             method="email",
             invoice={"client_email": email_clean},
             msg="",
@@ -60,63 +186,87 @@ async def process_conversion(email: str, user_id: str, spots: int, doc_id: str,
             html=html,
             email_type="marketing_conversion"
         )
+    if sent:
         logger.info(f"🎯 Conversion pitch sent to Client: {email_clean}")
+    return sent
+
+
+async def process_page(collection: str, target_time: datetime, cursor: dict, spots: int) -> int:
+    """Process one page of a source. Returns the number of candidates handled."""
+    ts_field = SOURCES[collection][0]
+    cursor_field = f"{collection}_{ts_field}"
+
+    candidates = await asyncio.to_thread(
+        _fetch_page, collection, target_time, cursor.get(cursor_field), cursor.get(f"{cursor_field}_id")
+    )
+    if not candidates:
+        return 0
+
+    sendable = [c for c in candidates if c["email"] and c["user_id"]]
+    resolved = await asyncio.to_thread(_resolve_page, sendable) if sendable else {"crm_refs": {}}
+
+    failed = set()
+    if sendable:
+        semaphore = asyncio.Semaphore(SEND_CONCURRENCY)
+        background_queue_depth.set(("marketing",), len(sendable))
+        try:
+            results = await asyncio.gather(
+                *(send_pitch(c, resolved, spots, semaphore) for c in sendable),
+                return_exceptions=True,
+            )
+        finally:
+            background_queue_depth.set(("marketing",), 0)
+        for c, result in zip(sendable, results):
+            if isinstance(result, Exception):
+                logger.error(f"Conversion pitch failed for {c['email']}: {result}")
+            if result is not True:
+                failed.add(c["doc_id"])
+
+    # Failed sends stay unmarked (until PITCH_ATTEMPTS) and the cursor stops
+    # before the first of them, so the next cycle retries them; everything
+    # else is marked processed so we don't repeat the check
+    done, retry = [], []
+    cursor_row = None
+    for c in candidates:
+        if c["doc_id"] in failed and c["attempts"] + 1 < PITCH_ATTEMPTS:
+            retry.append(c)
+            continue
+        if c["doc_id"] in failed:
+            logger.warning(f"Giving up on conversion pitch for {c['email']} after {PITCH_ATTEMPTS} attempts")
+        done.append(c)
+        if not retry:
+            cursor_row = c
+
+    last_ts = cursor_row["ts"] if cursor_row else None
+    last_id = cursor_row["doc_id"] if cursor_row else None
+    await asyncio.to_thread(_commit_page, done, retry, resolved["crm_refs"], cursor_field, last_ts, last_id)
+    if cursor_row:
+        cursor[cursor_field] = last_ts
+        cursor[f"{cursor_field}_id"] = last_id
+    return len(candidates)
 
-    # 6. Mark as processed everywhere so we don't repeat the check
-    batch = db.batch()
-    batch.update(db.collection(collection_name).document(doc_id), {"conversion_pitched": True})
-    
-    # Also update the Client record under the User
-    client_ref = db.collection("users").document(user_id).collection("clients").document(email_clean)
-    batch.update(client_ref, {"conversion_pitched": True})
-    
-    await asyncio.to_thread(batch.commit)
 
 async def marketing_loop():
     logger.info("📈 Marketing & Conversion Loop started")
     while True:
+        drained = True
         try:
-            now = datetime.now(timezone.utc)
-            target_time = now - timedelta(days=3)
-            spots = await get_spots_left()
-
-            # --- PART A: INVOICES ---
-            recent_invoices = db.collection("invoices")\
-                .where(filter=FieldFilter("status", "==", "paid"))\
-                .where(filter=FieldFilter("conversion_pitched", "==", False))\
-                .where(filter=FieldFilter("paid_at", "<=", target_time))\
-                .limit(20).stream()
-
-            for doc in recent_invoices:
-                inv = doc.to_dict()
-                if inv.get("client_email"):
-                    await process_conversion(
-                        email=inv["client_email"],
-                        user_id=inv["sender_id"],
-                        spots=spots,
-                        doc_id=doc.id,
-                        collection_name="invoices"
-                    )
-
-            # --- PART B: PAYLINKS ---
-            recent_paylinks = db.collection("paylink_transactions")\
-                .where(filter=FieldFilter("status", "==", "success"))\
-                .where(filter=FieldFilter("conversion_pitched", "==", False))\
-                .where(filter=FieldFilter("created_at", "<=", target_time))\
-                .limit(20).stream()
-
-            for doc in recent_paylinks:
-                txn = doc.to_dict()
-                if txn.get("payer_email"):
-                    await process_conversion(
-                        email=txn["payer_email"],
-                        user_id=txn["user_id"],
-                        spots=spots,
-                        doc_id=doc.id,
-                        collection_name="paylink_transactions"
-                    )
+            with track_run("marketing"):
+                now = datetime.now(timezone.utc)
+                target_time = now - timedelta(days=3)
+                spots = await get_spots_left()
+                cursor = await asyncio.to_thread(_load_cursor)
+
+                # --- PART A: INVOICES / PART B: PAYLINKS ---
+                for collection in SOURCES:
+                    handled = await process_page(collection, target_time, cursor, spots)
+                    if handled:
+                        logger.info(f"📈 {collection}: processed {handled} conversion candidates")
+                    if handled >= PAGE_SIZE:
+                        drained = False
 
         except Exception as e:
             logger.error(f"Error in marketing loop: {e}")
-            
-        await asyncio.sleep(3600 * 4) # Runs every 4 hours
\ No newline at end of file
+
+        # Keep paging while there is backlog; otherwise check again in 4 hours
+        await asyncio.sleep(1 if not drained else IDLE_INTERVAL)
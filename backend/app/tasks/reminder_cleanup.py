@@ -6,10 +6,13 @@ Save this as: app/tasks/reminder_cleanup.py
 
 import asyncio
 import logging
+import time
 from datetime import datetime, timezone, timedelta
 from firebase_admin import firestore
 
 from app.core.firebase import db
+from app.utils.firebase import stream_pages
+from app.core.metrics import background_queue_depth, track_run
 
 logger = logging.getLogger("payla.cleanup")
 
@@ -17,9 +20,78 @@ logger = logging.getLogger("payla.cleanup")
 ARCHIVE_AFTER_DAYS = 90  # Archive reminders older than 90 days
 DELETE_AFTER_DAYS = 365  # Delete archived reminders after 1 year
 BATCH_SIZE = 500
+ARCHIVE_PAGE_SIZE = 250  # set + delete per reminder = 500 writes per batch
+MAX_INFLIGHT_WRITES = 4  # Pages being written while the next is fetched
+RUN_BUDGET_SECONDS = 15 * 60  # Stop draining after this long; resume next cycle
 CLEANUP_INTERVAL_HOURS = 24  # Run cleanup once per day
 
 
+# ---------------------------
+# Paged drain engine
+# ---------------------------
+async def _drain(label: str, query, write_page, field_paths=None, page_size: int = BATCH_SIZE) -> int:
+    """
+    Page through `query` until it is exhausted or RUN_BUDGET_SECONDS elapse,
+    handing each page to the blocking `write_page(page) -> int`. Up to
+    MAX_INFLIGHT_WRITES pages are written while the next one is fetched.
+    """
+    deadline = time.monotonic() + RUN_BUDGET_SECONDS
+    pages = stream_pages(query, page_size, field_paths)
+    slots = asyncio.Semaphore(MAX_INFLIGHT_WRITES)
+    writes = []
+    done = 0
+    pending = 0
+
+    async def write(page):
+        nonlocal done, pending
+        try:
+            done += await asyncio.to_thread(write_page, page)
+        except Exception as e:
+            logger.error(f"Failed to {label} page of {len(page)}: {e}")
+        finally:
+            pending -= len(page)
+            background_queue_depth.set(("cleanup",), pending)
+            slots.release()
+
+    while True:
+        if time.monotonic() >= deadline:
+            logger.warning(f"⏱️ {label}: stopped after {RUN_BUDGET_SECONDS}s budget, backlog remains")
+            break
+        page = await asyncio.to_thread(next, pages, None)
+        if page is None:
+            break
+        await slots.acquire()
+        pending += len(page)
+        background_queue_depth.set(("cleanup",), pending)
+        writes.append(asyncio.create_task(write(page)))
+
+    await asyncio.gather(*writes)
+    return done
+
+
+def _delete_page(page) -> int:
+    """Delete a page of archived reminders in one batch (a page is at most BATCH_SIZE writes)."""
+    batch = db.batch()
+    for doc in page:
+        batch.delete(doc.reference)
+    batch.commit()
+    return len(page)
+
+
+def _archive_page(page) -> int:
+    """Copy and delete a page of reminders in one atomic batch."""
+    archived_at = datetime.utcnow().replace(tzinfo=timezone.utc)
+    batch = db.batch()
+    for doc in page:
+        batch.set(
+            db.collection("reminders_archive").document(doc.id),
+            {**doc.to_dict(), "archived_at": archived_at}
+        )
+        batch.delete(doc.reference)
+    batch.commit()
+    return len(page)
+
+
 async def archive_old_reminders():
     """
     Move old 'sent' reminders to an archive collection.
@@ -29,38 +101,13 @@ async def archive_old_reminders():
     
     logger.info(f"📦 Archiving reminders older than {cutoff_date}")
     
-    # Get old sent reminders
-    reminders = await asyncio.to_thread(
-        lambda: list(
-            db.collection("reminders")
-            .where("status", "==", "sent")
-            .where("sent_at", "<=", cutoff_date)
-            .limit(BATCH_SIZE)
-            .stream()
-        )
+    query = (
+        db.collection("reminders")
+        .where("status", "==", "sent")
+        .where("sent_at", "<=", cutoff_date)
     )
-    
-    archived_count = 0
-    
-    for doc in reminders:
-        try:
-            data = doc.to_dict()
-            
-            # Copy to archive collection
-            await asyncio.to_thread(
-                db.collection("reminders_archive").document(doc.id).set,
-                {**data, "archived_at": datetime.utcnow().replace(tzinfo=timezone.utc)}
-            )
-            
-            # Delete from main collection
-            await asyncio.to_thread(
-                db.collection("reminders").document(doc.id).delete
-            )
-            
-            archived_count += 1
-            
-        except Exception as e:
-            logger.error(f"Failed to archive reminder {doc.id}: {e}")
+    # Each reminder is a set + delete, so a page is half the batch write limit
+    archived_count = await _drain("archive", query, _archive_page, page_size=ARCHIVE_PAGE_SIZE)
     
     logger.info(f"✅ Archived {archived_count} old reminders")
     return archived_count
@@ -73,27 +120,12 @@ async def delete_old_archives():
     cutoff_date = datetime.utcnow().replace(tzinfo=timezone.utc) - timedelta(days=DELETE_AFTER_DAYS)
     
     logger.info(f"🗑️  Deleting archived reminders older than {cutoff_date}")
-    
-    archives = await asyncio.to_thread(
-        lambda: list(
-            db.collection("reminders_archive")
-            .where("archived_at", "<=", cutoff_date)
-            .limit(BATCH_SIZE)
-            .stream()
-        )
-    )
-    
-    deleted_count = 0
-    
-    for doc in archives:
-        try:
-            await asyncio.to_thread(
-                db.collection("reminders_archive").document(doc.id).delete
-            )
-            deleted_count += 1
-        except Exception as e:
-            logger.error(f"Failed to delete archive {doc.id}: {e}")
-    
+
+    # Each page is its own WriteBatch, as archiving does; concurrent pages
+    # never share a writer across threads
+    query = db.collection("reminders_archive").where("archived_at", "<=", cutoff_date)
+    deleted_count = await _drain("delete archives", query, _delete_page, field_paths=["archived_at"])
+
     logger.info(f"✅ Deleted {deleted_count} old archives")
     return deleted_count
 
@@ -199,19 +231,20 @@ async def cleanup_loop():
     
     while True:
         try:
-            logger.info("🧹 Starting cleanup cycle...")
+            with track_run("cleanup"):
+                logger.info("🧹 Starting cleanup cycle...")
             
-            # Run all cleanup tasks
-            paid_count = await cleanup_reminders_for_paid_invoices()
-            failed_count = await cleanup_failed_reminders()
-            archived_count = await archive_old_reminders()
-            deleted_count = await delete_old_archives()
+                # Run all cleanup tasks
+                paid_count = await cleanup_reminders_for_paid_invoices()
+                failed_count = await cleanup_failed_reminders()
+                archived_count = await archive_old_reminders()
+                deleted_count = await delete_old_archives()
             
-            logger.info(
-                f"✅ Cleanup cycle complete: "
-                f"{paid_count} cancelled, {failed_count} marked failed, "
-                f"{archived_count} archived, {deleted_count} deleted"
-            )
+                logger.info(
+                    f"✅ Cleanup cycle complete: "
+                    f"{paid_count} cancelled, {failed_count} marked failed, "
+                    f"{archived_count} archived, {deleted_count} deleted"
+                )
             
         except Exception as e:
             logger.exception(f"❌ Cleanup error: {e}")
@@ -2,7 +2,7 @@
 
 import asyncio
 import logging
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 from firebase_admin import firestore
 
 from app.services.reminder_service import (
@@ -13,62 +13,29 @@ from app.services.reminder_service import (
     get_layla_sms,
     get_layla_email,
     map_templates,
+    record_send_failures,
+    reschedule_reminder,
+    retry_delay,
+    MAX_SEND_ATTEMPTS,
+    is_within_quiet_hours,
+    quiet_hours_end,
 )
+from app.core.reminder_config import resolve_timezone
 from app.core.config import settings  # Essential for settings.BACKEND_URL
 from google.cloud.firestore import Transaction # Needed if you type-hint transactions
 from app.models.reminder_model import Reminder
 from app.utils.receipt_emails import generate_receipt_content
 from app.utils.email import get_html_wrapper
 from google.cloud.firestore_v1.base_query import FieldFilter
+from app.services.reminder_scheduler import reminder_scheduler
+from app.services.reminder_leases import reminder_leases, PAGE_SIZE
+from app.services.reminder_dispatch import reminder_dispatcher
+from app.core.metrics import track_run
 
 db = firestore.client()
 logger = logging.getLogger("payla.reminders")
 
 CHECK_INTERVAL = 60
-MAX_RETRIES = 3  # Reduced from 5
-RETRY_INTERVAL = 5 * 60  # Reduced from 15 to 5 minutes
-QUIET_START = 22
-QUIET_END = 7
-
-LOCK_TIMEOUT = timedelta(minutes=10)
-
-
-def is_within_quiet_hours(now: datetime) -> bool:
-    hour = now.hour
-    return hour >= QUIET_START or hour < QUIET_END
-
-
-def acquire_reminder_lock(reminder_id: str) -> bool:
-    ref = db.collection("reminders").document(reminder_id)
-
-    @firestore.transactional
-    def txn(transaction):
-        snap = ref.get(transaction=transaction)
-        data = snap.to_dict() or {}
-
-        locked = data.get("locked", False)
-        locked_at = data.get("locked_at")
-
-        if locked and locked_at:
-            locked_at = locked_at.replace(tzinfo=timezone.utc)
-            if datetime.utcnow().replace(tzinfo=timezone.utc) - locked_at < LOCK_TIMEOUT:
-                return False
-
-        transaction.update(ref, {
-            "locked": True,
-            "locked_at": datetime.utcnow().replace(tzinfo=timezone.utc),
-        })
-        return True
-
-    transaction = db.transaction()
-    return txn(transaction)
-
-
-def release_reminder_lock(reminder_id: str):
-    db.collection("reminders").document(reminder_id).update({
-        "locked": False,
-        "locked_at": None,
-    })
 
 
 async def send_single_channel(
@@ -78,49 +45,32 @@ async def send_single_channel(
     subject: str = None,
     html: str = None,
     email_type: str = "reminder",
-    max_retries: int = MAX_RETRIES,
 ) -> bool:
     """
-    Send via a single channel with retries.
-    Non-blocking - returns False on failure instead of waiting forever.
+    Make one send attempt on a single channel.
+    Retries are not done here: the caller records the failure and the
+    scheduler picks the reminder up again after a backoff.
     """
-    attempt = 0
-
-    while attempt < max_retries:
-        now = datetime.utcnow().replace(tzinfo=timezone.utc)
-
-        if is_within_quiet_hours(now):
-            logger.info(f"[{method}] Quiet hours active, will retry later")
-            await asyncio.sleep(60)  # Wait 1 min and check again
-            continue
-
-        try:
+    try:
+        async with reminder_dispatcher.channel(method):
             if method == "whatsapp" and invoice.get("client_phone"):
-                logger.info(f"[{method}] Attempt {attempt + 1}/{max_retries} | phone={invoice['client_phone']}")
+                logger.info(f"[{method}] Sending | phone={invoice['client_phone']}")
                 await send_via_whatsapp(invoice["client_phone"], msg)
 
             elif method == "sms" and invoice.get("client_phone"):
-                logger.info(f"[{method}] Attempt {attempt + 1}/{max_retries} | phone={invoice['client_phone']}")
+                logger.info(f"[{method}] Sending | phone={invoice['client_phone']}")
                 await send_via_sms(invoice["client_phone"], msg)
 
             elif method == "email" and invoice.get("client_email"):
-                logger.info(f"[{method}] Attempt {attempt + 1}/{max_retries} | email={invoice['client_email']}")
+                logger.info(f"[{method}] Sending | email={invoice['client_email']}")
                 await send_via_email(invoice["client_email"], subject, html, email_type=email_type)
 
-            logger.info(f"[{method}] ✅ Success!")
-            return True
-
-        except Exception as e:
-            attempt += 1
-            logger.error(f"[{method}] ❌ Attempt {attempt}/{max_retries} failed: {e}")
-            
-            if attempt < max_retries:
-                logger.info(f"[{method}] Waiting {RETRY_INTERVAL}s before retry...")
-                await asyncio.sleep(RETRY_INTERVAL)
-            else:
-                logger.error(f"[{method}] All {max_retries} attempts failed, giving up")
+        logger.info(f"[{method}] ✅ Success!")
+        return True
 
-    return False
+    except Exception as e:
+        logger.error(f"[{method}] ❌ Send failed: {e}")
+        return False
 
 
 async def send_channel_with_tracking(
@@ -136,11 +86,11 @@ async def send_channel_with_tracking(
 ):
     """
     Send via one channel and update tracking in Firestore.
-    Each channel runs independently in parallel.
+    Each channel runs independently in parallel. Returns False if the send failed.
     """
     if ch in rem.channel_used:
         logger.info(f"[{ch}] Already sent for reminder {rem.id}, skipping")
-        return
+        return True
 
     logger.info(f"[{ch}] Starting send for reminder {rem.id}")
 
@@ -185,11 +135,15 @@ async def send_channel_with_tracking(
     else:
         logger.error(f"[{ch}] ❌ Failed to send for reminder {rem.id}")
 
-async def process_reminder(rem: Reminder):
-    if not acquire_reminder_lock(rem.id):
-        logger.info(f"Reminder {rem.id} already locked, skipping")
-        return
+    return success
+
+async def delete_reminder(reminder_ref):
+    reminder_leases.forget(reminder_ref.id)
+    await asyncio.to_thread(reminder_ref.delete)
+
 
+async def process_reminder(rem: Reminder):
+    """Process a reminder whose lease is already held by this worker."""
     try:
         # Define references
         reminder_ref = db.collection("reminders").document(rem.id)
@@ -198,7 +152,7 @@ async def process_reminder(rem: Reminder):
         # 1. Fetch Invoice
         invoice_doc = await asyncio.to_thread(db.collection("invoices").document(invoice_id).get)
         if not invoice_doc.exists:
-            await asyncio.to_thread(reminder_ref.delete)
+            await delete_reminder(reminder_ref)
             return
 
         invoice = invoice_doc.to_dict()
@@ -206,13 +160,24 @@ async def process_reminder(rem: Reminder):
         # 2. Status Check: Stop if paid
         if invoice.get("status") == "paid":
             logger.info(f"Invoice {invoice_id} paid. Deleting reminder {rem.id}")
-            await asyncio.to_thread(reminder_ref.delete) 
+            await delete_reminder(reminder_ref) 
             return
 
         # 3. Fetch User Branding
         sender_id = invoice.get("sender_id")
         user_doc = await asyncio.to_thread(db.collection("users").document(sender_id).get)
         user_data = user_doc.to_dict() if user_doc.exists else {}
+
+        # 3b. Quiet hours in the recipient's timezone: defer to a slot in the window after they end
+        tz_code = rem.recipient_timezone or resolve_timezone(
+            invoice.get("client_phone"), user_data.get("reminder_timezone")
+        )
+        now = datetime.utcnow().replace(tzinfo=timezone.utc)
+        if is_within_quiet_hours(now, tz_code):
+            resume_at = quiet_hours_end(now, tz_code, rem.id)
+            logger.info(f"🌙 Quiet hours ({tz_code}): deferring reminder {rem.id} to {resume_at.isoformat()}")
+            await reschedule_reminder(rem.id, resume_at)
+            return
         
         biz_display_name = (
             user_data.get("business_name") or 
@@ -273,7 +238,6 @@ async def process_reminder(rem: Reminder):
         # Email Generation (Uses your Elite HTML Wrapper)
         from app.utils.email import generate_email_content, METADATA
         if custom_msg:
-            from utils.email import get_html_wrapper
             email_html = get_html_wrapper(
                 title="Invoice Update",
                 body_text=custom_msg.replace("\n", "<br>"),
@@ -295,7 +259,7 @@ async def process_reminder(rem: Reminder):
         )]
 
         if not final_channels:
-            await asyncio.to_thread(reminder_ref.delete)
+            await delete_reminder(reminder_ref)
             return
 
         tasks = [
@@ -305,28 +269,48 @@ async def process_reminder(rem: Reminder):
             )
             for ch in final_channels
         ]
-        await asyncio.gather(*tasks, return_exceptions=True)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        failed = {
+            ch: str(result) if isinstance(result, Exception) else "send failed"
+            for ch, result in zip(final_channels, results)
+            if result is not True
+        }
+        if failed:
+            # Sent channels are already recorded; only the failed ones retry
+            await record_send_failures(rem, failed)
+            return
 
         # 8. Cleanup Logic
         final_snap = await asyncio.to_thread(reminder_ref.get)
         if final_snap.exists:
             if final_snap.to_dict().get("status") == "sent":
                 logger.info(f"🗑️ Deleting completed reminder {rem.id}")
-                await asyncio.to_thread(reminder_ref.delete)
+                await delete_reminder(reminder_ref)
 
     except Exception as e:
         logger.exception(f"Error processing {rem.id}: {e}")
-    finally:
-        release_reminder_lock(rem.id)
-        
+
 
 async def process_payment_notification(invoice_doc):
+    """
+    Send the paid-invoice messages that haven't gone out yet. Each successful
+    message is recorded in `payment_notify_sent`, so a retry only resends what
+    failed; failures back off like reminders and are given up on after
+    MAX_SEND_ATTEMPTS.
+    """
     invoice = invoice_doc.to_dict()
     invoice_id = invoice.get("invoice_id")
 
     if invoice.get("payment_notified", False):
         return
 
+    now = datetime.now(timezone.utc)
+    next_attempt = invoice.get("payment_notify_next_at")
+    if next_attempt is not None and next_attempt > now:
+        return
+    already_sent = set(invoice.get("payment_notify_sent") or [])
+
     amount_str = f"₦{invoice.get('amount', 0):,}"
     client_email = invoice.get("client_email")
     user_email = invoice.get("user_email")
@@ -338,13 +322,13 @@ async def process_payment_notification(invoice_doc):
         "business_name": invoice.get("sender_business_name") or "Payla Creator",
     }
 
-    tasks = []
+    tasks = {}
 
     # 1. SMS/WhatsApp to CLIENT (Luxury Celebration)
     if invoice.get("client_phone"):
         paid_msg = get_layla_sms("paid", base_context) # Now correctly indented
-        tasks.append(send_via_sms(invoice["client_phone"], paid_msg))
-        tasks.append(send_via_whatsapp(invoice["client_phone"], paid_msg))
+        tasks["client_sms"] = lambda: send_single_channel("sms", invoice, paid_msg)
+        tasks["client_whatsapp"] = lambda: send_single_channel("whatsapp", invoice, paid_msg)
 
     # 2. Receipt to CLIENT
     if client_email:
@@ -355,7 +339,9 @@ async def process_payment_notification(invoice_doc):
         }
         client_html = generate_receipt_content("client_receipt", client_context)
         client_subject = f"Receipt: {amount_str} to {base_context['business_name']}"
-        tasks.append(send_single_channel("email", invoice, "", client_subject, client_html, email_type="client_receipt"))
+        tasks["client_receipt"] = lambda: send_single_channel(
+            "email", invoice, "", client_subject, client_html, email_type="client_receipt"
+        )
 
     # 3. Alert to USER (The Creator)
     if user_email:
@@ -368,57 +354,93 @@ async def process_payment_notification(invoice_doc):
         }
         user_html = generate_receipt_content("user_payment_alert", user_context)
         user_subject = f"💰 Payment Received: {amount_str}!"
-        tasks.append(send_single_channel("email", {"client_email": user_email}, "", user_subject, user_html, email_type="payment_alert"))
+        tasks["payment_alert"] = lambda: send_single_channel(
+            "email", {"client_email": user_email}, "", user_subject, user_html, email_type="payment_alert"
+        )
 
-    if tasks:
-        await asyncio.gather(*tasks, return_exceptions=True)
+    pending = [key for key in tasks if key not in already_sent]
+    results = await asyncio.gather(*(tasks[key]() for key in pending), return_exceptions=True)
+    sent = already_sent | {key for key, ok in zip(pending, results) if ok is True}
+    failed = [key for key, ok in zip(pending, results) if ok is not True]
 
-    await asyncio.to_thread(db.collection("invoices").document(invoice_id).update, {"payment_notified": True})
+    update = {"payment_notify_sent": sorted(sent)}
+    if not failed:
+        update["payment_notified"] = True
+    else:
+        attempts = invoice.get("payment_notify_attempts", 0) + 1
+        update["payment_notify_attempts"] = attempts
+        update["payment_notify_failed"] = failed
+        if attempts >= MAX_SEND_ATTEMPTS:
+            logger.error(f"❌ Payment notification for {invoice_id} giving up after {attempts} attempts: {failed}")
+            update["payment_notified"] = True
+        else:
+            update["payment_notify_next_at"] = now + retry_delay(attempts)
+            logger.warning(f"⚠️ Payment notification for {invoice_id} failed ({failed}); retry {attempts}/{MAX_SEND_ATTEMPTS}")
 
+    await asyncio.to_thread(invoice_doc.reference.update, update)
 
-async def reminder_loop():
-    logger.info("🚀 Reminder loop started")
-    
-    while True:
-        now = datetime.utcnow().replace(tzinfo=timezone.utc)
 
+async def process_claimed_page(page: list):
+    """
+    Feed one leased page through the bounded dispatcher, then release
+    whatever leases are left in one write.
+    """
+    jobs = []
+    with track_run("reminder"):
         try:
-            pending_docs = await asyncio.to_thread(
-                lambda: list(
-                    db.collection("reminders")
-                    .where(filter=FieldFilter("status", "==", "pending"))
-                    .where(filter=FieldFilter("active", "==", True))
-                    .where(filter=FieldFilter("next_send", "<=", now))
-                    .stream()
-                )
-            )
+            for data in page:
+                logger.info(f"📨 Queueing reminder {data['id']} with channels: {data.get('channels_selected')}")
+                try:
+                    rem = Reminder(**data)
+                except Exception as e:
+                    logger.error(f"Skipping malformed reminder {data.get('id')}: {e}")
+                    continue
+                jobs.append(await reminder_dispatcher.submit(lambda rem=rem: process_reminder(rem)))
 
-            logger.info(f"🔍 Found {len(pending_docs)} pending reminders")
+            await asyncio.gather(*jobs, return_exceptions=True)
+        finally:
+            await reminder_leases.release([data["id"] for data in page])
 
-            paid_docs = await asyncio.to_thread(
-                lambda: list(
-                    db.collection("invoices")
-                    .where(filter=FieldFilter("status", "==", "paid"))
-                    .where(filter=FieldFilter("payment_notified", "==", False))
-                    .stream()
-                )
-            )
 
-            tasks = []
+async def dispatch_due_reminders(due: list):
+    """Called by the scheduler with reminders whose next_send has arrived."""
+    claimed = await reminder_leases.claim([data["id"] for data in due])
+    for i in range(0, len(claimed), PAGE_SIZE):
+        asyncio.create_task(process_claimed_page(claimed[i:i + PAGE_SIZE]))
 
-            for doc in pending_docs:
-                data = doc.to_dict()
-                data["id"] = doc.id
-                logger.info(f"📨 Processing reminder {doc.id} with channels: {data.get('channels_selected')}")
-                tasks.append(process_reminder(Reminder(**data)))
 
-            for doc in paid_docs:
-                tasks.append(process_payment_notification(doc))
+async def payment_notification_loop():
+    while True:
+        try:
+            with track_run("payment_notifications"):
+                paid_docs = await asyncio.to_thread(
+                    lambda: list(
+                        db.collection("invoices")
+                        .where(filter=FieldFilter("status", "==", "paid"))
+                        .where(filter=FieldFilter("payment_notified", "==", False))
+                        .stream()
+                    )
+                )
 
-            if tasks:
-                await asyncio.gather(*tasks, return_exceptions=True)
+                jobs = [
+                    await reminder_dispatcher.submit(lambda doc=doc: process_payment_notification(doc))
+                    for doc in paid_docs
+                ]
+                if jobs:
+                    await asyncio.gather(*jobs, return_exceptions=True)
 
         except Exception as e:
-            logger.exception(f"❌ Reminder loop error: {e}")
+            logger.exception(f"❌ Payment notification loop error: {e}")
+
+        await asyncio.sleep(CHECK_INTERVAL)
+
 
-        await asyncio.sleep(CHECK_INTERVAL)
\ No newline at end of file
+async def reminder_loop():
+    logger.info("🚀 Reminder loop started")
+    reminder_dispatcher.start()
+
+    await asyncio.gather(
+        reminder_scheduler.run(dispatch_due_reminders),
+        reminder_leases.renew_forever(),
+        payment_notification_loop(),
+    )
@@ -1,45 +1,137 @@
 # app/utils/crm.py
+import asyncio
+import logging
 from datetime import datetime, timezone
+from typing import Dict, Tuple
 from google.cloud import firestore
-from app.core.firebase import db 
+from app.core.firebase import db
+
+logger = logging.getLogger("payla")
+
+FLUSH_INTERVAL = 5          # Seconds between buffered CRM commits
+MAX_BUFFERED_CLIENTS = 200  # Flush early once this many clients are pending
+MAX_BATCH_WRITES = 400      # Stay under Firestore's 500-write limit
+
+
+class CRMAggregator:
+    """
+    Buffers client stats per (merchant, email) and commits them in batches.
+
+    Several payments from the same client between flushes collapse into one
+    write. Each chunk resolves which clients already exist with a single
+    get_all: existing clients get Increment updates, new ones are created
+    with the full first-payment record (opt-in and pitch flags included).
+    """
+
+    def __init__(self):
+        self._pending: Dict[Tuple[str, str], dict] = {}
+        self._flush_lock = asyncio.Lock()
+
+    def record(self, merchant_id: str, email: str, amount: float) -> None:
+        email_clean = email.lower().strip()
+        now = datetime.now(timezone.utc)
+
+        entry = self._pending.setdefault(
+            (merchant_id, email_clean),
+            {"amount": 0.0, "count": 0, "first_at": now, "last_at": now},
+        )
+        entry["amount"] += amount
+        entry["count"] += 1
+        entry["last_at"] = now
+
+        if len(self._pending) >= MAX_BUFFERED_CLIENTS:
+            asyncio.get_running_loop().create_task(self.flush())
+
+    @staticmethod
+    def _commit_chunk(chunk: list) -> None:
+        refs = {
+            key: db.collection("users").document(key[0]).collection("clients").document(key[1])
+            for key, _ in chunk
+        }
+        existing = {
+            snap.reference.path
+            for snap in db.get_all(list(refs.values()), field_paths=["email"])
+            if snap.exists
+        }
+
+        batch = db.batch()
+        for key, entry in chunk:
+            client_ref = refs[key]
+            if client_ref.path in existing:
+                # EXISTING CLIENT: Update their lifetime stats
+                batch.update(client_ref, {
+                    "total_spent": firestore.Increment(entry["amount"]),
+                    "transaction_count": firestore.Increment(entry["count"]),
+                    "last_payment_at": entry["last_at"],
+                })
+                continue
+
+            # NEW CLIENT: First time record. create() fails the chunk (and it
+            # is re-buffered) if another writer created the client meanwhile.
+            # Generate a friendly display name from the email handle
+            # e.g., 'tunde.gold' -> 'Tunde Gold'
+            email_clean = key[1]
+            handle = email_clean.split('@')[0]
+            display_name = handle.replace('.', ' ').replace('_', ' ').title()
+            batch.create(client_ref, {
+                "email": email_clean,
+                "display_name": display_name,
+                "total_spent": entry["amount"],
+                "transaction_count": entry["count"],
+                "first_payment_at": entry["first_at"],
+                "last_payment_at": entry["last_at"],
+                "marketing_opt_in": True,
+                "conversion_pitched": False # Used by the loop to prevent double-pitching
+            })
+        batch.commit()
+
+    def _commit(self, pending: Dict[Tuple[str, str], dict]) -> Dict[Tuple[str, str], dict]:
+        """Commit in atomic chunks; returns the entries of chunks that failed."""
+        items = list(pending.items())
+        failed: Dict[Tuple[str, str], dict] = {}
+        for i in range(0, len(items), MAX_BATCH_WRITES):
+            chunk = items[i:i + MAX_BATCH_WRITES]
+            try:
+                self._commit_chunk(chunk)
+            except Exception as e:
+                logger.error(f"CRM flush failed for {len(chunk)} clients, re-buffering: {e}")
+                failed.update(chunk)
+        return failed
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            failed = await asyncio.to_thread(self._commit, pending)
+            # Failed chunks wrote nothing; merge them back for the next flush
+            for key, entry in failed.items():
+                current = self._pending.get(key)
+                if current is None:
+                    self._pending[key] = entry
+                else:
+                    current["amount"] += entry["amount"]
+                    current["count"] += entry["count"]
+                    current["first_at"] = min(current["first_at"], entry["first_at"])
+                    current["last_at"] = max(current["last_at"], entry["last_at"])
+            return len(pending) - len(failed)
+
+    async def run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+
+
+crm_aggregator = CRMAggregator()
+
 
 async def sync_client_to_crm(merchant_id: str, email: str, amount: float):
     """
     Saves or updates client data for a specific merchant.
     This builds the lead list for the automated marketing conversion loop.
+    The update is buffered and committed with the next CRM batch.
     """
     if not email or "@" not in email:
         return # Safety check for invalid data
 
-    email_clean = email.lower().strip()
-    
-    # Generate a friendly display name from the email handle
-    # e.g., 'tunde.gold' -> 'Tunde Gold'
-    handle = email_clean.split('@')[0]
-    display_name = handle.replace('.', ' ').replace('_', ' ').title()
-
-    # Reference to the client within the Merchant's specific collection
-    client_ref = db.collection("users").document(merchant_id).collection("clients").document(email_clean)
-    
-    doc = await client_ref.get()
-    now = datetime.now(timezone.utc)
-
-    if doc.exists:
-        # EXISTING CLIENT: Update their lifetime stats
-        await client_ref.update({
-            "total_spent": firestore.Increment(amount),
-            "transaction_count": firestore.Increment(1),
-            "last_payment_at": now
-        })
-    else:
-        # NEW CLIENT: First time record
-        await client_ref.set({
-            "email": email_clean,
-            "display_name": display_name, 
-            "total_spent": amount,
-            "transaction_count": 1,
-            "first_payment_at": now,
-            "last_payment_at": now,
-            "marketing_opt_in": True,
-            "conversion_pitched": False # Used by the loop to prevent double-pitching
-        })
\ No newline at end of file
+    crm_aggregator.record(merchant_id, email, amount)
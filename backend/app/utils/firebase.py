@@ -1,13 +1,76 @@
 import asyncio
+import contextvars
 from functools import partial
 
+from google.cloud.firestore_v1.base_query import _INEQUALITY_OPERATORS
+
 
 async def firestore_run(fn, *args, **kwargs):
     """
     Run blocking Firestore SDK calls safely in async code.
     """
     loop = asyncio.get_running_loop()
+    # Carry the caller's context so reads are attributed to its request/job
+    ctx = contextvars.copy_context()
     return await loop.run_in_executor(
         None,
-        partial(fn, *args, **kwargs)
+        partial(ctx.run, fn, *args, **kwargs)
     )
+
+
+def _cursor_fields(query) -> list:
+    """
+    Fields a snapshot cursor on `query` is ordered by: its explicit order_by
+    fields plus any inequality-filtered field, which Firestore orders by
+    implicitly. A start_after(snapshot) needs these present in the snapshot.
+    """
+    fields = [order.field.field_path for order in query._orders]
+    for field_filter in query._field_filters:
+        field = getattr(getattr(field_filter, "field", None), "field_path", None)
+        if field and getattr(field_filter, "op", None) in _INEQUALITY_OPERATORS and field not in fields:
+            fields.append(field)
+    return [field for field in fields if field != "__name__"]
+
+
+def stream_pages(query, page_size: int = 500, field_paths=None):
+    """
+    Yield a query's results in pages of `page_size` snapshots, resuming each
+    page after the last document of the previous one. `field_paths` limits
+    the fields fetched (an empty list returns document names only); the
+    fields the page cursor orders by are always added to the projection.
+    """
+    if field_paths is not None:
+        projection = list(field_paths)
+        projection += [field for field in _cursor_fields(query) if field not in projection]
+        query = query.select(projection)
+
+    last = None
+    while True:
+        page_query = query.limit(page_size)
+        if last is not None:
+            page_query = page_query.start_after(last)
+        page = list(page_query.stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        last = page[-1]
+
+
+def new_bulk_writer(db, max_attempts: int = 5, on_error=None):
+    """
+    BulkWriter that retries failed writes up to `max_attempts` times and
+    reports the final failure to `on_error(failure)` instead of raising.
+    """
+    writer = db.bulk_writer()
+
+    def _retry(failure) -> bool:
+        if failure.attempts < max_attempts:
+            return True
+        if on_error is not None:
+            on_error(failure)
+        return False
+
+    writer.on_write_error(_retry)
+    return writer
@@ -1,7 +1,7 @@
 # utils/email.py → LAYLA'S VOICE — FINAL LUXURY MIDNIGHT & ROSE EDITION
-import smtplib
 from email.message import EmailMessage
 from app.core.config import settings
+from app.core.smtp_pool import get_smtp_pool
 import logging
 
 logger = logging.getLogger("payla")
@@ -51,8 +51,8 @@ LAYLA_TEMPLATES = {
     }
 }
 
-def send_layla_email(template_key: str, to_email: str, context: dict = None):
-    """Send email with no-crash handling"""
+async def send_layla_email(template_key: str, to_email: str, context: dict = None):
+    """Send email with no-crash handling (reuses pooled Gmail connections)"""
     if template_key not in LAYLA_TEMPLATES: return
     template = LAYLA_TEMPLATES[template_key]
 
@@ -63,9 +63,8 @@ def send_layla_email(template_key: str, to_email: str, context: dict = None):
         msg["Subject"] = template["subject"]
         msg.add_alternative(template["html"], subtype="html")
 
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465) as smtp:
-            smtp.login(settings.LAYLA_USER, settings.LAYLA_EMAIL_PASS)
-            smtp.send_message(msg)
+        pool = get_smtp_pool("smtp.gmail.com", 465, settings.LAYLA_USER, settings.LAYLA_EMAIL_PASS)
+        await pool.send_message(msg)
         logger.info(f"Sent email to {to_email}")
     except Exception as e:
-        logger.error(f"Email error: {e}")
\ No newline at end of file
+        logger.error(f"Email error: {e}")
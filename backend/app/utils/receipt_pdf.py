@@ -0,0 +1,179 @@
+# app/utils/receipt_pdf.py
+"""
+Receipt PDF builders.
+
+These run inside the receipt render process pool, so they take plain,
+picklable specs (strings, numbers, logo bytes) and return the PDF bytes.
+Anything that needs Firestore or the network happens before the spec is built.
+"""
+from io import BytesIO
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, Image
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+
+# Bump when the layout changes so cached receipts are re-rendered
+LAYOUT_VERSION = 1
+
+# --- Styles Configuration ---
+styles = getSampleStyleSheet()
+title_style = ParagraphStyle(
+    'CustomTitle',
+    parent=styles['Heading1'],
+    fontSize=26,
+    spaceAfter=20,
+    textColor=colors.HexColor("#1a1a1a"),
+    alignment=1
+)
+subtitle_style = ParagraphStyle(
+    'Subtitle',
+    parent=styles['Normal'],
+    fontSize=10,
+    textColor=colors.grey,
+    alignment=1
+)
+
+
+def format_date(dt_val) -> str:
+    """Safely converts Firestore Timestamps or strings to formatted strings."""
+    if not dt_val:
+        return "N/A"
+    try:
+        if isinstance(dt_val, datetime):
+            return dt_val.strftime("%B %d, %Y")
+        if hasattr(dt_val, "timestamp"): # Firestore Timestamp
+            return dt_val.strftime("%B %d, %Y")
+        return str(dt_val)
+    except:
+        return "Date Pending"
+
+
+def _logo(story, logo_bytes, width):
+    if not logo_bytes:
+        return
+    try:
+        img = Image(BytesIO(logo_bytes))
+        # Aspect ratio maintenance
+        aspect = img.imageHeight / float(img.imageWidth)
+        img.drawWidth = width*inch
+        img.drawHeight = width*inch * aspect
+        img.hAlign = 'CENTER'
+        story.append(img)
+        story.append(Spacer(1, 15))
+    except:
+        pass
+
+
+def build_paylink_receipt(spec: dict) -> bytes:
+    primary_color = colors.HexColor(spec["primary_color"])
+    business_name = spec["business_name"]
+
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.75*inch, bottomMargin=0.75*inch)
+    story = []
+
+    # 4. Logo Handling
+    _logo(story, spec.get("logo"), 1.3)
+
+    # 5. Header
+    story.append(Paragraph(business_name.upper(), title_style.clone('PaylinkTitle', textColor=primary_color)))
+    story.append(Paragraph("PAYMENT RECEIPT", subtitle_style))
+    story.append(Spacer(1, 30))
+
+    # 6. Data Mapping
+    table = Table(spec["rows"], colWidths=[2.2*inch, 3.8*inch], rowHeights=28)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor("#f8fafc")),
+        ('TEXTCOLOR', (0, 0), (0, -1), primary_color),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor("#cbd5e1")),
+        ('LEFTPADDING', (0, 0), (-1, -1), 12),
+    ]))
+    story.append(table)
+    story.append(Spacer(1, 40))
+
+    # 7. Professional Sign-off
+    thanks_text = f"<b>Thank you for your payment to {business_name}!</b>"
+    story.append(Paragraph(thanks_text, subtitle_style.clone('Thanks', textColor=primary_color, fontSize=11)))
+    story.append(Spacer(1, 60))
+
+    # 8. Footer
+    footer_text = f"""
+    <font size="8" color="grey">
+    This receipt was issued by {spec["footer_brand"]} via Payla Intelligence.<br/>
+    Reference: {spec["reference"]}<br/>
+    {spec["backend_url"]}
+    </font>
+    """
+    story.append(Paragraph(footer_text, ParagraphStyle('Footer', alignment=1)))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def build_invoice_receipt(spec: dict) -> bytes:
+    primary_color = colors.HexColor(spec["primary_color"])
+    business_name = spec["business_name"]
+
+    buffer = BytesIO()
+    # Setting margins for a professional "letterhead" feel
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=0.75*inch, bottomMargin=0.75*inch)
+    story = []
+
+    # 4. Logo Handling
+    _logo(story, spec.get("logo"), 1.2)
+
+    # 5. Header Section
+    story.append(Paragraph(business_name.upper(), title_style.clone('MainTitle', textColor=primary_color)))
+    story.append(Paragraph("OFFICIAL PAYMENT RECEIPT", subtitle_style))
+    story.append(Spacer(1, 30))
+
+    # 6. Transaction Table
+    table = Table(spec["rows"], colWidths=[2.2*inch, 3.8*inch], rowHeights=30)
+    table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor("#f8fafc")), # Soft slate background for keys
+        ('TEXTCOLOR', (0, 0), (0, -1), primary_color),
+        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor("#e2e8f0")),
+        ('LEFTPADDING', (0, 0), (-1, -1), 12),
+    ]))
+    story.append(table)
+    story.append(Spacer(1, 40))
+
+    # 7. Closing Message
+    thanks_style = ParagraphStyle('Thanks', parent=subtitle_style, fontSize=12, leading=16)
+    story.append(Paragraph(f"<b>Successful Payment.</b>", thanks_style.clone('bold', textColor=primary_color)))
+    story.append(Paragraph(f"This document confirms that your payment was received in full.", thanks_style))
+    story.append(Spacer(1, 60))
+
+    # 8. Brand-Specific Footer
+    footer_style = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=8, textColor=colors.grey, alignment=1)
+
+    footer_content = f"""
+    This receipt was generated by {spec["footer_brand"]}.<br/>
+    For inquiries regarding this payment, please contact {spec["support_contact"]}.<br/>
+    <b>Thank you for using Payla.</b>
+    """
+    story.append(Paragraph(footer_content, footer_style))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+BUILDERS = {
+    "paylink": build_paylink_receipt,
+    "invoice": build_invoice_receipt,
+}
+
+
+def render_receipt(kind: str, spec: dict) -> bytes:
+    """Process-pool entry point."""
+    return BUILDERS[kind](spec)
@@ -145,13 +145,16 @@ document.addEventListener('DOMContentLoaded', function () {
     // ================= LOAD PAYLINK + PROFILE =================
     async function initPaylinkPage() {
         try {
-            // 1. Get Paylink
-            const paylinkRes = await fetch(`${BACKEND_URL}/api/paylinks/${username}`);
-            if (!paylinkRes.ok) {
-                trackPaylinkLoadFailed(username, 'paylink_not_found');
-                throw new Error('Paylink not found');
+            // 1. Get Paylink (embedded by the server when available)
+            let paylink = window.PAYLINK_DATA || null;
+            if (!paylink) {
+                const paylinkRes = await fetch(`${BACKEND_URL}/api/paylinks/${username}`);
+                if (!paylinkRes.ok) {
+                    trackPaylinkLoadFailed(username, 'paylink_not_found');
+                    throw new Error('Paylink not found');
+                }
+                paylink = await paylinkRes.json();
             }
-            const paylink = await paylinkRes.json();
 
             // 2. Get Owner Profile
             let owner = {};
@@ -4,6 +4,7 @@ from app.core.config import settings
 from firebase_admin import firestore
 from datetime import datetime, timezone
 from app.routers.payment_router import create_notification
+from app.services.payment_references import source_document
 
 logger = logging.getLogger("payla")
 db = firestore.client()
@@ -14,25 +15,17 @@ db = firestore.client()
 
 def update_payout_status(reference: str, status: str):
     """Updates the payout status across collections (Paylinks or Invoices)."""
-    # Try paylink first
-    ref_pl = db.collection("paylink_transactions").document(reference)
-    if ref_pl.get().exists:
-        ref_pl.update({
-            "payout_status": status,
-            "last_update": datetime.now(timezone.utc)
-        })
+    source_type, source_ref = source_document(reference)
+    if source_ref is None:
+        logger.error(f"Payout reference not found anywhere: {reference}")
         return
 
-    # Try invoice
-    ref_inv = db.collection("invoices").document(reference)
-    if ref_inv.get().exists:
-        ref_inv.update({
-            "payout_status": status,
-            "updated_at": datetime.now(timezone.utc)
-        })
-        return
-
-    logger.error(f"Payout reference not found anywhere: {reference}")
+    # Paylink transactions track 'last_update', invoices 'updated_at'
+    stamp_field = "last_update" if source_type == "paylink" else "updated_at"
+    source_ref.update({
+        "payout_status": status,
+        stamp_field: datetime.now(timezone.utc)
+    })
 
 
 async def get_paystack_available_balance():
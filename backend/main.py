@@ -18,8 +18,8 @@ from app.tasks.billing_service_loop import billing_service_loop
 from app.tasks.marketing_service_loop import marketing_loop
 from fastapi.responses import StreamingResponse
 from reminder_cleanup import purge_locked_and_old_reminders, repeat_purge_forever
+import secrets
 import time
-import threading
 import subprocess
 import multiprocessing
 from celery.bin import beat
@@ -31,38 +31,30 @@ from app.core.config import settings
 import asyncio
 from app.core.auth import get_current_user
 from app.core.firebase import db
-import logging.config
+from app.core.smtp_pool import close_smtp_pools
+from app.services.billing_service import close_resend_clients
+from app.services.receipt_renderer import receipt_renderer
+from app.services.logo_cache import logo_cache
+from app.core.static_assets import StaticAssetCache, etag_matches, json_for_script
+from app.utils.crm import crm_aggregator
+from app.core.log_pipeline import AccessLog, configure_logging
+from app.core import firestore_usage, metrics
+from app.core.instrumentation import instrument_firestore, instrument_http_clients
 
 # ------------------------------------------------------------
 # IMPROVED LOGGING CONFIGURATION
 # ------------------------------------------------------------
 LOG_LEVEL = "INFO" if settings.ENVIRONMENT == "production" else "DEBUG"
 
-logging_config = {
-    "version": 1,
-    "disable_existing_loggers": False,
-    "formatters": {
-        "default": {
-            "format": "%(asctime)s | %(levelname)s | %(name)s | %(message)s",
-        },
-    },
-    "handlers": {
-        "console": {
-            "class": "logging.StreamHandler",
-            "formatter": "default",
-        },
-    },
-    "loggers": {
-        "uvicorn": {"handlers": ["console"], "level": LOG_LEVEL},
-        "uvicorn.error": {"handlers": ["console"], "level": LOG_LEVEL},
-        "uvicorn.access": {"handlers": ["console"], "level": LOG_LEVEL},
-        "payla": {"handlers": ["console"], "level": "DEBUG", "propagate": False},
-    },
-}
-
-logging.config.dictConfig(logging_config)
+# Records are queued and written by a listener thread (see app/core/log_pipeline.py)
+log_listener = configure_logging(LOG_LEVEL)
+access_log = AccessLog(settings.ACCESS_LOG_SAMPLE_RATE, settings.ACCESS_LOG_SLOW_MS)
 logger = logging.getLogger("payla")
 
+# Firestore / outbound HTTP timings for /metrics (see app/core/instrumentation.py)
+instrument_firestore()
+instrument_http_clients()
+
 # ------------------------------------------------------------
 # 2. FASTAPI APP
 # ------------------------------------------------------------
@@ -158,105 +150,31 @@ else:
 # 6. EXPLICIT STATIC FILE HANDLERS (HIGHEST PRIORITY)
 # ------------------------------------------------------------
 
-# Helper function to get MIME type
-def get_mime_type(filename: str) -> str:
-    """Get correct MIME type for a file"""
-    import mimetypes
-    mimetypes.init()
-    
-    # Explicit mappings to ensure correct types
-    mime_map = {
-        '.js': 'application/javascript',
-        '.mjs': 'application/javascript',
-        '.css': 'text/css',
-        '.json': 'application/json',
-        '.png': 'image/png',
-        '.jpg': 'image/jpeg',
-        '.jpeg': 'image/jpeg',
-        '.gif': 'image/gif',
-        '.ico': 'image/x-icon',
-        '.webmanifest': 'application/manifest+json',
-        '.woff': 'font/woff',
-        '.woff2': 'font/woff2',
-        '.ttf': 'font/ttf',
-        '.eot': 'application/vnd.ms-fontobject',
-    }
-    
-    ext = os.path.splitext(filename)[1].lower()
-    return mime_map.get(ext, mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+# Loaded into memory once (pre-compressed, ETagged); see app/core/static_assets.py
+static_assets = StaticAssetCache(FRONTEND_DIR)
+STATIC_CACHE_CONTROL = "public, max-age=31536000" if not settings.DEBUG else "no-cache"
+
+assert settings.BACKEND_URL, "BACKEND_URL must be set in production"
+PAYLINK_API_BASE = f"{settings.BACKEND_URL.rstrip('/')}/api/paylinks"
+paylink_shell = static_assets.shell("paylink.html")
 
 # JavaScript files - MUST BE FIRST
 @app.get("/js/{file_path:path}", include_in_schema=False)
-async def serve_js(file_path: str):
+async def serve_js(file_path: str, request: Request):
     """Serve JavaScript files with correct MIME type"""
-    full_path = os.path.join(FRONTEND_DIR, "js", file_path)
-    
-    # Security check
-    if not os.path.abspath(full_path).startswith(os.path.abspath(os.path.join(FRONTEND_DIR, "js"))):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    if not os.path.exists(full_path):
-        raise HTTPException(status_code=404, detail=f"JS file not found: {file_path}")
-    
-    logger.info(f"🟢 Serving JS: {file_path} from {full_path}")
-    
-    return FileResponse(
-        full_path,
-        media_type="application/javascript",
-        headers={
-            "Content-Type": "application/javascript; charset=utf-8",
-            "X-Content-Type-Options": "nosniff",
-            "Cache-Control": "public, max-age=31536000" if not settings.DEBUG else "no-cache"
-        }
-    )
+    return static_assets.response(request, "js", file_path, STATIC_CACHE_CONTROL)
 
 # CSS files
 @app.get("/css/{file_path:path}", include_in_schema=False)
-async def serve_css(file_path: str):
+async def serve_css(file_path: str, request: Request):
     """Serve CSS files with correct MIME type"""
-    full_path = os.path.join(FRONTEND_DIR, "css", file_path)
-    
-    if not os.path.abspath(full_path).startswith(os.path.abspath(os.path.join(FRONTEND_DIR, "css"))):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    if not os.path.exists(full_path):
-        raise HTTPException(status_code=404, detail=f"CSS file not found: {file_path}")
-    
-    logger.info(f"🟢 Serving CSS: {file_path}")
-    
-    return FileResponse(
-        full_path,
-        media_type="text/css",
-        headers={
-            "Content-Type": "text/css; charset=utf-8",
-            "X-Content-Type-Options": "nosniff",
-            "Cache-Control": "public, max-age=31536000" if not settings.DEBUG else "no-cache"
-        }
-    )
+    return static_assets.response(request, "css", file_path, STATIC_CACHE_CONTROL)
 
 # Assets (images, fonts, etc.)
 @app.get("/assets/{file_path:path}", include_in_schema=False)
-async def serve_assets(file_path: str):
+async def serve_assets(file_path: str, request: Request):
     """Serve asset files with correct MIME type"""
-    full_path = os.path.join(FRONTEND_DIR, "assets", file_path)
-    
-    if not os.path.abspath(full_path).startswith(os.path.abspath(os.path.join(FRONTEND_DIR, "assets"))):
-        raise HTTPException(status_code=403, detail="Access denied")
-    
-    if not os.path.exists(full_path):
-        raise HTTPException(status_code=404, detail=f"Asset not found: {file_path}")
-    
-    mime_type = get_mime_type(file_path)
-    logger.info(f"🟢 Serving asset: {file_path} as {mime_type}")
-    
-    return FileResponse(
-        full_path,
-        media_type=mime_type,
-        headers={
-            "X-Content-Type-Options": "nosniff",
-            "Cache-Control": "public, max-age=31536000" if not settings.DEBUG else "no-cache"
-        }
-    )
+    return static_assets.response(request, "assets", file_path, STATIC_CACHE_CONTROL)
 
 # Uploads
 BASE_DIR = Path(__file__).resolve().parent  # backend/
@@ -281,6 +199,16 @@ async def health_check():
         logger.error(f"Health check failed: {e}")
         return JSONResponse(status_code=503, content={"status": "unhealthy", "error": str(e)})
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics(request: Request):
+    """Prometheus scrape endpoint; only served when METRICS_TOKEN is configured."""
+    if not settings.METRICS_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "")
+    if not secrets.compare_digest(supplied.encode("utf-8"), f"Bearer {settings.METRICS_TOKEN}".encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/debug/check-js", tags=["System"])
 async def debug_check():
     """Debug endpoint to check JS file serving"""
@@ -328,33 +256,24 @@ async def me(user = Depends(get_current_user)):
     return user
 
 @app.get("/favicon.ico", include_in_schema=False)
-async def favicon():
-    favicon_path = os.path.join(FRONTEND_DIR, "assets", "favicon.ico")
-    if os.path.exists(favicon_path):
-        return FileResponse(favicon_path, media_type="image/x-icon")
-    raise HTTPException(status_code=404, detail="Favicon not found")
+async def favicon(request: Request):
+    return static_assets.response(request, "assets", "favicon.ico", STATIC_CACHE_CONTROL)
 
 @app.get("/site.webmanifest", include_in_schema=False)
-async def site_manifest():
-    manifest_path = os.path.join(FRONTEND_DIR, "assets", "site.webmanifest")
-    if os.path.exists(manifest_path):
-        return FileResponse(manifest_path, media_type="application/manifest+json")
-    raise HTTPException(status_code=404, detail="Manifest not found")
+async def site_manifest(request: Request):
+    return static_assets.response(request, "assets", "site.webmanifest", STATIC_CACHE_CONTROL)
 
 @app.get("/og-image.jpg", include_in_schema=False)
-async def serve_og_image():
-    path = os.path.join(FRONTEND_DIR, "assets", "og-image.jpg")
-    if os.path.exists(path):
-        return FileResponse(path, media_type="image/jpeg")
-    raise HTTPException(status_code=404, detail="OG image not found")
+async def serve_og_image(request: Request):
+    return static_assets.response(request, "assets", "og-image.jpg", STATIC_CACHE_CONTROL)
 
 @app.get("/reload", include_in_schema=False)
 async def reload():
     async def event_stream():
-        last = frontend_last_change
+        last = static_assets.last_change
         while True:
-            if frontend_last_change > last:
-                last = frontend_last_change
+            if static_assets.last_change > last:
+                last = static_assets.last_change
                 yield "data: reload\n\n"
             await asyncio.sleep(0.5)
     return StreamingResponse(event_stream(), media_type="text/event-stream")
@@ -379,35 +298,44 @@ async def serve_invoice_page(invoice_id: str):
 
 @app.get("/@{username}", include_in_schema=False)
 @app.get("/@{username}/", include_in_schema=False)
-async def serve_paylink_page(username: str):
+async def serve_paylink_page(username: str, request: Request):
     """Serve paylink.html for any /@username"""
     username = username.strip().lower()
-    paylink_path = os.path.join(FRONTEND_DIR, "paylink.html")
 
-    if not os.path.exists(paylink_path):
+    if not paylink_shell.loaded:
         raise HTTPException(status_code=404, detail="Paylink page not found")
 
-    with open(paylink_path, "r", encoding="utf-8") as f:
-        html_content = f.read()
-
-    assert settings.BACKEND_URL, "BACKEND_URL must be set in production"
+    # Same cached payload the API serves; on any failure the page falls
+    # back to fetching it (and shows the API's error)
+    paylink_data = None
+    if settings.PAYLINK_EMBED_DATA:
+        try:
+            paylink_data = await paylink_router.resolve_public_paylink(username)
+        except HTTPException:
+            pass
+        except Exception as e:
+            logger.warning(f"Paylink @{username} not embedded: {e}")
+    data_json = json_for_script(paylink_data)
+
+    # Revalidated on every visit, but an unchanged page costs a 304
+    etag = paylink_shell.etag(username, PAYLINK_API_BASE, data_json)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, no-cache",
+        "X-Content-Type-Options": "nosniff"
+    }
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
 
     inject_script = f"""
     <script>
-        window.PAYLINK_USERNAME = "{username}";
-        window.PAYLINK_API_BASE = "{settings.BACKEND_URL.rstrip('/')}/api/paylinks";
+        window.PAYLINK_USERNAME = {json_for_script(username)};
+        window.PAYLINK_API_BASE = {json_for_script(PAYLINK_API_BASE)};
+        window.PAYLINK_DATA = {data_json};
     </script>
-    """
+"""
 
-    html_content = html_content.replace("</head>", inject_script + "\n</head>")
-
-    return HTMLResponse(
-        html_content,
-        headers={
-            "Cache-Control": "no-cache, no-store, must-revalidate",
-            "X-Content-Type-Options": "nosniff"
-        }
-    )
+    return HTMLResponse(paylink_shell.render(inject_script), headers=headers)
 
 @app.get("/", include_in_schema=False)
 async def serve_index():
@@ -509,6 +437,12 @@ async def startup_event():
 @app.on_event("startup")
 async def start_background_tasks():
     """Start all background async tasks"""
+    loaded = await asyncio.to_thread(static_assets.load)
+    logger.info(f"✅ Static assets cached: {loaded} files")
+    if settings.DEBUG:
+        asyncio.create_task(static_assets.watch())
+        logger.info("👀 Frontend file watcher started")
+
     asyncio.create_task(repeat_purge_forever())
     asyncio.create_task(reminder_loop())
     logger.info("✅ Reminder loop started")
@@ -519,43 +453,47 @@ async def start_background_tasks():
     asyncio.create_task(marketing_loop())
     logger.info("✅ Marketing loop started")
 
+    asyncio.create_task(crm_aggregator.run_forever())
+    logger.info("✅ CRM aggregator started")
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await crm_aggregator.flush()
+    await close_smtp_pools()
+    await close_resend_clients()
+    receipt_renderer.shutdown()
+    await logo_cache.close()
+    log_listener.stop()
+
 # ------------------------------------------------------------
 # 12. REQUEST LOGGING MIDDLEWARE
 # ------------------------------------------------------------
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
-    logger.info(f"➡️ {request.client.host} {request.method} {request.url.path}")
-    try:
-        response = await call_next(request)
-    except Exception as e:
-        logger.exception(f"💥 Exception during {request.method} {request.url.path}: {e}")
-        raise
-    logger.info(f"⬅️ {request.method} {request.url.path} → {response.status_code}")
+    started = time.perf_counter()
+    with firestore_usage.accounting() as usage:
+        try:
+            response = await call_next(request)
+        except Exception:
+            access_log.record(request, 500, started, exc_info=True)
+            _observe_request(request, 500, started, usage)
+            raise
+    access_log.record(request, response.status_code, started)
+    _observe_request(request, response.status_code, started, usage)
+
+    if settings.FIRESTORE_USAGE_HEADERS:
+        response.headers["X-Firestore-Reads"] = str(usage.reads)
+        response.headers["X-Firestore-Writes"] = str(usage.writes)
     return response
 
-# ------------------------------------------------------------
-# 13. FRONTEND RELOAD WATCHER (DEV ONLY)
-# ------------------------------------------------------------
-frontend_last_change = time.time()
 
-def watch_frontend():
-    global frontend_last_change
-    last_mtime = 0
-    
-    while True:
-        try:
-            for root, dirs, files in os.walk(FRONTEND_DIR):
-                for f in files:
-                    path = os.path.join(root, f)
-                    mtime = os.path.getmtime(path)
-                    if mtime > last_mtime:
-                        last_mtime = mtime
-                        frontend_last_change = time.time()
-        except Exception as e:
-            logger.error(f"Watch error: {e}")
-        time.sleep(1)
-
-if settings.DEBUG:
-    thread = threading.Thread(target=watch_frontend, daemon=True)
-    thread.start()
-    logger.info("👀 Frontend file watcher started")
+def _observe_request(request: Request, status_code: int, started: float, usage) -> None:
+    # Label by route template (/api/invoices/{invoice_id}), never the raw path
+    route = request.scope.get("route")
+    template = getattr(route, "path", None) or "unmatched"
+    seconds = time.perf_counter() - started
+    metrics.http_request_duration.observe((request.method, template, str(status_code)), seconds)
+    firestore_usage.check_budget(
+        f"{request.method} {template}", usage, seconds * 1000,
+        settings.FIRESTORE_REQUEST_READ_BUDGET, settings.FIRESTORE_SLOW_REQUEST_MS,
+    )
@@ -1,9 +1,13 @@
+import argparse
 import asyncio
 import logging
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 import firebase_admin
 from firebase_admin import firestore, credentials
 from app.core.firebase import db
+from app.utils.firebase import stream_pages
 logger = logging.getLogger("payla")
 
 # Firestore client
@@ -14,55 +18,176 @@ except Exception as e:
     logger.error(f"❌ Failed to initialize Firestore client: {e}")
     raise
 
-from app.routers.payout_router import queue_payout
+from app.routers.payout_router import build_payout_entry, payout_source_update
 
 # Setup logging to see what's happening in terminal
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("payla_sync")
 db = firestore.client()
 
-async def sync_missing_invoice_payouts():
-    print("🚀 Starting manual sync for paid invoices...")
-    
-    # 1. Find all paid invoices
-    invoices = db.collection("invoices").where("status", "==", "paid").stream()
-    
-    synced_count = 0
-    found_count = 0
-    
-    for inv in invoices:
-        found_count += 1
-        data = inv.to_dict()
-        reference = data.get("transaction_reference")
-        user_id = data.get("sender_id")
-        amount = data.get("amount", 0)
-        
-        if not reference or not user_id:
-            print(f"⚠️ Skipping Invoice {inv.id}: Missing reference or user_id")
-            continue
-
-        # 2. Check if this transaction is already in the payout ledger
-        payout_check = db.collection("payouts").document(reference).get()
-        
-        if not payout_check.exists:
-            print(f"🔄 Syncing missing payout for Invoice: {inv.id} (Amount: ₦{amount})")
-            
-            # 3. Trigger the logic to update user balance and payout history
-            await queue_payout(
-                user_id=user_id,
-                amount=amount,
-                reference=reference,
-                payout_type="invoice",
-                manual_payout=False
+PAGE_SIZE = 300     # Source documents (and payout lookups) per page
+PAYOUTS_PER_BATCH = 200  # 2 writes per payout + the user increment, under the 500-write batch limit
+WRITE_CONCURRENCY = 8    # Batches committed in parallel (each touches a single user)
+
+# payout_type -> (collection, paid status, fields fetched)
+SOURCES = {
+    "invoice": ("invoices", "paid", ["transaction_reference", "sender_id", "amount"]),
+    "paylink": ("paylink_transactions", "success", ["user_id", "amount", "amount_requested"]),
+}
+
+
+def _source_row(payout_type, doc):
+    data = doc.to_dict() or {}
+    if payout_type == "invoice":
+        return data.get("transaction_reference"), data.get("sender_id"), data.get("amount", 0)
+    # Paylink transactions are keyed by their Paystack reference
+    return doc.id, data.get("user_id"), data.get("amount", data.get("amount_requested", 0))
+
+
+def _missing_references(references):
+    """References with no payouts/{reference} document, via one get_all."""
+    refs = [db.collection("payouts").document(r) for r in references]
+    if not refs:
+        return set()
+    return {snap.id for snap in db.get_all(refs, field_paths=["status"]) if not snap.exists}
+
+
+def reconcile(now):
+    """
+    Stream paid invoices and successful paylink transactions and build, in
+    memory, every payout entry that is missing plus the per-user deltas.
+    """
+    plan = {
+        "entries": [],    # (reference, user_id, payout_type, amount, source_ref)
+        "deltas": defaultdict(lambda: {"total_earned": 0, "total_invoice_revenue": 0, "total_paylink_revenue": 0}),
+        "scanned": defaultdict(int),
+        "skipped": defaultdict(int),
+    }
+    seen = set()
+
+    for payout_type, (collection, status, fields) in SOURCES.items():
+        query = db.collection(collection).where("status", "==", status)
+        for page in stream_pages(query, PAGE_SIZE, fields):
+            rows = []
+            for doc in page:
+                plan["scanned"][payout_type] += 1
+                reference, user_id, amount = _source_row(payout_type, doc)
+                if not reference or not user_id:
+                    print(f"⚠️ Skipping {payout_type} {doc.id}: Missing reference or user_id")
+                    plan["skipped"][payout_type] += 1
+                    continue
+                if reference in seen:
+                    continue
+                seen.add(reference)
+                rows.append((reference, user_id, amount or 0, doc.reference))
+
+            missing = _missing_references([r[0] for r in rows])
+            for reference, user_id, amount, source_ref in rows:
+                if reference not in missing:
+                    continue
+                plan["entries"].append((reference, user_id, payout_type, amount, source_ref))
+                delta = plan["deltas"][user_id]
+                delta["total_earned"] += amount
+                delta[f"total_{payout_type}_revenue"] += amount
+
+    return plan
+
+
+def _commit_user_batch(user_id, entries, now):
+    """
+    Create a user's payouts, mark their sources, and increment the user's
+    totals by exactly those payouts, in one atomic batch. Payouts are
+    created (not set), so a payout written since reconcile() aborts the
+    whole batch instead of being counted twice.
+    """
+    batch = db.batch()
+    delta = {"total_earned": 0, "total_invoice_revenue": 0, "total_paylink_revenue": 0}
+    for reference, _, payout_type, amount, source_ref in entries:
+        batch.create(
+            db.collection("payouts").document(reference),
+            build_payout_entry(user_id, amount, reference, payout_type, False, now)
+        )
+        batch.set(source_ref, payout_source_update(False, now), merge=True)
+        delta["total_earned"] += amount
+        delta[f"total_{payout_type}_revenue"] += amount
+
+    updates = {k: firestore.Increment(v) for k, v in delta.items() if v}
+    updates.update({"last_payout_at": now, "updated_at": now})
+    batch.update(db.collection("users").document(user_id), updates)
+    batch.commit()
+
+
+def apply(plan, now):
+    """
+    Write the reconciled payouts with one atomic batch per user (split every
+    PAYOUTS_PER_BATCH payouts), so a payout and its balance increment always
+    land together. Returns the batches that failed and wrote nothing.
+    """
+    by_user = defaultdict(list)
+    for entry in plan["entries"]:
+        by_user[entry[1]].append(entry)
+
+    batches = [
+        (user_id, entries[i:i + PAYOUTS_PER_BATCH])
+        for user_id, entries in by_user.items()
+        for i in range(0, len(entries), PAYOUTS_PER_BATCH)
+    ]
+
+    def commit(job):
+        user_id, entries = job
+        try:
+            _commit_user_batch(user_id, entries, now)
+            return None
+        except Exception as e:
+            references = ", ".join(entry[0] for entry in entries)
+            print(f"❌ Batch for user {user_id} failed ({references}): {e}")
+            return job
+
+    with ThreadPoolExecutor(max_workers=WRITE_CONCURRENCY) as pool:
+        return [job for job in pool.map(commit, batches) if job is not None]
+
+
+def print_report(plan, dry_run):
+    print(f"\n--- SYNC {'DRY RUN' if dry_run else 'COMPLETE'} ---")
+    for payout_type in SOURCES:
+        missing = sum(1 for e in plan["entries"] if e[2] == payout_type)
+        print(
+            f"{payout_type.capitalize()}s scanned: {plan['scanned'][payout_type]} | "
+            f"skipped: {plan['skipped'][payout_type]} | missing payouts: {missing}"
+        )
+
+    if dry_run:
+        for reference, user_id, payout_type, amount, _ in plan["entries"]:
+            print(f"  + payouts/{reference} ({payout_type}) user={user_id} ₦{amount}")
+        for user_id, delta in plan["deltas"].items():
+            changes = ", ".join(f"{k} +{v}" for k, v in delta.items() if v)
+            print(f"  ~ users/{user_id}: {changes}")
+
+    print(f"{'Payouts to create' if dry_run else 'New Payouts Created'}: {len(plan['entries'])}")
+    print(f"Users {'to update' if dry_run else 'updated'}: {len(plan['deltas'])}")
+
+
+async def sync_missing_invoice_payouts(dry_run: bool = False):
+    print(f"🚀 Starting payout reconciliation{' (dry run)' if dry_run else ''}...")
+    now = datetime.now(timezone.utc)
+
+    plan = await asyncio.to_thread(reconcile, now)
+    if not dry_run and plan["entries"]:
+        failures = await asyncio.to_thread(apply, plan, now)
+        if failures:
+            payouts = sum(len(entries) for _, entries in failures)
+            print(
+                f"⚠️ {len(failures)} batches ({payouts} payouts) failed and were not written; "
+                f"re-running retries exactly those payouts"
             )
-            synced_count += 1
-        else:
-            print(f"✅ Invoice {inv.id} already exists in payouts. Skipping.")
-            
-    print(f"\n--- SYNC COMPLETE ---")
-    print(f"Total Paid Invoices Found: {found_count}")
-    print(f"New Payouts Created: {synced_count}")
+
+    print_report(plan, dry_run)
+    return plan
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill missing payout ledger entries")
+    parser.add_argument("--dry-run", action="store_true", help="Print the diff without writing")
+    args = parser.parse_args()
+
     # This is the line that actually starts the script!
-    asyncio.run(sync_missing_invoice_payouts())
\ No newline at end of file
+    asyncio.run(sync_missing_invoice_payouts(dry_run=args.dry_run))
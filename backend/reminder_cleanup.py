@@ -1,68 +1,100 @@
+import argparse
 import asyncio
+import time
+from collections import Counter
 from datetime import datetime, timezone
 import logging
 from app.core.firebase import db
+from app.utils.firebase import stream_pages, new_bulk_writer
+from app.core.metrics import track_run
 
 logger = logging.getLogger("payla")
 
+PAGE_SIZE = 500            # Reminders fetched per page
+PROGRESS_EVERY = 10        # Log progress every N pages
+
 # --- PURGE LOGIC ---
 
-async def purge_locked_and_old_reminders():
+def _invoice_statuses(invoice_ids) -> dict:
+    """Batch-read invoice statuses for one page (missing invoices map to None)."""
+    refs = [db.collection("invoices").document(i) for i in invoice_ids]
+    if not refs:
+        return {}
+    statuses = {}
+    for snap in db.get_all(refs, field_paths=["status"]):
+        statuses[snap.id] = (snap.to_dict() or {}).get("status", "").lower() if snap.exists else None
+    return statuses
+
+
+def _purge(now: datetime, dry_run: bool) -> dict:
+    stats = Counter()
+    started = time.monotonic()
+    seen = set()
+    writer = None if dry_run else new_bulk_writer(
+        db, on_error=lambda failure: stats.update(["failed"])
+    )
+
+    def delete(doc):
+        seen.add(doc.id)
+        stats["deleted"] += 1
+        if writer is not None:
+            writer.delete(doc.reference)
+
+    def progress(pass_name, pages):
+        if pages % PROGRESS_EVERY == 0:
+            logger.info(
+                f"🧹 Purge {pass_name}: {pages} pages | {stats['deleted']} "
+                f"{'would be ' if dry_run else ''}deleted | {time.monotonic() - started:.1f}s"
+            )
+
+    try:
+        # Pass 1: Handle reminders left behind by an expired lease
+        locked = db.collection("reminders").where("lease_expires_at", "<", now)
+        for pages, page in enumerate(stream_pages(locked, PAGE_SIZE, ["invoice_id", "lease_expires_at"]), start=1):
+            invoice_of = {doc.id: (doc.to_dict() or {}).get("invoice_id") for doc in page}
+            statuses = _invoice_statuses({i for i in invoice_of.values() if i})
+            for doc in page:
+                invoice_id = invoice_of[doc.id]
+                if invoice_id:
+                    status = statuses.get(invoice_id)
+                    stats["lease_" + ("invoice_missing" if status is None else "invoice_" + (status or "unknown"))] += 1
+                delete(doc)
+            progress("expired leases", pages)
+
+        # Pass 2: Final cleanup for ANY reminder older than 'now'
+        old = db.collection("reminders").where("next_send", "<", now)
+        for pages, page in enumerate(stream_pages(old, PAGE_SIZE, ["next_send"]), start=1):
+            for doc in page:
+                if doc.id not in seen:
+                    stats["past_due"] += 1
+                    delete(doc)
+            progress("past due", pages)
+    finally:
+        if writer is not None:
+            writer.close()  # Flushes and waits for all pending deletes
+
+    stats["elapsed_ms"] = int((time.monotonic() - started) * 1000)
+    return dict(stats)
+
+
+async def purge_locked_and_old_reminders(dry_run: bool = False):
     """
     Specifically targets:
-    1. Reminders where 'locked' is True.
+    1. Reminders whose processing lease expired (worker died mid-send).
     2. Reminders for invoices that are already PAID.
     3. Reminders where 'next_send' is in the past.
+    With dry_run=True nothing is deleted; counts are reported only.
     """
-    logger.info("🚀 Starting deep purge of reminders...")
+    logger.info(f"🚀 Starting deep purge of reminders{' (dry run)' if dry_run else ''}...")
     now = datetime.utcnow().replace(tzinfo=timezone.utc)
-    
-    deleted_count = 0
-    batch = db.batch()
-    batch_counter = 0
-
-    # Pass 1: Handle Locked Reminders
-    locked_reminders = db.collection("reminders").where("locked", "==", True).stream()
-    for doc in locked_reminders:
-        rem_data = doc.to_dict()
-        invoice_id = rem_data.get("invoice_id")
-        
-        if invoice_id:
-            inv_doc = db.collection("invoices").document(invoice_id).get()
-            if inv_doc.exists:
-                inv_status = inv_doc.to_dict().get("status", "").lower()
-                if inv_status == "paid":
-                    logger.info(f"Purging reminder {doc.id} (Invoice {invoice_id} is PAID)")
-                else:
-                    logger.info(f"Purging stuck locked reminder {doc.id} (Invoice {invoice_id} is {inv_status})")
-            else:
-                logger.info(f"Purging reminder {doc.id} (Invoice {invoice_id} no longer exists)")
-
-        batch.delete(doc.reference)
-        deleted_count += 1
-        batch_counter += 1
-        
-        if batch_counter >= 400:
-            batch.commit()
-            batch = db.batch()
-            batch_counter = 0
-
-    # Pass 2: Final cleanup for ANY reminder older than 'now'
-    old_reminders = db.collection("reminders").where("next_send", "<", now).stream()
-    for doc in old_reminders:
-        batch.delete(doc.reference)
-        deleted_count += 1
-        batch_counter += 1
-        if batch_counter >= 400:
-            batch.commit()
-            batch = db.batch()
-            batch_counter = 0
-
-    if batch_counter > 0:
-        batch.commit()
-
-    logger.info(f"✅ Purge complete. Removed {deleted_count} total reminders.")
-    return deleted_count
+
+    stats = await asyncio.to_thread(_purge, now, dry_run)
+
+    logger.info(
+        f"✅ Purge complete{' (dry run)' if dry_run else ''}. "
+        f"{'Would remove' if dry_run else 'Removed'} {stats.get('deleted', 0)} total reminders | {stats}"
+    )
+    return stats.get("deleted", 0) - stats.get("failed", 0)
 
 # --- REPEAT LOGIC ---
 
@@ -70,10 +102,20 @@ async def repeat_purge_forever():
     """Loop that runs once every 24 hours."""
     while True:
         try:
-            await purge_locked_and_old_reminders()
+            with track_run("purge"):
+                await purge_locked_and_old_reminders()
         except Exception as e:
             logger.error(f"Error in background purge loop: {e}")
         
         # Wait 24 hours (86400 seconds)
         logger.info("Purge loop sleeping for 24 hours...")
-        await asyncio.sleep(86400)
\ No newline at end of file
+        await asyncio.sleep(86400)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Purge stale reminders")
+    parser.add_argument("--dry-run", action="store_true", help="Report counts without deleting")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(purge_locked_and_old_reminders(dry_run=args.dry_run))